@@ -0,0 +1,171 @@
+import json
+import os
+import threading
+from hashlib import sha1
+
+__all__ = ('ArtifactStore', 'HTTPStore', 'LocalStore', 'open_store')
+
+def open_store(location):
+    """Returns the store at ``location``, either a url or a directory."""
+
+    if location.startswith(('http://', 'https://')):
+        return HTTPStore(location)
+    else:
+        return LocalStore(location)
+
+class ArtifactStore(object):
+    """A store of task results. The output files of a task are stored as
+    blobs addressed by their sha1 hash, and a manifest listing them is stored
+    under the fingerprint of the task, so that outputs shared by many results
+    are stored once. Stores raise EnvironmentError when they fail."""
+
+    def get_blob(self, hexhash):
+        raise NotImplementedError()
+
+    def get_manifest(self, key):
+        raise NotImplementedError()
+
+    def has_blob(self, hexhash):
+        return self.get_blob(hexhash) is not None
+
+    def put_blob(self, hexhash, data):
+        raise NotImplementedError()
+
+    def put_manifest(self, key, manifest):
+        raise NotImplementedError()
+
+    def restore(self, key):
+        """Restores the outputs recorded under ``key``, relative to the
+        current directory, returning the number of files restored or None if
+        there is no such manifest."""
+
+        manifest = self.get_manifest(key)
+        if manifest is None:
+            return None
+
+        # every blob is retrieved and verified before any file is written
+        outputs = []
+        for filepath, hexhash, mode in manifest['outputs']:
+            if os.path.isabs(filepath) or os.path.normpath(filepath).split(os.sep)[0] == '..':
+                raise ValueError('invalid output %r' % filepath)
+            data = self.get_blob(hexhash)
+            if data is None or sha1(data).hexdigest() != hexhash:
+                return None
+            outputs.append((filepath, data, mode))
+
+        for filepath, data, mode in outputs:
+            directory = os.path.dirname(filepath)
+            if directory and not os.path.isdir(directory):
+                os.makedirs(directory)
+            _write_atomically(filepath, data)
+            os.chmod(filepath, mode)
+        return len(outputs)
+
+    def store(self, key, files):
+        """Stores ``files``, a list of ``(filepath, hexhash)`` pairs relative
+        to the current directory, under ``key``."""
+
+        outputs = []
+        for filepath, hexhash in files:
+            if not self.has_blob(hexhash):
+                with open(filepath, 'rb') as openfile:
+                    self.put_blob(hexhash, openfile.read())
+            outputs.append([filepath, hexhash, os.stat(filepath).st_mode & 0777])
+        self.put_manifest(key, {'outputs': outputs})
+
+class LocalStore(ArtifactStore):
+    """An artifact store in a local directory, which may be shared by the
+    builds on one machine or mounted by several."""
+
+    def __init__(self, directory):
+        self.directory = os.path.abspath(directory)
+
+    def get_blob(self, hexhash):
+        return self._read(self._blobpath(hexhash))
+
+    def get_manifest(self, key):
+        content = self._read(self._manifestpath(key))
+        if content is not None:
+            return json.loads(content)
+
+    def has_blob(self, hexhash):
+        return os.path.exists(self._blobpath(hexhash))
+
+    def put_blob(self, hexhash, data):
+        self._write(self._blobpath(hexhash), data)
+
+    def put_manifest(self, key, manifest):
+        self._write(self._manifestpath(key), json.dumps(manifest, sort_keys=True))
+
+    def _blobpath(self, hexhash):
+        return os.path.join(self.directory, 'blobs', hexhash[:2], hexhash[2:])
+
+    def _manifestpath(self, key):
+        return os.path.join(self.directory, 'manifests', key)
+
+    def _read(self, filepath):
+        try:
+            with open(filepath, 'rb') as openfile:
+                return openfile.read()
+        except IOError:
+            return None
+
+    def _write(self, filepath, data):
+        directory = os.path.dirname(filepath)
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                if not os.path.isdir(directory):
+                    raise
+        _write_atomically(filepath, data)
+
+class HTTPStore(ArtifactStore):
+    """An artifact store behind an http server, which retrieves blobs and
+    manifests with GET and stores them with PUT, under ``blobs/`` and
+    ``manifests/`` beneath ``url``."""
+
+    def __init__(self, url, timeout=30):
+        self.timeout = timeout
+        self.url = url.rstrip('/')
+
+    def get_blob(self, hexhash):
+        return self._request('GET', 'blobs/%s' % hexhash)
+
+    def get_manifest(self, key):
+        content = self._request('GET', 'manifests/%s' % key)
+        if content is not None:
+            return json.loads(content)
+
+    def has_blob(self, hexhash):
+        return self._request('HEAD', 'blobs/%s' % hexhash) is not None
+
+    def put_blob(self, hexhash, data):
+        self._request('PUT', 'blobs/%s' % hexhash, data)
+
+    def put_manifest(self, key, manifest):
+        self._request('PUT', 'manifests/%s' % key, json.dumps(manifest, sort_keys=True))
+
+    def _request(self, method, resource, data=None):
+        import urllib2
+        request = urllib2.Request('%s/%s' % (self.url, resource), data)
+        request.get_method = lambda: method
+        if data is not None:
+            request.add_header('Content-Type', 'application/octet-stream')
+
+        try:
+            response = urllib2.urlopen(request, timeout=self.timeout)
+        except urllib2.HTTPError, exception:
+            if exception.code == 404:
+                return None
+            raise
+        try:
+            return response.read()
+        finally:
+            response.close()
+
+def _write_atomically(filepath, data):
+    temporary = '%s.%d.%d.tmp' % (filepath, os.getpid(), threading.current_thread().ident)
+    with open(temporary, 'wb') as openfile:
+        openfile.write(data)
+    os.rename(temporary, filepath)
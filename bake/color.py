@@ -1,4 +1,5 @@
 import re
+from threading import Lock
 
 try:
     import colorama
@@ -19,8 +20,80 @@ else:
 
 TokenPattern = re.compile(r'\[!([bcgmryBCGMRY])?\]')
 
-def _replace_tokens(match):
-    token = match.group(1)
+class LRUCache(object):
+    """A mapping of at most ``maxsize`` entries, which discards the least
+    recently used entry to make room for another."""
+
+    def __init__(self, maxsize=1024):
+        self.entries = {}
+        self.lock = Lock()
+        self.maxsize = maxsize
+
+        # a circular doubly linked list of [previous, next, key, value] links,
+        # ordered from least to most recently used
+        self.root = root = []
+        root[:] = [root, root, None, None]
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key, default=None):
+        with self.lock:
+            link = self.entries.get(key)
+            if link is None:
+                return default
+
+            previous, next, key, value = link
+            previous[1] = next
+            next[0] = previous
+
+            root = self.root
+            last = root[0]
+            last[1] = root[0] = link
+            link[0] = last
+            link[1] = root
+            return value
+
+    def put(self, key, value):
+        with self.lock:
+            if key in self.entries:
+                self.entries[key][3] = value
+                return
+
+            root = self.root
+            if len(self.entries) >= self.maxsize:
+                oldest = root[1]
+                root[1] = oldest[1]
+                oldest[1][0] = root
+                del self.entries[oldest[2]]
+
+            last = root[0]
+            link = [last, root, key, value]
+            last[1] = root[0] = self.entries[key] = link
+
+class Template(object):
+    """A message with its color tokens parsed out, rendered both with and
+    without color."""
+
+    __slots__ = ('colored', 'plain')
+
+    def __init__(self, value):
+        # splitting on the pattern alternates text with the captured token,
+        # which is None for a reset
+        segments = TokenPattern.split(value)
+        self.plain = ''.join(segments[::2])
+
+        self.colored = None
+        if colorama:
+            rendered = [segments[0]]
+            for i in range(1, len(segments), 2):
+                rendered.append(_render_token(segments[i]))
+                rendered.append(segments[i + 1])
+            self.colored = ''.join(rendered)
+
+Templates = LRUCache(4096)
+
+def _render_token(token):
     if not token:
         return Style.RESET_ALL
 
@@ -31,10 +104,17 @@ def _replace_tokens(match):
         return replacement
 
 def ansify(value, colorize=False, reset=True):
-    if colorama and colorize:
-        value = TokenPattern.sub(_replace_tokens, value)
-        if reset:
-            value = value + Reset
-        return value
-    else:
-        return TokenPattern.sub('', value)
+    colorize = colorize and colorama
+    if '[!' in value:
+        template = Templates.get(value)
+        if template is None:
+            template = Template(value)
+            Templates.put(value, template)
+
+        if not colorize:
+            return template.plain
+        value = template.colored
+
+    if colorize and reset:
+        value = value + Reset
+    return value
@@ -0,0 +1,91 @@
+import struct
+import zlib
+from collections import deque
+from multiprocessing.pool import ThreadPool
+from time import time
+
+try:
+    import lzma
+except ImportError:
+    try:
+        from backports import lzma
+    except ImportError:
+        lzma = None
+
+__all__ = ('ParallelCompressor', 'supports_parallel_compression')
+
+def compress_gzip_member(data, level=6):
+    """Compresses ``data`` as a complete gzip member; a sequence of members
+    forms a valid gzip stream."""
+
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+    body = compressor.compress(data) + compressor.flush()
+
+    header = '\x1f\x8b\x08\x00' + struct.pack('<L', int(time())) + '\x00\xff'
+    trailer = struct.pack('<LL', zlib.crc32(data) & 0xffffffff, len(data) & 0xffffffff)
+    return header + body + trailer
+
+def compress_xz_stream(data, level=6):
+    """Compresses ``data`` as a complete xz stream; a sequence of streams
+    forms a valid xz file."""
+
+    return lzma.compress(data, format=lzma.FORMAT_XZ, preset=level)
+
+COMPRESSORS = {'gz': compress_gzip_member}
+if lzma:
+    COMPRESSORS['xz'] = compress_xz_stream
+
+def supports_parallel_compression(compression):
+    return compression in COMPRESSORS
+
+class ParallelCompressor(object):
+    """A writable file object which compresses what is written to it in
+    independent blocks on a pool of threads, writing the compressed blocks
+    to ``fileobj`` in order."""
+
+    def __init__(self, fileobj, compression='gz', workers=2, level=6,
+            blocksize=1048576):
+
+        self.blocks = 0
+        self.blocksize = blocksize
+        self.buffer = []
+        self.buffered = 0
+        self.compress = COMPRESSORS[compression]
+        self.fileobj = fileobj
+        self.level = level
+        self.pending = deque()
+        self.pool = ThreadPool(workers)
+        self.workers = workers
+
+    def close(self):
+        if self.pool is None:
+            return
+        try:
+            if self.buffered or not self.blocks:
+                self._submit()
+            self._drain(0)
+        finally:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
+    def flush(self):
+        self.fileobj.flush()
+
+    def write(self, data):
+        self.buffer.append(data)
+        self.buffered += len(data)
+        if self.buffered >= self.blocksize:
+            self._submit()
+            self._drain(self.workers * 2)
+
+    def _drain(self, limit):
+        while len(self.pending) > limit:
+            self.fileobj.write(self.pending.popleft().get())
+
+    def _submit(self):
+        data = ''.join(self.buffer)
+        self.buffer = []
+        self.buffered = 0
+        self.blocks += 1
+        self.pending.append(self.pool.apply_async(self.compress, (data, self.level)))
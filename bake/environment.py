@@ -1,6 +1,8 @@
 import os
 import re
+from itertools import count
 from pprint import pformat
+from threading import Lock
 
 from bake.util import recursive_merge
 from scheme.formats import Format, StructuredText
@@ -9,15 +11,50 @@ __all__ = ('Environment', 'EnvironmentStack')
 
 null = object()
 
+# advanced whenever an environment belonging to a stack is modified, which
+# invalidates the lookups cached by every stack; the lock orders the advance
+# against the storing of lookups which began before it
+_generations = count(1)
+_generation = 0
+_lock = Lock()
+
+# identifies each environment for as long as the process runs, unlike id()
+_serials = count(1)
+
 class Environment(object):
-    """A bake runtime environment."""
+    """A bake runtime environment. Dotted paths are resolved through a flat
+    index of the environment, which is built on first use and discarded by
+    ``set`` and ``merge``; the environment should not be modified otherwise
+    once it has been queried."""
 
     def __init__(self, environment=None):
+        self._lock = Lock()
+        self._serial = next(_serials)
+        self._stacked = False
+        self._version = 0
         self.environment = environment or {}
 
     def __repr__(self):
         return 'Environment(%r)' % self.environment
 
+    @property
+    def environment(self):
+        return self._environment
+
+    @environment.setter
+    def environment(self, value):
+        with self._lock:
+            self._environment = value
+            self._invalidate()
+
+    @property
+    def serial(self):
+        return self._serial
+
+    @property
+    def version(self):
+        return self._version
+
     def dump(self):
         return pformat(self.environment)
 
@@ -25,54 +62,55 @@ class Environment(object):
         if '.' not in path:
             return self.environment.get(path, default)
 
+        found = self._found
+        if path in found:
+            value = found[path]
+            if value is null:
+                return default
+            return value
+
+        index = self._index
+        if index is None:
+            index = self._build_index()
+
         tokens, name = path.rsplit('.', 1)
         while True:
-            value = self.get('%s.%s' % (tokens, name), null)
+            value = index.get('%s.%s' % (tokens, name), null)
             if value is not null:
-                return value
+                break
             if '.' in tokens:
                 tokens = tokens.rsplit('.', 1)[0]
             else:
-                return self.environment.get(name, default)
+                value = self.environment.get(name, null)
+                break
+
+        found[path] = value
+        if value is null:
+            return default
+        return value
 
     def get(self, path, default=None):
         if '.' not in path:
             return self.environment.get(path, default)
 
-        tokens = path.split('.')
-        tail = tokens.pop()
-
-        ref = self.environment
-        for token in tokens:
-            if token in ref:
-                ref = ref[token]
-                if not isinstance(ref, dict):
-                    return default
-            else:
-                return default
-        else:
-            return ref.get(tail, default)
+        index = self._index
+        if index is None:
+            index = self._build_index()
+        return index.get(path, default)
 
     def has(self, path):
         if '.' not in path:
             return (path in self.environment)
 
-        tokens = path.split('.')
-        tail = tokens.pop()
-
-        ref = self.environment
-        for token in tokens:
-            if token in ref:
-                ref = ref[token]
-                if not isinstance(ref, dict):
-                    return False
-            else:
-                return False
-        else:
-            return (tail in ref)
+        index = self._index
+        if index is None:
+            index = self._build_index()
+        return (path in index)
 
     def merge(self, source):
-        recursive_merge(self.environment, source)
+        with self._lock:
+            recursive_merge(self.environment, source)
+            self._invalidate()
         return self
 
     def overlay(self, environment=None, **params):
@@ -101,9 +139,30 @@ class Environment(object):
         return self
 
     def set(self, path, value):
+        # the environment is invalidated once it has been modified, so that
+        # a stack cannot cache what it finds in between
+        with self._lock:
+            try:
+                self._assign(path, value)
+            finally:
+                self._invalidate()
+        return self
+
+    def underlay(self, environment=None, **params):
+        if not isinstance(environment, Environment):
+            environment = Environment(environment)
+        if params:
+            environment.environment.update(params)
+        return EnvironmentStack(self, environment)
+
+    def write(self, path, format=None, **params):
+        Format.write(path, self.environment, format, **params)
+        return self
+
+    def _assign(self, path, value):
         if '.' not in path:
             self.environment[path] = value
-            return self
+            return
 
         tokens = path.split('.')
         tail = tokens.pop()
@@ -115,47 +174,80 @@ class Environment(object):
             ref = ref[token]
             if not isinstance(ref, dict):
                 raise ValueError(path)
-
         ref[tail] = value
-        return self
-
-    def underlay(self, environment=None, **params):
-        if not isinstance(environment, Environment):
-            environment = Environment(environment)
-        if params:
-            environment.environment.update(params)
-        return EnvironmentStack(self, environment)
 
-    def write(self, path, format=None, **params):
-        Format.write(path, self.environment, format, **params)
-        return self
+    def _build_index(self):
+        # maps the dotted path of every value to the value, so that a lookup
+        # does not have to walk the nested dicts; it is built under the lock
+        # which modifications hold, so that it is never built from a partial
+        # modification nor published once it has been invalidated
+        with self._lock:
+            index = {}
+            pending = [('', self.environment)]
+            while pending:
+                prefix, environment = pending.pop()
+                for key, value in environment.iteritems():
+                    if isinstance(key, basestring) and '.' not in key:
+                        index[prefix + key] = value
+                        if isinstance(value, dict):
+                            pending.append((prefix + key + '.', value))
+
+            self._index = index
+        return index
+
+    def _invalidate(self):
+        global _generation
+        self._found = {}
+        self._index = None
+        self._version += 1
+        if self._stacked:
+            with _lock:
+                _generation = next(_generations)
 
 class EnvironmentStack(object):
+    """A stack of environments, the first taking precedence. Stacks are
+    persistent: an overlay is a new stack sharing the one beneath it, and
+    each level caches what it has looked up until an environment in any
+    stack is modified. Once a stack is deeper than ``threshold``, an overlay
+    collapses the layers above the bottom one into a single indexed layer."""
+
+    threshold = 8
+
     def __init__(self, *environments):
-        self.stack = list(environments)
+        parent = None
+        if len(environments) > 1:
+            parent = EnvironmentStack(*environments[1:])
+        self._initialize(environments[0] if environments else Environment(), parent)
+
+    @property
+    def stack(self):
+        layers, node = [], self
+        while node:
+            if isinstance(node.layer, _CompositeLayer):
+                layers.extend(node.layer.layers)
+            else:
+                layers.append(node.layer)
+            node = node.parent
+        return layers
+
+    @property
+    def version(self):
+        return _generation
 
     def find(self, path, default=None):
-        for environment in self.stack:
-            value = environment.find(path, null)
-            if value is not null:
-                return value
-        else:
+        value = self._lookup('find', path)
+        if value is null:
             return default
+        return value
 
     def get(self, path, default=None):
-        for environment in self.stack:
-            value = environment.get(path, null)
-            if value is not null:
-                return value
-        else:
+        value = self._lookup('get', path)
+        if value is null:
             return default
+        return value
 
     def has(self, path):
-        for environment in self.stack:
-            if environment.has(path):
-                return True
-        else:
-            return False
+        return self._lookup('has', path) is not null
 
     def overlay(self, environment=None, **params):
         if not isinstance(environment, Environment):
@@ -163,11 +255,13 @@ class EnvironmentStack(object):
         if params:
             environment.environment.update(params)
 
-        stack = [environment] + self.stack[:]
-        return EnvironmentStack(*stack)
+        parent = self
+        if self.depth >= self.threshold:
+            parent = self._collapse()
+        return self._push(environment, parent)
 
     def set(self, path, value):
-        self.stack[0].set(path, value)
+        self.layer.set(path, value)
         return self
 
     def underlay(self, environment=None, **params):
@@ -176,5 +270,117 @@ class EnvironmentStack(object):
         if params:
             environment.environment.update(params)
 
-        stack = self.stack[:] + [environment]
+        stack = self.stack + [environment]
         return EnvironmentStack(*stack)
+
+    def _collapse(self):
+        layers, node = [], self
+        while node.parent:
+            layers.append(node.layer)
+            node = node.parent
+        return self._push(_CompositeLayer(layers), node)
+
+    def _initialize(self, layer, parent):
+        layer._stacked = True
+        self.cache = {}
+        self.depth = (parent.depth + 1) if parent else 1
+        self.generation = _generation
+        self.layer = layer
+        self.parent = parent
+
+    def _lookup(self, method, path):
+        key = (method, path)
+        generation = _generation
+
+        visited, node, value = [], self, null
+        while node:
+            if node.generation == generation and key in node.cache:
+                value = node.cache[key]
+                break
+
+            visited.append(node)
+            if method == 'has':
+                if node.layer.has(path):
+                    value = True
+            else:
+                value = getattr(node.layer, method)(path, null)
+            if value is not null:
+                break
+            node = node.parent
+
+        # a value found before a modification is stale once it is made
+        with _lock:
+            if generation == _generation:
+                for node in visited:
+                    if node.generation != generation:
+                        node.cache = {}
+                        node.generation = generation
+                    node.cache[key] = value
+        return value
+
+    @classmethod
+    def _push(cls, layer, parent):
+        stack = cls.__new__(cls)
+        stack._initialize(layer, parent)
+        return stack
+
+class _CompositeLayer(object):
+    # a sequence of environments indexed as one, mapping each path to the
+    # position of the first environment which has it and its value there
+    def __init__(self, environments):
+        self.layers = []
+        for environment in environments:
+            if isinstance(environment, _CompositeLayer):
+                self.layers.extend(environment.layers)
+            else:
+                self.layers.append(environment)
+
+        self.generation = None
+        self.index = None
+        self._stacked = True
+
+    def find(self, path, default=None):
+        index = self._get_index()
+        if '.' not in path:
+            return index.get(path, (None, default))[1]
+
+        candidates, (tokens, name) = [], path.rsplit('.', 1)
+        while True:
+            candidates.append('%s.%s' % (tokens, name))
+            if '.' in tokens:
+                tokens = tokens.rsplit('.', 1)[0]
+            else:
+                candidates.append(name)
+                break
+
+        # each environment in turn would try every candidate before the
+        # next environment is consulted
+        found = None
+        for i, candidate in enumerate(candidates):
+            entry = index.get(candidate)
+            if entry and (found is None or entry[0] < found[0]):
+                found = (entry[0], entry[1])
+        if found:
+            return found[1]
+        return default
+
+    def get(self, path, default=None):
+        return self._get_index().get(path, (None, default))[1]
+
+    def has(self, path):
+        return path in self._get_index()
+
+    def _get_index(self):
+        if self.index is None or self.generation != _generation:
+            generation = _generation
+            index = {}
+            for position in range(len(self.layers) - 1, -1, -1):
+                environment = self.layers[position]
+                entries = environment._index
+                if entries is None:
+                    entries = environment._build_index()
+                for key, value in entries.iteritems():
+                    index[key] = (position, value)
+            self.index = index
+            self.generation = generation
+        return self.index
@@ -0,0 +1,74 @@
+import json
+import os
+import threading
+from time import time
+
+__all__ = ('EventStream',)
+
+class EventStream(object):
+    """A stream of events, written as JSON lines to ``target``, which is
+    either a filename or a file descriptor; a descriptor is duplicated, so
+    that closing the stream leaves it open. Events are buffered and written
+    in batches once ``buffersize`` bytes have accumulated, no later than
+    ``interval`` seconds after they are emitted, and as each task event is
+    emitted."""
+
+    def __init__(self, target, buffersize=65536, interval=1.0):
+        if isinstance(target, int) or (isinstance(target, basestring) and target.isdigit()):
+            self.fileobj = os.fdopen(os.dup(int(target)), 'w', 0)
+        else:
+            self.fileobj = open(target, 'w', 0)
+
+        self.buffer = []
+        self.buffered = 0
+        self.buffersize = buffersize
+        self.flushed = time()
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.timer = None
+
+    def close(self):
+        with self.lock:
+            if self.timer:
+                self.timer.cancel()
+                self.timer = None
+            if self.fileobj:
+                self._write()
+                self.fileobj.close()
+                self.fileobj = None
+
+    def emit(self, event, **fields):
+        fields['event'] = event
+        fields['time'] = now = time()
+        line = json.dumps(fields, default=str) + '\n'
+
+        with self.lock:
+            if not self.fileobj:
+                return
+            self.buffer.append(line)
+            self.buffered += len(line)
+            if (self.buffered >= self.buffersize or now - self.flushed >= self.interval
+                    or event.startswith('task.')):
+                self._write()
+            elif not self.timer:
+                self.timer = threading.Timer(self.interval, self._expire)
+                self.timer.daemon = True
+                self.timer.start()
+
+    def flush(self):
+        with self.lock:
+            if self.fileobj:
+                self._write()
+
+    def _expire(self):
+        with self.lock:
+            self.timer = None
+            if self.fileobj:
+                self._write()
+
+    def _write(self):
+        if self.buffer:
+            self.fileobj.write(''.join(self.buffer))
+            self.buffer = []
+            self.buffered = 0
+        self.flushed = time()
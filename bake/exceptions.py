@@ -10,6 +10,9 @@ class TaskError(BakeError):
 class TaskFailed(BakeError):
     """A task failed."""
 
+class CyclicDependencyError(TaskError):
+    """The dependencies of a set of tasks are cyclic."""
+
 class MultipleTasksError(TaskError):
     """Multiple tasks with the same name exist."""
 
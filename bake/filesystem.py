@@ -1,13 +1,46 @@
+import os
 import tarfile
+from multiprocessing.pool import ThreadPool
 
+from bake.compression import ParallelCompressor, supports_parallel_compression
 from bake.path import path
+from bake.state import STATEDIR
+
+def collate_ancestors(filepaths):
+    """Returns the set of every directory which contains, at any depth, one
+    of the specified filepaths."""
+
+    ancestors = set()
+    for filepath in filepaths:
+        directory = os.path.dirname(filepath)
+        while directory not in ancestors:
+            ancestors.add(directory)
+            parent = os.path.dirname(directory)
+            if parent == directory:
+                break
+            directory = parent
+    return ancestors
+
+def ignore_directories(*names):
+    """Returns a prune callback for path.walktree which skips directories
+    with any of the specified names, such as '.git' or 'node_modules'."""
+
+    names = frozenset(names)
+    def prune(directory):
+        return os.path.basename(directory) in names
+    return prune
 
 class Collation(object):
-    def __init__(self, root, runtime=None):
+    def __init__(self, root, runtime=None, cache=None, workers=1, exclude=None):
         if not isinstance(root, path):
             root = path(root)
+        if cache is None and runtime:
+            cache = runtime.hashcache
 
+        self.cache = cache
+        self.exclude = exclude
         self.root = root.abspath()
+        self.workers = workers
         if runtime: # added for debugging purposes
             self.runtime = runtime
         else:
@@ -22,42 +55,40 @@ class Collation(object):
         self.directories = [str(self.root)]
         self.files = {}
 
-        for subject in self.root.walk():
-            subject = subject.abspath()
-            if subject.isdir():
+        candidates = []
+        for subject, isdir, isfile in self.root.walktree(self._prune):
+            if isdir:
                 if self.runtime:
                     self.runtime.report('filesystem Collation.collate: %s is a dir, adding to directories' % subject)
                 self.directories.append(str(subject))
-            elif subject.isfile():
-                if self.runtime:
-                    self.runtime.report('filesystem Collation.collate: %s is a file, adding to files with hash %s' % (subject, subject.read_hexhash('sha1')))
-                self.files[str(subject)] = subject.read_hexhash('sha1')
+            elif isfile:
+                candidates.append(subject)
+
+        for subject, hexhash in zip(candidates, self._hash_files(candidates)):
+            if self.runtime:
+                self.runtime.report('filesystem Collation.collate: %s is a file, adding to files with hash %s' % (subject, hexhash))
+            self.files[str(subject)] = hexhash
+
+        if self.cache is not None:
+            self.cache.evict(str(self.root) + os.sep, self.files)
+            self.cache.save()
 
     def prune(self, other):
         for filepath, hash in self.files.items():
             if other.files.get(filepath) == hash:
                 del self.files[filepath]
-        
+
+        existing = set(other.directories)
+        populated = collate_ancestors(self.files)
+
+        directories = []
         for directory in self.directories:
-            if self.runtime:
-                self.runtime.report('checking for %s in the other collation' % directory)
-        
-            if directory in other.directories:
+            if directory in existing:
                 if self.runtime:
                     self.runtime.report('removing %s from this collations directories list' % directory)
-                del self.directories[self.directories.index(directory)]
-            else:
-                if self.runtime:
-                    self.runtime.report('not removing %s from this collations directories list' % directory)
+            elif directory in populated or os.path.islink(directory):
+                directories.append(directory)
 
-        filepaths = self.files.keys()
-        directories = []
-        for directory in self.directories:
-            for filepath in filepaths:
-                if filepath.startswith(directory) or path(directory).islink():
-                    directories.append(directory)
-                    break
-    
         self.directories = directories
         return self
 
@@ -68,29 +99,67 @@ class Collation(object):
                 filepath = self._transform_filepath(filepath, transforms)
             reportpath.write_text(filepath + '\n', append=True)
 
-    def tar(self, filename, transforms=None, compression='bz2'):
-        openfile = tarfile.open(filename, 'w:' + compression)
+    def _prune(self, directory):
+        # the state of a runtime, including its hash cache, changes with each
+        # run and so is never collated
+        if os.path.basename(directory) == STATEDIR:
+            return True
+        return bool(self.exclude and self.exclude(directory))
+
+    def tar(self, target, transforms=None, compression='bz2', workers=1):
+        """Writes this collation as a tar archive to ``target``, either a
+        filename or a writable file object such as a pipe, which is written
+        as a stream. With gz or xz compression and more than one worker, the
+        archive is compressed in independent blocks on that many threads."""
+
+        openfile = compressor = None
+        if workers > 1 and supports_parallel_compression(compression):
+            if isinstance(target, basestring):
+                target = openfile = open(target, 'wb')
+            compressor = ParallelCompressor(target, compression, workers)
+            archive = tarfile.open(fileobj=compressor, mode='w|')
+        elif isinstance(target, basestring):
+            archive = tarfile.open(target, 'w:' + compression)
+        else:
+            archive = tarfile.open(fileobj=target, mode='w|' + compression)
+
         try:
-            for filepath in self.filepaths:
+            filepaths = self.filepaths
+            for filepath in filepaths:
                 arcname = filepath
                 if transforms: 
                     arcname = self._transform_filepath(filepath, transforms)
-                openfile.add(filepath, arcname, recursive=False)
+                archive.add(filepath, arcname, recursive=False)
+
+            # directories holding files are implied by the files themselves
+            populated = collate_ancestors(filepaths)
             for directory in self.directories:
-                docontinue = False
-                for filepath in self.filepaths:
-                    if filepath.startswith(directory):
-                        docontinue = True
-                        break
-                if docontinue:
+                if directory in populated:
                     continue
                 arcname = directory
                 if transforms:
                     arcname = self._transform_filepath(directory, transforms)
-                openfile.add(directory, arcname, recursive=False)
-                
+                archive.add(directory, arcname, recursive=False)
+        finally:
+            archive.close()
+            if compressor:
+                compressor.close()
+            if openfile:
+                openfile.close()
+
+    def _hash_file(self, subject):
+        return subject.read_hexhash('sha1', self.cache)
+
+    def _hash_files(self, candidates):
+        if self.workers <= 1 or len(candidates) <= 1:
+            return map(self._hash_file, candidates)
+
+        pool = ThreadPool(self.workers)
+        try:
+            return pool.map(self._hash_file, candidates, 16)
         finally:
-            openfile.close()
+            pool.close()
+            pool.join()
 
     def _transform_filepath(self, filepath, transforms):
         for prefix, repl in transforms.iteritems():
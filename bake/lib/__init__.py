@@ -1,5 +1,32 @@
-import bake.lib.git
-import bake.lib.misc
-import bake.lib.sphinx
-import bake.lib.svn
-import bake.lib.virtualenv
+"""The task libraries bundled with bake, each of which is imported only once
+one of its tasks is requested."""
+
+import sys
+
+LIBRARIES = {
+    'bake': 'bake.lib.misc',
+    'git': 'bake.lib.git',
+    'sphinx': 'bake.lib.sphinx',
+    'svn': 'bake.lib.svn',
+    'virtualenv': 'bake.lib.virtualenv',
+}
+
+def import_libraries():
+    for module in sorted(LIBRARIES.itervalues()):
+        __import__(module)
+
+def import_library(name):
+    """Imports the library which would define the task ``name``, either its
+    name or its full name, returning True if it had not already been
+    imported."""
+
+    if name.startswith('bake.lib.'):
+        module = 'bake.lib.%s' % name.split('.')[2]
+        if module not in LIBRARIES.itervalues():
+            module = None
+    else:
+        module = LIBRARIES.get(name.split('.', 1)[0])
+    if module and module not in sys.modules:
+        __import__(module)
+        return True
+    return False
@@ -1,19 +1,117 @@
+import atexit
+import subprocess
+from threading import Lock
+
 from scheme import *
 
+from bake.lib.gitreader import ObjectReader, UnsupportedError
 from bake.path import path
-from bake.process import Process
+from bake.process import Process, set_cloexec
 from bake.task import *
 
+# the sessions running without a runtime, which are closed at exit
+_sessions = set()
+
+@atexit.register
+def _close_sessions():
+    for session in list(_sessions):
+        session.close()
+
+class BatchSession(object):
+    """A long-lived ``git cat-file --batch`` (or ``--batch-check``) coprocess
+    which answers object queries without forking git for each one. While the
+    coprocess runs, the session is closed when the runtime of its repository
+    shuts down, or at exit."""
+
+    def __init__(self, repository, check=False):
+        self.check = check
+        self.lock = Lock()
+        self.process = None
+        self.repository = repository
+
+    def close(self):
+        with self.lock:
+            process, self.process = self.process, None
+            if process:
+                process.stdin.close()
+                process.stdout.close()
+                process.wait()
+                self._unregister()
+
+    def query(self, name):
+        """Returns ``(hash, type, size, content)`` for the named object, with
+        ``content`` of None for a check session, or None if it is missing."""
+
+        with self.lock:
+            process = self._start()
+            process.stdin.write(name + '\n')
+            process.stdin.flush()
+
+            header = process.stdout.readline()
+            if not header:
+                self.process = None
+                raise RuntimeError('git cat-file exited unexpectedly')
+
+            tokens = header.split()
+            if len(tokens) != 3:
+                return None
+
+            hash, type, size = tokens[0], tokens[1], int(tokens[2])
+            content = None
+            if not self.check:
+                content = process.stdout.read(size)
+                process.stdout.read(1)
+            return hash, type, size, content
+
+    def _start(self):
+        if self.process is None or self.process.poll() is not None:
+            option = '--batch-check' if self.check else '--batch'
+            self.process = subprocess.Popen([self.repository.binary, 'cat-file', option],
+                cwd=str(self.repository.root), stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE, close_fds=True)
+            set_cloexec(self.process.stdin.fileno())
+            set_cloexec(self.process.stdout.fileno())
+            self._register()
+        return self.process
+
+    def _register(self):
+        runtime = self.repository.runtime
+        if runtime:
+            runtime.add_cleanup(self.close)
+        else:
+            _sessions.add(self)
+
+    def _unregister(self):
+        runtime = self.repository.runtime
+        if runtime:
+            runtime.remove_cleanup(self.close)
+        else:
+            _sessions.discard(self)
+
 class Repository(object):
     """A git repository."""
 
-    def __init__(self, root, runtime=None, binary='git'):
+    def __init__(self, root, runtime=None, binary='git', inprocess=True):
         if not isinstance(root, path):
             root = path(root)
 
         self.binary = binary
+        self.inprocess = inprocess
         self.root = root.expanduser().abspath()
         self.runtime = runtime
+        self._reader = None
+
+        self.batch = BatchSession(self)
+        self.batch_check = BatchSession(self, True)
+
+    @property
+    def reader(self):
+        if self.inprocess and self._reader is None:
+            try:
+                self._reader = ObjectReader(self.root / '.git')
+            except (UnsupportedError, EnvironmentError):
+                self.inprocess = False
+        return self._reader
 
     @property
     def tags(self):
@@ -22,6 +120,12 @@ class Repository(object):
     def checkout(self, commit):
         self.execute(['checkout', commit])
 
+    def close(self):
+        self.batch.close()
+        self.batch_check.close()
+        if self._reader:
+            self._reader.close()
+
     def clone(self, url):
         self.execute(['clone', url, str(self.root)], False, True)
 
@@ -50,16 +154,41 @@ class Repository(object):
         return self.root.exists()
 
     def get_current_branch(self):
+        found, branch = self._query_reader('get_current_branch')
+        if found:
+            return branch
+
         process = self.execute(['rev-parse', '--abbrev-ref', 'HEAD'])
         return process.stdout.strip()
 
     def get_current_hash(self):
-        process = self.execute(['log', '-1', '--pretty=format:%H'])
-        return process.stdout.strip()
+        found, hash = self._query_reader('resolve', 'HEAD')
+        if found:
+            return hash
+
+        object = self.batch_check.query('HEAD')
+        if not object:
+            raise RuntimeError('HEAD does not point to a commit')
+        return object[0]
 
     def get_file(self, filename, commit='HEAD'):
-        filename = '%s:%s' % (commit, filename)
-        return self.execute(['show', filename]).stdout
+        return self.get_files([filename], commit)[filename]
+
+    def get_files(self, filenames, commit='HEAD'):
+        files = {}
+        for filename in filenames:
+            found, content = self._query_reader('get_file', filename, commit)
+            if found:
+                files[filename] = content
+                continue
+
+            object = self.batch.query('%s:%s' % (commit, filename))
+            if not object:
+                raise RuntimeError('%r does not exist in %r' % (filename, commit))
+            elif object[1] != 'blob':
+                raise RuntimeError('%r is not a file in %r' % (filename, commit))
+            files[filename] = object[3]
+        return files
 
     def get_status(self):
         process = self.execute(['status', '-s'], passive=True)
@@ -81,6 +210,16 @@ class Repository(object):
         if not passthrough:
             return process.stdout
 
+    def _query_reader(self, method, *args):
+        # anything the in-process reader cannot answer is put to git instead
+        reader = self.reader
+        if reader:
+            try:
+                return True, getattr(reader, method)(*args)
+            except (UnsupportedError, EnvironmentError):
+                pass
+        return False, None
+
 class GitTask(Task):
     parameters = {
         'binary': Text(description='path to git binary', default='git'),
@@ -99,3 +238,77 @@ class GitClone(GitTask):
         if self['path']:
             options.append(self['path'])
         runtime.shell(options)
+
+class GitSync(GitTask):
+    name = 'git.sync'
+    description = 'clones or fast-forwards a set of git repositories'
+    parameters = {
+        'concurrency': Integer(description='maximum number of concurrent git operations',
+            default=4),
+        'repositories': Sequence(Structure({
+            'branch': Text(description='branch to clone or fast-forward'),
+            'path': Text(description='path to working copy', nonnull=True),
+            'url': Text(description='url of git repository', nonnull=True),
+        }), description='repositories to synchronize', required=True),
+        'timeout': Integer(description='timeout in seconds for each git operation'),
+    }
+
+    def run(self, runtime):
+        binary = self['binary']
+        repositories = self['repositories']
+        self.results = [None] * len(repositories)
+
+        operations, cmdlines = [], []
+        for i, entry in enumerate(repositories):
+            repository = Repository(entry['path'], runtime, binary)
+            branch = entry.get('branch')
+            if not repository.exists():
+                cmdline = [binary, 'clone', '-q']
+                if branch:
+                    cmdline.extend(['-b', branch])
+                cmdline.extend([entry['url'], str(repository.root)])
+                before = None
+            elif not repository.is_repository():
+                self.results[i] = (entry['path'], 'skipped', 'not a git repository')
+                continue
+            else:
+                current = repository.get_current_branch()
+                if branch and current != branch:
+                    self.results[i] = (entry['path'], 'skipped', 'on branch %s' % current)
+                    continue
+                before = repository.get_current_hash()
+                cmdline = [binary, '-C', str(repository.root), 'pull', '-q', '--ff-only']
+                if branch:
+                    cmdline.extend(['origin', branch])
+            operations.append((i, entry['path'], repository, before))
+            cmdlines.append(cmdline)
+
+        # fail rather than wait on a credential prompt nobody can answer
+        processes = runtime.shell_many(cmdlines, {'GIT_TERMINAL_PROMPT': '0'},
+            timeout=self['timeout'], concurrency=self['concurrency'], merge_output=True,
+            passive=True, tail=5)
+
+        for (i, name, repository, before), process in zip(operations, processes):
+            if process.returncode != 0:
+                reason = 'timed out' if process.timedout else '\n'.join(process.tail or ())
+                self.results[i] = (name, 'failed', reason)
+            elif before is None:
+                self.results[i] = (name, 'cloned', repository.get_current_hash()[:10])
+            else:
+                after = repository.get_current_hash()
+                if after == before:
+                    self.results[i] = (name, 'current', after[:10])
+                else:
+                    self.results[i] = (name, 'updated', '%s..%s' % (before[:10], after[:10]))
+            repository.close()
+
+        failures = 0
+        for name, status, detail in self.results:
+            color = {'failed': 'R', 'skipped': 'Y'}.get(status, 'G')
+            runtime.report('[!%s]%s[!] %s (%s)' % (color, status, name, detail))
+            if status == 'failed':
+                failures += 1
+
+        if failures:
+            raise TaskError('failed to synchronize %d of %d repositories'
+                % (failures, len(self.results)))
@@ -0,0 +1,364 @@
+import mmap
+import os
+import struct
+import zlib
+from binascii import hexlify, unhexlify
+from bisect import bisect_left
+from threading import Lock
+
+__all__ = ('ObjectReader', 'UnsupportedError')
+
+TYPES = {1: 'commit', 2: 'tree', 3: 'blob', 4: 'tag'}
+OFS_DELTA = 6
+REF_DELTA = 7
+
+class UnsupportedError(Exception):
+    """The reader cannot answer a query, which should instead be put to git."""
+
+class ObjectReader(object):
+    """A read-only, in-process reader of the refs and objects of a git
+    repository, for queries which would otherwise fork git. Anything it does
+    not understand raises UnsupportedError."""
+
+    def __init__(self, gitdir):
+        gitdir = str(gitdir)
+        if os.path.isfile(gitdir):
+            gitdir = self._follow_gitfile(gitdir)
+        if os.path.exists(os.path.join(gitdir, 'commondir')):
+            raise UnsupportedError('linked worktrees are not supported')
+
+        self.gitdir = gitdir
+        self.lock = Lock()
+        self.packed_refs = None
+        self.packs = None
+
+    def close(self):
+        with self.lock:
+            for pack in (self.packs or ()):
+                pack.close()
+            self.packs = None
+
+    def get_current_branch(self):
+        target = self._read_ref_file('HEAD')
+        if target is None:
+            raise UnsupportedError('cannot read HEAD')
+        if not target.startswith('ref: '):
+            return 'HEAD'
+
+        ref = target[5:]
+        if not ref.startswith('refs/heads/') or self.resolve_ref(ref) is None:
+            raise UnsupportedError(ref)
+        return ref[11:]
+
+    def get_file(self, filename, commit='HEAD'):
+        hash = self.resolve(commit)
+        type, content = self.read_object(hash)
+        while type == 'tag':
+            hash = content.split('\n', 1)[0].split(' ', 1)[1]
+            type, content = self.read_object(hash)
+        if type != 'commit' or not content.startswith('tree '):
+            raise UnsupportedError(commit)
+
+        hash = content[5:45]
+        for name in filename.strip('/').split('/'):
+            type, content = self.read_object(hash)
+            if type != 'tree':
+                raise UnsupportedError(filename)
+            hash = self._find_tree_entry(content, name)
+            if hash is None:
+                raise UnsupportedError(filename)
+
+        type, content = self.read_object(hash)
+        if type != 'blob':
+            raise UnsupportedError(filename)
+        return content
+
+    def read_object(self, hash):
+        """Returns ``(type, content)`` for the object with the specified
+        hexadecimal hash."""
+
+        content = self._read_loose_object(hash)
+        if content is not None:
+            return content
+
+        binary = unhexlify(hash)
+        for refresh in (False, True):
+            for pack in self._get_packs(refresh):
+                offset = pack.find(binary)
+                if offset is not None:
+                    return pack.read(offset, self)
+        raise UnsupportedError('cannot find object %s' % hash)
+
+    def resolve(self, name):
+        """Resolves ``name``, which may be HEAD, a full hash or the name of a
+        ref, to the hash it refers to."""
+
+        if len(name) == 40:
+            try:
+                unhexlify(name)
+            except TypeError:
+                pass
+            else:
+                return name.lower()
+
+        if name == 'HEAD':
+            candidates = ['HEAD']
+        else:
+            candidates = [name, 'refs/' + name, 'refs/tags/' + name, 'refs/heads/' + name,
+                'refs/remotes/' + name, 'refs/remotes/%s/HEAD' % name]
+
+        for candidate in candidates:
+            hash = self.resolve_ref(candidate)
+            if hash:
+                return hash
+        raise UnsupportedError(name)
+
+    def resolve_ref(self, ref, depth=0):
+        if depth > 5:
+            raise UnsupportedError('too many levels of symbolic refs')
+
+        target = self._read_ref_file(ref)
+        if target is None:
+            return self._get_packed_refs().get(ref)
+        elif target.startswith('ref: '):
+            return self.resolve_ref(target[5:], depth + 1)
+        elif len(target) == 40:
+            return target
+        else:
+            raise UnsupportedError(ref)
+
+    def _find_tree_entry(self, content, name):
+        offset, length = 0, len(content)
+        while offset < length:
+            space = content.index(' ', offset)
+            null = content.index('\0', space)
+            if content[space + 1:null] == name:
+                return hexlify(content[null + 1:null + 21])
+            offset = null + 21
+
+    def _follow_gitfile(self, filename):
+        with open(filename) as openfile:
+            content = openfile.read().strip()
+        if not content.startswith('gitdir: '):
+            raise UnsupportedError(filename)
+        return os.path.join(os.path.dirname(filename), content[8:])
+
+    def _get_packed_refs(self):
+        filename = os.path.join(self.gitdir, 'packed-refs')
+        try:
+            mtime = os.stat(filename).st_mtime
+        except OSError:
+            return {}
+
+        cached = self.packed_refs
+        if cached and cached[0] == mtime:
+            return cached[1]
+
+        refs = {}
+        with open(filename) as openfile:
+            for line in openfile:
+                if line[0] in '#^':
+                    continue
+                tokens = line.split()
+                if len(tokens) == 2:
+                    refs[tokens[1]] = tokens[0]
+
+        self.packed_refs = (mtime, refs)
+        return refs
+
+    def _get_packs(self, refresh=False):
+        with self.lock:
+            if self.packs is None or refresh:
+                directory = os.path.join(self.gitdir, 'objects', 'pack')
+                existing = dict((pack.filename, pack) for pack in (self.packs or ()))
+                packs = []
+                if os.path.isdir(directory):
+                    for filename in sorted(os.listdir(directory)):
+                        if filename.endswith('.idx'):
+                            filename = os.path.join(directory, filename[:-4])
+                            pack = existing.pop(filename, None)
+                            if pack is None:
+                                try:
+                                    pack = Pack(filename)
+                                except (EnvironmentError, ValueError, UnsupportedError):
+                                    continue
+                            packs.append(pack)
+                for pack in existing.itervalues():
+                    pack.close()
+                self.packs = packs
+            return self.packs
+
+    def _read_loose_object(self, hash):
+        filename = os.path.join(self.gitdir, 'objects', hash[:2], hash[2:])
+        try:
+            openfile = open(filename, 'rb')
+        except IOError:
+            return None
+
+        with openfile:
+            try:
+                data = zlib.decompress(openfile.read())
+            except zlib.error:
+                raise UnsupportedError('corrupt object %s' % hash)
+
+        null = data.index('\0')
+        type, size = data[:null].split(' ')
+        return type, data[null + 1:]
+
+    def _read_ref_file(self, ref):
+        try:
+            with open(os.path.join(self.gitdir, ref)) as openfile:
+                return openfile.read().strip()
+        except IOError:
+            return None
+
+class Pack(object):
+    """A git pack file and its version 2 index."""
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.index = self._map(filename + '.idx')
+        self.pack = self._map(filename + '.pack')
+
+        if self.index[:8] != '\377tOc\0\0\0\2':
+            self.close()
+            raise UnsupportedError('unsupported pack index %s' % filename)
+
+        self.fanout = struct.unpack('>256L', self.index[8:1032])
+        self.count = self.fanout[255]
+
+    def close(self):
+        self.index.close()
+        self.pack.close()
+
+    def find(self, binary):
+        index, count = self.index, self.count
+        first = ord(binary[0])
+        high = self.fanout[first]
+        low = self.fanout[first - 1] if first else 0
+
+        position = bisect_left(_HashTable(index, count), binary, low, high)
+        if position >= high or index[1032 + position * 20:1052 + position * 20] != binary:
+            return None
+
+        base = 1032 + count * 24
+        offset = struct.unpack('>L', index[base + position * 4:base + position * 4 + 4])[0]
+        if offset & 0x80000000:
+            base += count * 4 + (offset & 0x7fffffff) * 8
+            offset = struct.unpack('>Q', index[base:base + 8])[0]
+        return offset
+
+    def read(self, offset, reader):
+        """Returns ``(type, content)`` for the entry at ``offset``, resolving
+        deltas against their bases."""
+
+        pack, start = self.pack, offset
+        byte = ord(pack[offset])
+        type, size, shift = (byte >> 4) & 7, byte & 15, 4
+        offset += 1
+        while byte & 0x80:
+            byte = ord(pack[offset])
+            size |= (byte & 0x7f) << shift
+            shift += 7
+            offset += 1
+
+        if type in TYPES:
+            return TYPES[type], self._inflate(offset, size)
+        elif type == OFS_DELTA:
+            byte = ord(pack[offset])
+            distance = byte & 0x7f
+            offset += 1
+            while byte & 0x80:
+                byte = ord(pack[offset])
+                distance = ((distance + 1) << 7) | (byte & 0x7f)
+                offset += 1
+            type, base = self.read(start - distance, reader)
+        elif type == REF_DELTA:
+            type, base = reader.read_object(hexlify(pack[offset:offset + 20]))
+            offset += 20
+        else:
+            raise UnsupportedError('unknown pack entry type %d' % type)
+
+        return type, _apply_delta(base, self._inflate(offset, size))
+
+    def _inflate(self, offset, size):
+        decompressor = zlib.decompressobj()
+        chunks, blocksize = [], 4096
+        while True:
+            data = self.pack[offset:offset + blocksize]
+            if not data:
+                break
+            try:
+                chunks.append(decompressor.decompress(data))
+            except zlib.error:
+                raise UnsupportedError('corrupt pack entry in %s' % self.filename)
+            if decompressor.unused_data:
+                break
+            offset += blocksize
+            blocksize *= 2
+
+        chunks.append(decompressor.flush())
+        content = ''.join(chunks)
+        if len(content) != size:
+            raise UnsupportedError('corrupt pack entry in %s' % self.filename)
+        return content
+
+    def _map(self, filename):
+        with open(filename, 'rb') as openfile:
+            return mmap.mmap(openfile.fileno(), 0, access=mmap.ACCESS_READ)
+
+def _apply_delta(base, delta):
+    source, offset = _read_size(delta, 0)
+    target, offset = _read_size(delta, offset)
+    if source != len(base):
+        raise UnsupportedError('delta does not match its base')
+
+    chunks, length = [], len(delta)
+    while offset < length:
+        opcode = ord(delta[offset])
+        offset += 1
+        if opcode & 0x80:
+            start = size = 0
+            for i in range(4):
+                if opcode & (1 << i):
+                    start |= ord(delta[offset]) << (i * 8)
+                    offset += 1
+            for i in range(3):
+                if opcode & (0x10 << i):
+                    size |= ord(delta[offset]) << (i * 8)
+                    offset += 1
+            chunks.append(base[start:start + (size or 0x10000)])
+        elif opcode:
+            chunks.append(delta[offset:offset + opcode])
+            offset += opcode
+        else:
+            raise UnsupportedError('invalid delta opcode')
+
+    content = ''.join(chunks)
+    if len(content) != target:
+        raise UnsupportedError('delta produced the wrong size')
+    return content
+
+def _read_size(data, offset):
+    size = shift = 0
+    while True:
+        byte = ord(data[offset])
+        size |= (byte & 0x7f) << shift
+        shift += 7
+        offset += 1
+        if not byte & 0x80:
+            return size, offset
+
+class _HashTable(object):
+    # presents the sorted hash table of a pack index as a sequence, so that
+    # it can be searched with bisect without being copied
+    def __init__(self, index, count):
+        self.count = count
+        self.index = index
+
+    def __getitem__(self, position):
+        start = 1032 + position * 20
+        return self.index[start:start + 20]
+
+    def __len__(self):
+        return self.count
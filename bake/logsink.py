@@ -0,0 +1,110 @@
+import os
+import threading
+from datetime import datetime
+from Queue import Empty, Queue
+from time import time
+
+from bake.color import ansify
+
+__all__ = ('LEVELS', 'LogSink')
+
+LEVELS = {'error': 0, 'info': 1, 'debug': 2}
+
+class LogSink(object):
+    """A log file written by a background thread, which takes messages from a
+    bounded queue so that logging does not wait on the disk unless the queue
+    fills. Messages above ``level`` are discarded, and once the file would
+    exceed ``maxsize`` bytes it is rotated, keeping ``backups`` old files."""
+
+    def __init__(self, filename, level='info', maxsize=10485760, backups=5, queuesize=10000):
+        if level not in LEVELS:
+            raise ValueError('unknown log level %r' % level)
+
+        self.backups = backups
+        self.filename = filename
+        self.level = LEVELS[level]
+        self.maxsize = maxsize
+        self.queue = Queue(queuesize)
+
+        self._open()
+
+        self.thread = threading.Thread(target=self._run, name='bake-log')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def close(self):
+        if self.thread:
+            self.queue.put(None)
+            self.thread.join()
+            self.thread = None
+            self.fileobj.close()
+
+    def write(self, level, message, context=None):
+        if LEVELS[level] <= self.level:
+            self.queue.put((time(), level, context, message))
+
+    def _format(self, entry):
+        timestamp, level, context, message = entry
+        timestamp = datetime.fromtimestamp(timestamp).strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3]
+        if context:
+            message = '[%s] %s' % (context, message)
+        return '%s %-5s %s\n' % (timestamp, level.upper(), ansify(message).rstrip('\n'))
+
+    def _open(self):
+        self.fileobj = open(self.filename, 'a')
+        self.size = self.fileobj.tell()
+
+    def _rotate(self):
+        # should rotation fail, the current file is reopened
+        self.fileobj.close()
+        try:
+            for i in range(self.backups - 1, 0, -1):
+                source = '%s.%d' % (self.filename, i)
+                if os.path.exists(source):
+                    os.rename(source, '%s.%d' % (self.filename, i + 1))
+            if self.backups:
+                os.rename(self.filename, '%s.1' % self.filename)
+            else:
+                os.remove(self.filename)
+        finally:
+            self._open()
+
+    def _run(self):
+        while True:
+            entries = [self.queue.get()]
+            try:
+                while len(entries) < 1000:
+                    entries.append(self.queue.get_nowait())
+            except Empty:
+                pass
+
+            closing = None in entries
+            lines = [self._format(entry) for entry in entries if entry is not None]
+            try:
+                self._write(lines)
+            except (EnvironmentError, ValueError):
+                pass
+            if closing:
+                break
+
+    def _write(self, lines):
+        if self.fileobj.closed:
+            self._open()
+
+        batch, size, rotating = [], self.size, True
+        for line in lines:
+            if size + len(line) > self.maxsize and size and rotating:
+                self.fileobj.write(''.join(batch))
+                batch = []
+                try:
+                    self._rotate()
+                except EnvironmentError:
+                    # rotation is attempted again with the next batch
+                    rotating = False
+                size = self.size
+            batch.append(line)
+            size += len(line)
+
+        self.fileobj.write(''.join(batch))
+        self.fileobj.flush()
+        self.size = size
@@ -1,6 +1,8 @@
-import os
+from collections import OrderedDict
 
-def collate_data_files(rootpath, extensions=None):
+from bake.path import path
+
+def collate_data_files(rootpath, extensions=None, prune=None, followlinks=False):
     if isinstance(extensions, basestring):
         extensions = extensions.split(' ')
 
@@ -11,19 +13,15 @@ def collate_data_files(rootpath, extensions=None):
             if filename.endswith(extension):
                 return True
 
-    data_files = []
-    for root, dirs, files in os.walk(rootpath):
-        candidates = []
-        for filename in files:
-            if filter(filename):
-                candidates.append(os.path.join(root, filename))
-        if candidates:
-            data_files.append((root, candidates))
-    return data_files
+    data_files = OrderedDict()
+    for filepath, isdir, isfile in path(rootpath).walktree(prune, followlinks=followlinks):
+        if isfile and filter(filepath):
+            data_files.setdefault(str(filepath.dirname()), []).append(str(filepath))
+    return data_files.items()
 
-def enumerate_packages(rootpath):
+def enumerate_packages(rootpath, prune=None, followlinks=False):
     packages = []
-    for root, dirs, files in os.walk(rootpath):
-        if '__init__.py' in files:
-            packages.append(root.replace('/', '.'))
+    for filepath, isdir, isfile in path(rootpath).walktree(prune, followlinks=followlinks):
+        if isfile and filepath.name == '__init__.py':
+            packages.append(str(filepath.dirname()).replace('/', '.'))
     return packages
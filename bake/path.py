@@ -78,6 +78,19 @@ try:
 except NameError:
     basestring = (str, unicode)
 
+# Directory scanning which reports the type of each entry without a stat,
+# available from the os module (Python 3.5+) or, under Python 2, from the
+# scandir package. Bake does not depend on scandir, so as installed under
+# Python 2 the fallback, which stats every entry, is the path that runs; the
+# fast path is taken only where scandir has been installed separately.
+try:
+    from os import scandir as _scandir
+except ImportError:
+    try:
+        from scandir import scandir as _scandir
+    except ImportError:
+        _scandir = None
+
 # Universal newline support
 _textmode = 'U'
 if hasattr(__builtins__, 'file') and not hasattr(file, 'newlines'):
@@ -371,7 +384,7 @@ class path(_base):
 
         return [p for p in self.listdir(pattern) if p.isfile()]
 
-    def walk(self, pattern=None, errors='strict'):
+    def walk(self, pattern=None, errors='strict', prune=None):
         """ D.walk() -> iterator over files and subdirs, recursively.
 
         The iterator yields path objects naming each child item of
@@ -385,46 +398,14 @@ class path(_base):
         error occurs.  The default is 'strict', which causes an
         exception.  The other allowed values are 'warn', which
         reports the error via warnings.warn(), and 'ignore'.
-        """
-        if errors not in ('strict', 'warn', 'ignore'):
-            raise ValueError("invalid errors parameter")
-
-        try:
-            childList = self.listdir()
-        except Exception:
-            if errors == 'ignore':
-                return
-            elif errors == 'warn':
-                warnings.warn(
-                    "Unable to list directory '%s': %s"
-                    % (self, sys.exc_info()[1]),
-                    TreeWalkWarning)
-                return
-            else:
-                raise
 
-        for child in childList:
+        The prune= keyword argument is described under D.walktree().
+        """
+        for child, isdir, isfile in self.walktree(prune, errors):
             if pattern is None or child.fnmatch(pattern):
                 yield child
-            try:
-                isdir = child.isdir()
-            except Exception:
-                if errors == 'ignore':
-                    isdir = False
-                elif errors == 'warn':
-                    warnings.warn(
-                        "Unable to access '%s': %s"
-                        % (child, sys.exc_info()[1]),
-                        TreeWalkWarning)
-                    isdir = False
-                else:
-                    raise
 
-            if isdir:
-                for item in child.walk(pattern, errors):
-                    yield item
-
-    def walkdirs(self, pattern=None, errors='strict'):
+    def walkdirs(self, pattern=None, errors='strict', prune=None):
         """ D.walkdirs() -> iterator over subdirs, recursively.
 
         With the optional 'pattern' argument, this yields only
@@ -436,43 +417,69 @@ class path(_base):
         error occurs.  The default is 'strict', which causes an
         exception.  The other allowed values are 'warn', which
         reports the error via warnings.warn(), and 'ignore'.
-        """
-        if errors not in ('strict', 'warn', 'ignore'):
-            raise ValueError("invalid errors parameter")
 
-        try:
-            dirs = self.dirs()
-        except Exception:
-            if errors == 'ignore':
-                return
-            elif errors == 'warn':
-                warnings.warn(
-                    "Unable to list directory '%s': %s"
-                    % (self, sys.exc_info()[1]),
-                    TreeWalkWarning)
-                return
-            else:
-                raise
-
-        for child in dirs:
-            if pattern is None or child.fnmatch(pattern):
+        The prune= keyword argument is described under D.walktree().
+        """
+        for child, isdir, isfile in self.walktree(prune, errors):
+            if isdir and (pattern is None or child.fnmatch(pattern)):
                 yield child
-            for subsubdir in child.walkdirs(pattern, errors):
-                yield subsubdir
 
-    def walkfiles(self, pattern=None, errors='strict'):
+    def walkfiles(self, pattern=None, errors='strict', prune=None):
         """ D.walkfiles() -> iterator over files in D, recursively.
 
         The optional argument, pattern, limits the results to files
         with names that match the pattern.  For example,
         mydir.walkfiles('*.tmp') yields only files with the .tmp
         extension.
+
+        The prune= keyword argument is described under D.walktree().
+        """
+        for child, isdir, isfile in self.walktree(prune, errors):
+            if isfile and (pattern is None or child.fnmatch(pattern)):
+                yield child
+
+    def walktree(self, prune=None, errors='strict', followlinks=True):
+        """ D.walktree() -> iterator over (item, isdir, isfile), recursively.
+
+        The iterator yields a tuple for each child item of this
+        directory and its descendants, in the same order as D.walk().
+        Where scandir is available, the type of each item is taken
+        from its directory entry, so most items are never stat'd.
+        The traversal keeps an explicit stack rather than recursing.
+
+        The optional 'prune' argument is a callable which is passed
+        each subdirectory before it is yielded; if it returns true,
+        that subdirectory and its descendants are skipped.
+
+        The errors= keyword argument is as for D.walk(); an item
+        which cannot be accessed is reported as neither a directory
+        nor a file.
+
+        If 'followlinks' is false, a symbolic link to a directory is
+        reported as neither a directory nor a file, and so is not
+        descended into, as with os.walk().
         """
         if errors not in ('strict', 'warn', 'ignore'):
             raise ValueError("invalid errors parameter")
 
+        stack = [self._scan(errors, followlinks)]
+        while stack:
+            for child, isdir, isfile in stack[-1]:
+                if isdir and prune is not None and prune(child):
+                    continue
+                yield child, isdir, isfile
+                if isdir:
+                    stack.append(child._scan(errors, followlinks))
+                    break
+            else:
+                stack.pop()
+
+    def _scan(self, errors, followlinks=True):
         try:
-            childList = self.listdir()
+            if _scandir is not None:
+                entries = list(_scandir(self))
+            else:
+                entries = os.listdir(self)
         except Exception:
             if errors == 'ignore':
                 return
@@ -485,28 +492,30 @@ class path(_base):
             else:
                 raise
 
-        for child in childList:
+        for entry in entries:
+            if _scandir is not None:
+                child = self.__class__(entry.path)
+            else:
+                child = self / entry
             try:
-                isfile = child.isfile()
-                isdir = not isfile and child.isdir()
-            except:
+                if _scandir is not None:
+                    isdir = entry.is_dir(follow_symlinks=followlinks)
+                    isfile = not isdir and entry.is_file()
+                else:
+                    isdir = child.isdir() and (followlinks or not child.islink())
+                    isfile = not isdir and child.isfile()
+            except Exception:
                 if errors == 'ignore':
-                    continue
+                    isdir = isfile = False
                 elif errors == 'warn':
                     warnings.warn(
                         "Unable to access '%s': %s"
-                        % (self, sys.exc_info()[1]),
+                        % (child, sys.exc_info()[1]),
                         TreeWalkWarning)
-                    continue
+                    isdir = isfile = False
                 else:
                     raise
-
-            if isfile:
-                if pattern is None or child.fnmatch(pattern):
-                    yield child
-            elif isdir:
-                for f in child.walkfiles(pattern, errors):
-                    yield f
+            yield child, isdir, isfile
 
     def fnmatch(self, pattern):
         """ Return True if self.name matches the given pattern.
@@ -782,12 +791,14 @@ class path(_base):
         """
         return self.read_hash('md5')
 
-    def _hash(self, hash_name):
+    def _hash(self, hash_name, blocksize=1048576):
+        # large blocks keep per-call overhead down, and hashlib releases the
+        # GIL while digesting them, so files can be hashed on several threads
         f = self.open('rb')
         try:
             m = hashlib.new(hash_name)
             while True:
-                d = f.read(8192)
+                d = f.read(blocksize)
                 if not d:
                     break
                 m.update(d)
@@ -803,12 +814,15 @@ class path(_base):
         """
         return self._hash(hash_name).digest()
 
-    def read_hexhash(self, hash_name):
+    def read_hexhash(self, hash_name, cache=None):
         """ Calculate given hash for this file, returning hexdigest.
 
         List of supported hashes can be obtained from hashlib package. This
-        reads the entire file.
+        reads the entire file, unless a bake.state.HashCache is given as
+        cache and holds the hash of this file as it currently stands.
         """
+        if cache is not None:
+            return cache.hexhash(self, hash_name)
         return self._hash(hash_name).hexdigest()
 
     # --- Methods for querying the filesystem.
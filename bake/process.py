@@ -1,22 +1,62 @@
+import errno
+import fcntl
 import os
+import select
 import shlex
 import subprocess
 import sys
-from threading import Thread
+from collections import deque
 from time import time
 
+def set_cloexec(fd):
+    # keeps processes started later by other means than Popen with close_fds,
+    # such as os.exec, from inheriting this end of the pipe, which would
+    # otherwise hold it open after this process exits
+    flags = fcntl.fcntl(fd, fcntl.F_GETFD)
+    fcntl.fcntl(fd, fcntl.F_SETFD, flags | fcntl.FD_CLOEXEC)
+
 class ProcessFailure(Exception):
-    pass
+    def __str__(self):
+        if len(self.args) != 2 or not isinstance(self.args[1], Process):
+            return Exception.__str__(self)
+
+        returncode, process = self.args
+        cmdline = process.cmdline
+        if not isinstance(cmdline, basestring):
+            cmdline = ' '.join(cmdline)
+
+        message = '%r returned %s' % (cmdline, returncode)
+        if process.tail:
+            message = '%s; last output:\n%s' % (message, '\n'.join(process.tail))
+        return message
 
 class Process(object):
-    def __init__(self, cmdline, environ=None, shell=False, merge_output=False, passthrough=False):
+    """A subprocess. Output is captured into ``stdout`` and ``stderr`` (only
+    the last ``limit`` bytes of each, if specified), written unchanged to
+    ``tee``, a file object or filename, and passed line by line to
+    ``callback(name, line)``; the last ``tail`` lines are also retained and
+    reported with any failure. If set, ``observer(event, process)`` is called
+    when the process is spawned and when it exits."""
+
+    def __init__(self, cmdline, environ=None, shell=False, merge_output=False, passthrough=False,
+            limit=None, callback=None, tee=None, tail=None):
+
+        self.callback = callback
+        self.limit = limit
+        self.tee = tee
+        self.taillength = tail
+        self.tail = None
         self.merge_output = merge_output
         self.passthrough = passthrough
+        self.finished = None
+        self.observer = None
         self.process = None
+        self.received = 0
         self.returncode = None
         self.shell = shell
         self.stderr = None
         self.stdout = None
+        self.timedout = False
 
         self.environ = dict(os.environ)
         if environ:
@@ -27,40 +67,14 @@ class Process(object):
     def __call__(self, data=None, timeout=None, runtime=None, cwd=None):
         if runtime:
             runtime.info('shell: %s' % ' '.join(self.cmdline))
+            if self.observer is None:
+                self.observer = getattr(runtime, 'observe', None)
 
-        def _thread():
-            stdout = subprocess.PIPE
+            # output passed through by the process must follow what precedes it
             if self.passthrough:
-                stdout = sys.stdout
-
-            stderr = subprocess.PIPE
-            if self.merge_output:
-                stderr = subprocess.STDOUT
-            elif self.passthrough:
-                stderr = sys.stderr
-
-            self.process = subprocess.Popen(
-                self.cmdline,
-                bufsize=0,
-                env=self.environ,
-                shell=self.shell,
-                cwd=cwd,
-                stdin=subprocess.PIPE,
-                stdout=stdout,
-                stderr=stderr,
-                universal_newlines=True,
-            )
-            self.stdout, self.stderr = self.process.communicate(data)
-
-        thread = Thread(target=_thread)
-        thread.start()
-
-        thread.join(timeout)
-        if thread.isAlive():
-            self.process.terminate()
-            thread.join()
+                runtime.flush()
 
-        self.returncode = self.process.returncode
+        ProcessMonitor(timeout=timeout).run([self], data, cwd)
         return self.returncode
 
     def run(self, runtime, data=None, timeout=None, cwd=None):
@@ -68,8 +82,278 @@ class Process(object):
         if returncode != 0:
             raise ProcessFailure(returncode, self)
 
+    def start(self, data=None, cwd=None):
+        stdout = subprocess.PIPE
+        if self.passthrough:
+            stdout = sys.stdout
+
+        stderr = subprocess.PIPE
+        if self.merge_output:
+            stderr = subprocess.STDOUT
+        elif self.passthrough:
+            stderr = sys.stderr
+
+        self.process = subprocess.Popen(
+            self.cmdline,
+            bufsize=0,
+            env=self.environ,
+            shell=self.shell,
+            cwd=cwd,
+            stdin=subprocess.PIPE,
+            stdout=stdout,
+            stderr=stderr,
+            close_fds=True,
+        )
+
+        self.backoff = 0.0005
+        self.deadline = self.terminated = None
+        self.started = time()
+
+        self._channels = {}
+        self._output = {}
+        for name in ('stdout', 'stderr'):
+            pipe = getattr(self.process, name)
+            if pipe:
+                set_cloexec(pipe.fileno())
+                self._channels[pipe.fileno()] = (name, pipe)
+                self._output[name] = (deque(), [0])
+        set_cloexec(self.process.stdin.fileno())
+
+        self._input = None
+        if data:
+            self._input = [data, 0]
+        else:
+            self.process.stdin.close()
+
+        self._partial = {}
+        if self.taillength:
+            self.tail = deque(maxlen=self.taillength)
+
+        self._tee = self.tee
+        if isinstance(self.tee, basestring):
+            self._tee = open(self.tee, 'ab')
+
+        if self.observer:
+            self.observer('spawn', self)
+
+    def _close_input(self):
+        self._input = None
+        try:
+            self.process.stdin.close()
+        except IOError:
+            pass
+
+    def _emit(self, name, line):
+        if self.tail is not None:
+            self.tail.append(line)
+        if self.callback:
+            self.callback(name, line)
+
+    def _finish(self):
+        if self._overdue() and self.process.poll() is not None:
+            # descendants of a timed out process may still hold its pipes open
+            for name, pipe in self._channels.itervalues():
+                pipe.close()
+            self._channels = {}
+            if self._input:
+                self._close_input()
+
+        if self._channels or self._input or self.process.poll() is None:
+            return False
+
+        if self._tee is not self.tee:
+            self._tee.close()
+
+        self.finished = time()
+        self.returncode = self.process.returncode
+        for name, (chunks, size) in self._output.iteritems():
+            value = ''.join(chunks)
+            if '\r' in value:
+                value = value.replace('\r\n', '\n').replace('\r', '\n')
+            setattr(self, name, value)
+
+        if self.observer:
+            self.observer('exit', self)
+        return True
+
+    def _overdue(self):
+        return self.terminated is not None or (self.deadline is not None
+            and time() >= self.deadline)
+
     def _parse_cmdline(self, cmdline):
         if isinstance(cmdline, basestring) and not self.shell:
             cmdline = shlex.split(cmdline)
         return cmdline
 
+    def _read(self, fd):
+        name, pipe = self._channels[fd]
+        try:
+            chunk = os.read(fd, 65536)
+        except OSError, exception:
+            if exception.errno == errno.EINTR:
+                return
+            chunk = ''
+
+        if chunk:
+            self._receive(name, chunk)
+        else:
+            del self._channels[fd]
+            pipe.close()
+            partial = self._partial.pop(name, None)
+            if partial:
+                self._emit(name, partial.rstrip('\r'))
+
+    def _receive(self, name, chunk):
+        self.received += len(chunk)
+        if self._tee:
+            self._tee.write(chunk)
+
+        if self.callback or self.tail is not None:
+            lines = (self._partial.pop(name, '') + chunk).split('\n')
+            if lines[-1]:
+                self._partial[name] = lines[-1]
+            for line in lines[:-1]:
+                self._emit(name, line.rstrip('\r'))
+
+        limit = self.limit
+        if limit == 0:
+            return
+
+        chunks, size = self._output[name]
+        chunks.append(chunk)
+        size[0] += len(chunk)
+        if limit:
+            while size[0] - len(chunks[0]) >= limit:
+                size[0] -= len(chunks.popleft())
+            if size[0] > limit:
+                chunks[0] = chunks[0][size[0] - limit:]
+                size[0] = limit
+
+    def _write(self):
+        data, offset = self._input
+        try:
+            offset += os.write(self.process.stdin.fileno(), data[offset:offset + select.PIPE_BUF])
+        except OSError, exception:
+            if exception.errno == errno.EPIPE:
+                return self._close_input()
+            elif exception.errno != errno.EINTR:
+                raise
+
+        if offset >= len(data):
+            self._close_input()
+        else:
+            self._input[1] = offset
+
+class ProcessMonitor(object):
+    """Runs processes concurrently, multiplexing their pipes on the calling
+    thread. A process which outlives ``timeout`` is sent SIGTERM, and then
+    SIGKILL if it is still running ``grace`` seconds later."""
+
+    interval = 0.05
+
+    def __init__(self, concurrency=None, timeout=None, grace=5):
+        self.concurrency = concurrency
+        self.grace = grace
+        self.timeout = timeout
+
+    def run(self, processes, data=None, cwd=None):
+        pending = deque(processes)
+        running = []
+        try:
+            while pending or running:
+                while pending and not (self.concurrency and len(running) >= self.concurrency):
+                    process = pending.popleft()
+                    process.start(data, cwd)
+                    if self.timeout is not None:
+                        process.deadline = process.started + self.timeout
+                    running.append(process)
+
+                self._poll(running)
+                self._enforce_deadlines(running)
+                running = [process for process in running if not process._finish()]
+        except BaseException:
+            for process in running:
+                if process.process.poll() is None:
+                    process.process.kill()
+                    process.process.wait()
+            raise
+        return processes
+
+    def _enforce_deadlines(self, running):
+        now = time()
+        for process in running:
+            if process.deadline is None or process.process.poll() is not None:
+                continue
+            if process.terminated is None:
+                if now >= process.deadline:
+                    process.timedout = True
+                    process.terminated = now
+                    process.process.terminate()
+            elif now >= process.terminated + self.grace:
+                process.process.kill()
+
+    def _poll(self, running):
+        process = running[0]
+        if len(running) == 1 and not (process._channels or process._input
+                or process.deadline is not None):
+            # nothing to service but the exit of the only process; with more
+            # than one, whichever exits first is reaped by polling instead
+            process.process.wait()
+            return
+
+        readers, writers = {}, {}
+        for process in running:
+            for fd in process._channels:
+                readers[fd] = process
+            if process._input:
+                writers[process.process.stdin.fileno()] = process
+
+        timeout = self._calculate_timeout(running)
+        if hasattr(select, 'poll'):
+            poller = select.poll()
+            for fd in readers:
+                poller.register(fd, select.POLLIN | select.POLLPRI)
+            for fd in writers:
+                poller.register(fd, select.POLLOUT)
+            if timeout is not None:
+                timeout = int(timeout * 1000)
+            try:
+                ready = [fd for fd, event in poller.poll(timeout)]
+            except select.error, exception:
+                if exception.args[0] != errno.EINTR:
+                    raise
+                ready = []
+        else:
+            try:
+                readable, writable, exceptional = select.select(readers.keys(),
+                    writers.keys(), [], timeout)
+            except select.error, exception:
+                if exception.args[0] != errno.EINTR:
+                    raise
+                readable = writable = []
+            ready = readable + writable
+
+        for fd in ready:
+            if fd in readers:
+                readers[fd]._read(fd)
+            elif fd in writers:
+                writers[fd]._write()
+
+    def _calculate_timeout(self, running):
+        timeout = None
+        now = time()
+        for process in running:
+            if not (process._channels or process._input):
+                # nothing left to read, so poll for the exit of the process,
+                # backing off from a millisecond up to the full interval
+                process.backoff = min(process.backoff * 2, self.interval)
+                if timeout is None or process.backoff < timeout:
+                    timeout = process.backoff
+            if process.deadline is not None:
+                if process.terminated is None:
+                    remaining = process.deadline - now
+                else:
+                    remaining = process.terminated + self.grace - now
+                if timeout is None or remaining < timeout:
+                    timeout = max(remaining, 0.001)
+        return timeout
@@ -0,0 +1,109 @@
+import json
+import os
+import threading
+from contextlib import contextmanager
+from time import time
+
+__all__ = ('Profiler',)
+
+class Profiler(object):
+    """Records the phases of each task, and the processes each task runs, as
+    a trace in the Chrome trace event format. If ``pstats`` names a
+    directory, the implementation of each task is also run under cProfile,
+    with the statistics for each task written there."""
+
+    def __init__(self, filename, pstats=None):
+        self.events = []
+        self.filename = filename
+        self.lock = threading.Lock()
+        self.pid = os.getpid()
+        self.profiled = {}
+        self.pstats = pstats
+        self.started = time()
+        self.threads = {}
+        self._local = threading.local()
+
+    def call(self, name, callable, *args, **params):
+        """Calls ``callable``, under cProfile if statistics are being kept,
+        saving the statistics for ``name``."""
+
+        # cProfile cannot nest on one thread, so a task executed by another
+        # task is profiled as part of the outer task
+        if not self.pstats or getattr(self._local, 'profiling', False):
+            return callable(*args, **params)
+
+        import cProfile
+        profile = cProfile.Profile()
+        self._local.profiling = True
+        try:
+            return profile.runcall(callable, *args, **params)
+        finally:
+            self._local.profiling = False
+            profile.dump_stats(self._allocate_pstats(name))
+
+    @contextmanager
+    def measure(self, name, category, **args):
+        started = time()
+        try:
+            yield args
+        finally:
+            self.record(name, category, started, time(), **args)
+
+    def record(self, name, category, started, finished, **args):
+        event = {
+            'name': name,
+            'cat': category,
+            'ph': 'X',
+            'pid': self.pid,
+            'tid': self._identify_thread(),
+            'ts': int((started - self.started) * 1000000),
+            'dur': int((finished - started) * 1000000),
+        }
+        if args:
+            event['args'] = args
+        with self.lock:
+            self.events.append(event)
+
+    def record_process(self, process):
+        cmdline = process.cmdline
+        if not isinstance(cmdline, basestring):
+            cmdline = ' '.join(cmdline)
+
+        self.record(os.path.basename(cmdline.split(' ', 1)[0]), 'process', process.started,
+            process.finished or time(), cmdline=cmdline, returncode=process.returncode,
+            received=process.received, timedout=process.timedout)
+
+    def save(self):
+        if not self.filename:
+            return
+
+        with self.lock:
+            events = list(self.events)
+            for thread, (tid, name) in sorted(self.threads.iteritems()):
+                events.append({'name': 'thread_name', 'ph': 'M', 'pid': self.pid,
+                    'tid': tid, 'args': {'name': name}})
+
+        temporary = '%s.tmp' % self.filename
+        with open(temporary, 'w') as openfile:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, openfile)
+        os.rename(temporary, self.filename)
+
+    def _allocate_pstats(self, name):
+        with self.lock:
+            count = self.profiled[name] = self.profiled.get(name, 0) + 1
+            if not os.path.isdir(self.pstats):
+                os.makedirs(self.pstats)
+        if count > 1:
+            name = '%s-%d' % (name, count)
+        return os.path.join(self.pstats, '%s.pstats' % name)
+
+    def _identify_thread(self):
+        thread = threading.current_thread()
+        identity = thread.ident
+        try:
+            return self.threads[identity][0]
+        except KeyError:
+            with self.lock:
+                if identity not in self.threads:
+                    self.threads[identity] = (len(self.threads) + 1, thread.name)
+                return self.threads[identity][0]
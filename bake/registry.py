@@ -0,0 +1,210 @@
+import ast
+import imp
+import marshal
+import os
+
+__all__ = ('ModuleIndex',)
+
+class ModuleIndex(object):
+    """A persistent index of the tasks defined by task modules, found by
+    scanning the source of each module rather than importing it, and keyed
+    on the path, size and modification time of the source."""
+
+    filename = 'modules'
+    version = 1
+
+    def __init__(self, cachedir=None):
+        self.cachedir = cachedir
+        self.dirty = False
+        self.entries = None
+
+    def save(self):
+        if not (self.dirty and self.cachedir):
+            return
+
+        filename = os.path.join(self.cachedir, self.filename)
+        temporary = '%s.%d' % (filename, os.getpid())
+        try:
+            if not os.path.isdir(self.cachedir):
+                os.makedirs(self.cachedir)
+            with open(temporary, 'wb') as openfile:
+                marshal.dump((self.version, self.entries), openfile)
+            os.rename(temporary, filename)
+        except EnvironmentError:
+            pass
+        self.dirty = False
+
+    def scan(self, module):
+        """Returns the names of the tasks defined by ``module``, or None if
+        the module must be imported, either because it defines an
+        environment or because its tasks cannot be determined from its
+        source."""
+
+        filename = _locate_module(module)
+        if not filename:
+            return None
+
+        try:
+            status = os.stat(filename)
+        except OSError:
+            return None
+
+        signature = (filename, status.st_size, status.st_mtime)
+        entries = self._load()
+
+        entry = entries.get(module)
+        if entry and entry[0] == signature:
+            return entry[1]
+
+        try:
+            with open(filename, 'rU') as openfile:
+                names = _scan_source(openfile.read(), filename)
+        except (EnvironmentError, SyntaxError, TypeError):
+            return None
+
+        entries[module] = (signature, names)
+        self.dirty = True
+        return names
+
+    def _load(self):
+        if self.entries is None:
+            self.entries = {}
+            if self.cachedir:
+                try:
+                    with open(os.path.join(self.cachedir, self.filename), 'rb') as openfile:
+                        version, entries = marshal.load(openfile)
+                except (EnvironmentError, EOFError, ValueError, TypeError):
+                    pass
+                else:
+                    if version == self.version:
+                        self.entries = entries
+        return self.entries
+
+def _locate_module(module):
+    # finds the source of a module without importing it or its packages
+    if ':' in module:
+        return None
+
+    filename, searchpath = None, None
+    for token in module.split('.'):
+        if filename:
+            return None
+        try:
+            openfile, pathname, (suffix, mode, kind) = imp.find_module(token, searchpath)
+        except ImportError:
+            return None
+        if openfile:
+            openfile.close()
+
+        if kind == imp.PKG_DIRECTORY:
+            searchpath = [pathname]
+        elif kind == imp.PY_SOURCE:
+            filename = pathname
+        else:
+            return None
+
+    if filename is None:
+        filename = os.path.join(searchpath[0], '__init__.py')
+        if not os.path.exists(filename):
+            return None
+    return os.path.abspath(filename)
+
+def _scan_source(source, filename):
+    module = ast.parse(source, filename)
+    if any(_binds_environment(node) for node in _walk_statements(module.body)):
+        return None
+
+    # classes are only tasks if they derive from Task, possibly through
+    # another class in the module; a class which names itself but derives
+    # from a class defined elsewhere cannot be judged from the source
+    names, tasks, others = [], set(['Task']), set(['object'])
+    for node in module.body:
+        if isinstance(node, ast.ClassDef):
+            name = _scan_class_name(node)
+            bases = [_scan_base(base) for base in node.bases]
+            if any(base in tasks for base in bases):
+                tasks.add(node.name)
+                if name:
+                    names.append(name)
+            elif all(base in others for base in bases):
+                others.add(node.name)
+            elif name:
+                return None
+        elif isinstance(node, ast.FunctionDef):
+            for decorator in node.decorator_list:
+                name = _scan_task_decorator(decorator, node.name)
+                if name:
+                    names.append(name)
+
+    # a module without any recognizable tasks may define them dynamically
+    return names or None
+
+def _binds_environment(node):
+    if isinstance(node, ast.Assign):
+        return any(_names_environment(target) for target in node.targets)
+    elif isinstance(node, (ast.AugAssign, ast.For)):
+        return _names_environment(node.target)
+    elif isinstance(node, ast.With):
+        return node.optional_vars is not None and _names_environment(node.optional_vars)
+    elif isinstance(node, (ast.Import, ast.ImportFrom)):
+        for alias in node.names:
+            if alias.name == '*' or (alias.asname or alias.name.split('.')[0]) == 'environment':
+                return True
+    elif isinstance(node, (ast.ClassDef, ast.FunctionDef)):
+        return node.name == 'environment'
+    return False
+
+def _names_environment(target):
+    for node in ast.walk(target):
+        if isinstance(node, ast.Name) and node.id == 'environment':
+            return True
+    return False
+
+def _scan_base(base):
+    if isinstance(base, ast.Name):
+        return base.id
+    elif isinstance(base, ast.Attribute) and base.attr == 'Task':
+        return 'Task'
+
+def _scan_class_name(node):
+    for statement in node.body:
+        if (isinstance(statement, ast.Assign) and isinstance(statement.value, ast.Str)
+                and any(isinstance(target, ast.Name) and target.id == 'name'
+                    for target in statement.targets)):
+            return statement.value.s
+
+def _walk_statements(statements):
+    # yields the statements executed when the module is imported, including
+    # those nested in compound statements but not in functions or classes
+    for node in statements:
+        yield node
+        for field in ('body', 'orelse', 'finalbody', 'handlers'):
+            if isinstance(node, (ast.ClassDef, ast.FunctionDef)):
+                break
+            children = getattr(node, field, None)
+            if children:
+                for child in _walk_statements(children):
+                    yield child
+
+def _scan_task_decorator(decorator, default):
+    if not isinstance(decorator, ast.Call):
+        return None
+
+    function = decorator.func
+    if isinstance(function, ast.Attribute):
+        function = function.attr
+    elif isinstance(function, ast.Name):
+        function = function.id
+    if function != 'task':
+        return None
+
+    if decorator.args:
+        if isinstance(decorator.args[0], ast.Str):
+            return decorator.args[0].s
+        return None
+    for keyword in decorator.keywords:
+        if keyword.arg == 'name':
+            if isinstance(keyword.value, ast.Str):
+                return keyword.value.s
+            return None
+    return default
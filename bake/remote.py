@@ -0,0 +1,287 @@
+import json
+import socket
+from hmac import compare_digest
+from threading import Thread
+
+from bake.environment import Environment
+from bake.exceptions import *
+from bake.task import Task, Tasks
+
+__all__ = ('RemoteWorker', 'WorkerServer', 'is_loopback', 'parse_address')
+
+# the runtime flags a coordinator imposes on the workers executing its tasks
+FLAGS = ('color', 'dryrun', 'force', 'quiet', 'strict', 'timestamps', 'timing', 'verbose')
+
+def is_loopback(host):
+    try:
+        return socket.gethostbyname(host).startswith('127.')
+    except socket.error:
+        return False
+
+def parse_address(address):
+    """Parses ``address``, either ``host:port`` or a port, to a ``(host, port)``
+    tuple."""
+
+    host, port = 'localhost', address
+    if ':' in address:
+        host, port = address.rsplit(':', 1)
+    try:
+        return host or 'localhost', int(port)
+    except ValueError:
+        raise ValueError('invalid address %r' % address)
+
+def receive(fileobj):
+    line = fileobj.readline()
+    if line:
+        return json.loads(line)
+
+def send(fileobj, **message):
+    fileobj.write(json.dumps(message, default=str) + '\n')
+    fileobj.flush()
+
+class RemoteLog(object):
+    """A log which relays the messages recorded during the invocation ``id``
+    to a coordinator, so that they reach its own log and event stream, as
+    well as to ``log``, if specified."""
+
+    def __init__(self, fileobj, id, log=None):
+        self.fileobj = fileobj
+        self.id = id
+        self.log = log
+
+    def write(self, level, message, context=None):
+        send(self.fileobj, type='log', id=self.id, level=level, message=message,
+            context=context)
+        if self.log:
+            self.log.write(level, message, context)
+
+class RemoteStream(object):
+    """A stream which relays what is written to it to a coordinator, as the
+    output of the invocation ``id``."""
+
+    def __init__(self, fileobj, id):
+        self.fileobj = fileobj
+        self.id = id
+
+    def flush(self):
+        pass
+
+    def write(self, data):
+        send(self.fileobj, type='output', id=self.id, data=data)
+
+class WorkerServer(object):
+    """Serves the task invocations of coordinators, one connection at a time.
+    Each invocation names a task by its full name and carries the environment
+    of the coordinator, which is overlaid on the environment of the worker;
+    the output of the task is streamed back, followed by its status.
+
+    Since a worker executes whatever a coordinator asks of it, it only listens
+    on a loopback address unless the runtime has a token, which coordinators
+    must then present when they connect."""
+
+    def __init__(self, runtime, address):
+        self.address = parse_address(address)
+        self.runtime = runtime
+        self.socket = None
+        self.stopped = False
+
+    def close(self):
+        self.stopped = True
+        listener, self.socket = self.socket, None
+        if listener:
+            # shutting the socket down wakes a thread blocked accepting on it
+            try:
+                listener.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+            listener.close()
+
+    def listen(self):
+        if not self.runtime.token and not is_loopback(self.address[0]):
+            raise ValueError('a token is required to serve on a non-loopback address')
+
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.socket.bind(self.address)
+        self.socket.listen(5)
+        self.stopped = False
+
+        self.address = self.socket.getsockname()[:2]
+        return self.address
+
+    def serve(self):
+        listener = self.socket
+        while not self.stopped:
+            try:
+                connection, peer = listener.accept()
+            except socket.error:
+                if self.stopped:
+                    break
+                raise
+            try:
+                self._serve_connection(connection)
+            except (EnvironmentError, ValueError):
+                pass
+            finally:
+                connection.close()
+
+    def _execute(self, writer, invocation):
+        runtime, id = self.runtime, invocation['id']
+        flags = invocation.get('flags') or {}
+        original = dict((flag, getattr(runtime, flag)) for flag in FLAGS)
+        for flag in FLAGS:
+            setattr(runtime, flag, bool(flags.get(flag)))
+
+        log, stream = runtime.log, runtime.stream
+        if invocation.get('record'):
+            runtime.log = RemoteLog(writer, id, log)
+        runtime.stream = RemoteStream(writer, id)
+        try:
+            status = self._execute_task(invocation)
+        finally:
+            runtime.log, runtime.stream = log, stream
+            for flag, value in original.iteritems():
+                setattr(runtime, flag, value)
+        send(writer, type='result', id=id, status=status)
+
+    def _execute_task(self, invocation):
+        runtime = self.runtime
+        try:
+            task = self._find_task(invocation['task'], invocation['name'])(runtime, True)
+        except TaskError, exception:
+            runtime.error(exception.args[0])
+            return Task.FAILED
+
+        environment = Environment(invocation.get('environment') or {})
+        try:
+            runtime.execute(task, environment)
+        except TaskFailed:
+            return Task.FAILED
+        except Exception:
+            runtime.error('task raised exception', True)
+            return Task.FAILED
+        finally:
+            if runtime._hashcache is not None:
+                runtime._hashcache.save()
+        return task.status
+
+    def _find_task(self, fullname, name):
+        task = Tasks.by_fullname.get(fullname)
+        if task is None:
+            # the module defining the task may not have been imported yet
+            try:
+                Tasks.get(name)
+            except MultipleTasksError:
+                pass
+            task = Tasks.by_fullname.get(fullname)
+
+        if task is None:
+            raise UnknownTaskError('no task named %r' % fullname)
+        return task
+
+    def _serve_connection(self, connection):
+        reader, writer = connection.makefile('rb'), connection.makefile('wb')
+        try:
+            message = receive(reader)
+            if not (message and message.get('type') == 'hello' and self._verify(message)):
+                send(writer, type='refused')
+                return
+
+            send(writer, type='welcome')
+            while True:
+                message = receive(reader)
+                if message is None:
+                    break
+                if message.get('type') == 'execute':
+                    self._execute(writer, message)
+        finally:
+            reader.close()
+            writer.close()
+
+    def _verify(self, message):
+        token = self.runtime.token
+        if not token:
+            return True
+        return compare_digest(str(message.get('token') or ''), str(token))
+
+class RemoteWorker(Thread):
+    """A worker thread which dispatches the tasks it takes from a scheduler to
+    the worker at ``address``, relaying the output and status of each. Should
+    the connection be lost, the task is executed locally, as are all tasks
+    this thread takes afterwards."""
+
+    def __init__(self, scheduler, address, queue, results, timeout=10):
+        Thread.__init__(self)
+        self.address = address
+        self.daemon = True
+        self.queue = queue
+        self.results = results
+        self.scheduler = scheduler
+        self.sequence = 0
+
+        self.connection = socket.create_connection(parse_address(address), timeout)
+        self.connection.settimeout(None)
+        self.reader = self.connection.makefile('rb')
+        self.writer = self.connection.makefile('wb')
+
+        send(self.writer, type='hello', token=scheduler.runtime.token)
+        reply = receive(self.reader)
+        if not (reply and reply.get('type') == 'welcome'):
+            self.close()
+            raise EnvironmentError('connection refused by worker')
+
+    def close(self):
+        if self.connection:
+            for fileobj in (self.reader, self.writer, self.connection):
+                try:
+                    fileobj.close()
+                except EnvironmentError:
+                    pass
+            self.connection = None
+
+    def run(self):
+        try:
+            while True:
+                task = self.queue.get()
+                if task is None:
+                    break
+
+                result = None
+                if self.connection:
+                    try:
+                        result = self._dispatch(task)
+                    except (EnvironmentError, ValueError), exception:
+                        self.scheduler.runtime.error('[!R]lost worker %s[!] (%s); continuing locally'
+                            % (self.address, str(exception) or 'connection closed'))
+                        self.close()
+                if result is None:
+                    result = self.scheduler._execute(task)
+                self.results.put(result)
+        finally:
+            self.close()
+
+    def _dispatch(self, task):
+        runtime = self.scheduler.runtime
+        self.sequence += 1
+
+        send(self.writer, type='execute', id=self.sequence, task=task.fullname,
+            name=task.name, environment=runtime.environment.environment,
+            record=bool(runtime.log or runtime.events), flags=dict((flag, getattr(runtime, flag)) for flag in FLAGS))
+        runtime.emit('task.dispatched', task=task.name, worker=self.address)
+
+        while True:
+            message = receive(self.reader)
+            if message is None:
+                raise EnvironmentError()
+            if message.get('id') != self.sequence:
+                continue
+
+            if message['type'] == 'output':
+                runtime._write(message['data'])
+            elif message['type'] == 'log':
+                runtime._record_message(message['level'], message['message'],
+                    message.get('context'))
+            elif message['type'] == 'result':
+                task.status = message['status']
+                runtime.emit('task.%s' % task.status, task=task.name, worker=self.address)
+                return task, task.status in (Task.COMPLETED, Task.SKIPPED), None
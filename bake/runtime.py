@@ -3,24 +3,39 @@ import optparse
 import os
 import sys
 import textwrap
+import threading
 from ConfigParser import SafeConfigParser
 from datetime import datetime
 from operator import attrgetter
 from tempfile import mkstemp
+from time import time
 from textwrap import dedent
 from traceback import format_exc
-from urllib import urlretrieve
 
+from bake.artifacts import open_store
 from bake.color import ansify
 from bake.environment import *
+from bake.events import EventStream
 from bake.exceptions import *
+from bake.logsink import LogSink
+from bake.lib import import_libraries
 from bake.path import path
-from bake.process import Process
-from bake.task import Tasks, Task
+from bake.process import Process, ProcessFailure, ProcessMonitor
+from bake.profiling import Profiler
+from bake.registry import ModuleIndex
+from bake.remote import WorkerServer
+from bake.scheduler import Scheduler
+from bake.state import DiscoveryCache, HashCache, StateStore
+from bake.task import ResolutionCache, Tasks, Task
 from bake.util import import_object, import_source, topological_sort
 
 BAKEFILES = ('bakefile', 'bakefile.py')
+ENV_ARTIFACTS = 'BAKE_ARTIFACTS'
+ENV_BAKEFILE = 'BAKE_FILE'
+ENV_CACHE = 'BAKE_CACHE'
 ENV_MODULES = 'BAKE_MODULES'
+ENV_TOKEN = 'BAKE_WORKER_TOKEN'
+ENV_WORKERS = 'BAKE_WORKERS'
 
 USAGE = 'Usage: %s [options] %s [param=value] ...'
 DESCRIPTION = """
@@ -29,55 +44,78 @@ Useful information here.
 
 class OptionParser(optparse.OptionParser):
     options = (
+        ('    --artifacts LOCATION', 'restore and store task outputs at specified directory or url'),
         ('-c, --color', 'use color in output'),
         ('-d, --dryrun', 'run tasks in dry-run mode'),
         ('-e, --env FILE', 'populate runtime environment with specified file'),
+        ('    --events TARGET', 'write events as json lines to specified file or fd'),
+        ('-f, --force', 'execute tasks even if they are up to date'),
         ('-h, --help [TASK]', 'display help on specified task'),
         ('-i, --interactive', 'run tasks in interactive mode'),
+        ('-j, --jobs N', 'run up to N independent tasks concurrently'),
+        ('-k, --keep-going', 'continue with unaffected tasks after a failure'),
         ('-l, --log FILE', 'log messages to specified file'),
+        ('    --log-level LEVEL', 'log error, info or debug messages to file (default info)'),
         ('-m, --module MODULE', 'load tasks from specified module'),
         ('-n, --nosearch', 'do not search parent directories for bakefile'),
         ('-N, --nobakefile', 'do not use bakefile'),
         ('-p, --path PATH', 'run tasks under specified path'),
         ('    --prefix PREFIX', 'apply specified prefix to task names'),
+        ('    --profile FILE', 'write a trace of task execution to specified file'),
+        ('    --pstats DIR', 'profile each task, writing statistics to specified directory'),
         ('-P, --pythonpath PATH', 'add specified path to python path'),
         ('-q, --quiet', 'only log error messages'),
+        ('    --serve ADDRESS', 'serve any task sent to specified address, which must be'
+            ' loopback unless $BAKE_WORKER_TOKEN is set'),
         ('-S, --strict', 'only honor explicitly specified parameters'),
         ('-t, --timestamps', 'include timestamps on all log messages'),
         ('-T, --timing', 'display timing information for each task'),
         ('-v, --verbose', 'log all messages'),
         ('-V, --version', 'display version information'),
+        ('-W, --worker ADDRESS', 'dispatch tasks to worker at specified address'),
     )
 
     def __init__(self):
         optparse.OptionParser.__init__(self, add_help_option=False)
-        self.set_defaults(color=False, dryrun=False, help=False, interactive=False,
+        self.set_defaults(color=False, dryrun=False, force=False, help=False, interactive=False,
             nosearch=False, nobakefile=False, quiet=False, verbose=False, version=False,
-            strict=False, timing=False)
+            strict=False, timing=False, keepgoing=False)
 
+        self.add_option('--artifacts', dest='artifacts')
         self.add_option('-c', '--color', action='store_true', dest='color')
         self.add_option('-d', '--dryrun', action='store_true', dest='dryrun')
         self.add_option('-e', '--env', action='append', dest='sources')
+        self.add_option('--events', dest='events')
+        self.add_option('-f', '--force', action='store_true', dest='force')
         self.add_option('-h', '--help', action='store_true', dest='help')
         self.add_option('-i', '--interactive', action='store_true', dest='interactive')
+        self.add_option('-j', '--jobs', type='int', dest='jobs')
+        self.add_option('-k', '--keep-going', action='store_true', dest='keepgoing')
         self.add_option('-l', '--log', dest='logfile')
+        self.add_option('--log-level', dest='loglevel', choices=('error', 'info', 'debug'))
         self.add_option('-m', '--module', action='append', dest='modules')
         self.add_option('-n', '--nosearch', action='store_true', dest='nosearch')
         self.add_option('-N', '--nobakefile', action='store_true', dest='nobakefile')
         self.add_option('-p', '--path', dest='path')
         self.add_option('--prefix', dest='prefix')
+        self.add_option('--profile', dest='profile')
+        self.add_option('--pstats', dest='pstats')
         self.add_option('-P', '--pythonpath', action='append', dest='pythonpath')
         self.add_option('-q', '--quiet', action='store_true', dest='quiet')
+        self.add_option('--serve', dest='serve')
         self.add_option('-S', '--strict', action='store_true', dest='strict')
         self.add_option('-t', '--timestamps', action='store_true', dest='timestamps')
         self.add_option('-T', '--timing', action='store_true', dest='timing')
         self.add_option('-v', '--verbose', action='store_true', dest='verbose')
         self.add_option('-V', '--version', action='store_true', dest='version')
+        self.add_option('-W', '--worker', action='append', dest='workers')
 
     def error(self, msg):
         raise RuntimeError(msg)
 
     def generate_help(self, runtime):
+        import_libraries()
+        Tasks.import_deferred()
         sections = [USAGE % (runtime.executable, '{task}'), DESCRIPTION.strip()]
 
         length = 0
@@ -152,47 +190,110 @@ class OptionParser(optparse.OptionParser):
 class Runtime(object):
     """The bake runtime."""
 
-    flags = ('color', 'dryrun', 'interactive', 'nobakefile', 'nosearch',
-        'quiet', 'strict', 'timestamps', 'timing', 'verbose')
+    flags = ('color', 'dryrun', 'force', 'interactive', 'keepgoing', 'nobakefile',
+        'nosearch', 'quiet', 'strict', 'timestamps', 'timing', 'verbose')
 
     def __init__(self, executable='bake', environment=None, stream=sys.stdout,
             modules=None, **params):
 
+        self.artifacts = params.get('artifacts', None)
+        self.cleanups = []
         self.completed = []
-        self.context = []
         self.environment = Environment(environment or {})
         self.executable = executable
         self.modules = set(modules or [])
         self.queue = []
+        self.resolutions = ResolutionCache()
+        self.serving = False
         self.stream = stream
 
+        self._flushed = 0
+        self._flusher = None
+        self._local = threading.local()
+        self._hashcache = None
+        self._lock = threading.Lock()
+        self._pathexclusive = False
+        self._pathholders = 0
+        self._paths = threading.Condition()
+        self._state = None
+
+        self.cachedir = params.get('cachedir', None)
+        if self.cachedir is None:
+            self.cachedir = os.environ.get(ENV_CACHE) or os.path.join(
+                os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache'), 'bake')
+
         self.color = params.get('color', False)
         self.dryrun = params.get('dryrun', False)
+        self.events = params.get('events', None)
+        self.force = params.get('force', False)
+        self.flush_interval = params.get('flush_interval', 0.5)
         self.interactive = params.get('interactive', False)
+        self.jobs = params.get('jobs', 1)
+        self.keepgoing = params.get('keepgoing', False)
+        self.log = params.get('log', None)
         self.logfile = params.get('logfile', None)
+        self.loglevel = params.get('loglevel', 'info')
         self.nobakefile = params.get('nobakefile', False)
         self.nosearch = params.get('nosearch', False)
         self.path = params.get('path', None)
         self.prefix = params.get('prefix', None)
+        self.profiler = params.get('profiler', None)
         self.quiet = params.get('quiet', False)
         self.strict = params.get('strict', False)
         self.timestamps = params.get('timestamps', False)
         self.timing = params.get('timing', False)
+        self.token = params.get('token', None)
         self.verbose = params.get('verbose', False)
+        self.workers = list(params.get('workers') or [])
+
+    def add_cleanup(self, callback):
+        """Registers ``callback`` to be called when this runtime shuts down."""
+        with self._lock:
+            self.cleanups.append(callback)
+
+    def remove_cleanup(self, callback):
+        """Withdraws ``callback``, if it is registered."""
+        with self._lock:
+            if callback in self.cleanups:
+                self.cleanups.remove(callback)
+
+    @property
+    def context(self):
+        try:
+            return self._local.context
+        except AttributeError:
+            context = self._local.context = []
+            return context
 
     @property
     def curdir(self):
         return path(os.getcwd())
 
+    @property
+    def hashcache(self):
+        with self._lock:
+            if self._hashcache is None:
+                self._hashcache = HashCache(self.path or os.getcwd())
+            return self._hashcache
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._state is None:
+                self._state = StateStore(self.path or os.getcwd())
+            return self._state
+
     def chdir(self, path):
         curdir = self.curdir
         if self.verbose:
             self.info('changing directory to %s' % path)
 
+        self._claim_path()
         os.chdir(str(path))
         return curdir
 
     def check(self, message, default=False):
+        self.flush()
         token = {True: 'y', False: 'n'}[default]
         if self.context:
             message = '[%s] %s' % (' '.join(self.context), message)
@@ -205,12 +306,19 @@ class Runtime(object):
             elif response[0] == 'n':
                 return False
 
+    def emit(self, event, **fields):
+        if self.events:
+            self.events.emit(event, **fields)
+
     def error(self, message, exception=False, asis=False):
         if not message:
             return
         if exception:
             message = '[!R]%s[!]\n%s' % (message.rstrip(), format_exc())
+        if self.events or self.log:
+            self._record_message('error', message)
         self._report_message(message, asis)
+        self.flush()
 
     def execute(self, task, environment=None, **params):
         if environment or params:
@@ -218,8 +326,8 @@ class Runtime(object):
 
         if isinstance(task, basestring):
             task = Tasks.get(task)(self)
-        if task.independent:
-            self._reset_path()
+        if self._hold_path(task.independent) is False:
+            raise TaskFailed()
 
         self.context.append(task.name)
         try:
@@ -227,8 +335,16 @@ class Runtime(object):
                 raise TaskFailed()
         finally:
             self.context.pop()
+            self.flush()
+            self._release_path()
+
+    def flush(self):
+        with self._lock:
+            self._flush()
 
     def info(self, message, asis=False):
+        if message and (self.events or self.log):
+            self._record_message('debug', message)
         if not (message and self.verbose):
             return
         self._report_message(message, asis)
@@ -249,17 +365,45 @@ class Runtime(object):
             if flagged:
                 setattr(self, flag, True)
 
+        if options.jobs:
+            self.jobs = options.jobs
         if options.logfile:
             self.logfile = options.logfile
+        if options.loglevel:
+            self.loglevel = options.loglevel
+        if self.logfile and not self.log:
+            try:
+                self.log = LogSink(self.logfile, self.loglevel)
+            except (EnvironmentError, ValueError), exception:
+                self.error('cannot open log %r: %s' % (self.logfile, exception))
+                return False
         if options.prefix:
             self.prefix = options.prefix
+        artifacts = options.artifacts or os.environ.get(ENV_ARTIFACTS)
+        if artifacts:
+            self.artifacts = open_store(artifacts)
+        if options.workers:
+            self.workers.extend(options.workers)
+        if os.environ.get(ENV_WORKERS):
+            self.workers.extend(os.environ[ENV_WORKERS].split())
+        if os.environ.get(ENV_TOKEN):
+            self.token = os.environ[ENV_TOKEN]
+        if options.events:
+            try:
+                self.events = EventStream(options.events)
+            except (EnvironmentError, ValueError), exception:
+                self.error('cannot open event stream %r: %s' % (options.events, exception))
+                return False
+        if options.profile or options.pstats:
+            self.profiler = Profiler(options.profile and os.path.abspath(options.profile),
+                options.pstats and os.path.abspath(options.pstats))
 
         for addition in (options.pythonpath or []):
             sys.path.insert(0, addition)
         sys.path.insert(0, '.')
 
         if options.path:
-            self.path = options.path
+            self.path = os.path.abspath(options.path)
         if self.path:
             if self._reset_path() is False:
                 return False
@@ -272,12 +416,23 @@ class Runtime(object):
         if ENV_MODULES in os.environ:
             modules.update(os.environ[ENV_MODULES].split(' '))
 
-        for module in modules:
-            if self.load(module) is False:
+        # modules whose tasks can be determined from their source are only
+        # imported once one of those tasks is requested
+        index = ModuleIndex(self.cachedir)
+        for module in sorted(modules):
+            names = index.scan(module)
+            if names:
+                Tasks.defer(module, names)
+            elif self.load(module) is False:
                 return False
+        index.save()
         
         if not self.nobakefile:
+            started = time()
             bakefile = self._find_bakefile(options.nosearch)
+            if self.timing:
+                self.report('bakefile discovery: %s (%0.03fs)' % (
+                    bakefile or 'none found', time() - started))
             if bakefile:
                 if self.load(bakefile) is False:
                     return False
@@ -299,11 +454,26 @@ class Runtime(object):
                 elif task is False:
                     return False
 
+        if options.serve and self.queue:
+            self.error('tasks cannot be specified for a worker')
+            return False
+
         try:
+            if options.serve:
+                return self.serve(options.serve)
             return self.run()
         except TaskError, exception:
             self.error(exception.args[0])
             return False
+        finally:
+            if self.profiler:
+                self.profiler.save()
+            self.shutdown()
+            if self.events:
+                self.events.close()
+            if self.log:
+                self.log.close()
+            self.flush()
 
     def linefeed(self, n=1):
         if self.quiet:
@@ -316,7 +486,7 @@ class Runtime(object):
             if target[-3:] == '.py':
                 Tasks.current_source = path(target).relpath()
                 try:
-                    namespace = import_source(target)
+                    namespace = import_source(target, self.cachedir)
                 finally:
                     Tasks.current_source = None
                 environment = namespace.get('environment')
@@ -335,6 +505,7 @@ class Runtime(object):
             self.environment.merge(environment)
 
     def prompt(self, message, default=None):
+        self.flush()
         if self.context:
             message = '[!b][%s][!] %s' % (' '.join(self.context), message)
         if default is not None:
@@ -348,12 +519,30 @@ class Runtime(object):
         else:
             return response
 
+    def observe(self, event, process):
+        """Called by a process this runtime started when it is spawned and
+        when it exits."""
+
+        if self.events:
+            fields = {'cmdline': process.cmdline, 'pid': process.process.pid,
+                'task': ' '.join(self.context) or None}
+            if event == 'exit':
+                fields.update(duration=process.finished - process.started,
+                    received=process.received, returncode=process.returncode,
+                    timedout=process.timedout)
+            self.events.emit('process.%s' % event, **fields)
+        if self.profiler and event == 'exit':
+            self.profiler.record_process(process)
+
     def report(self, message, asis=False):
+        if message and (self.events or self.log):
+            self._record_message('info', message)
         if not message or self.quiet:
             return
         self._report_message(message, asis)
 
     def retrieve(self, url, filename):
+        from urllib import urlretrieve
         try:
             urlretrieve(url, filename)
         except Exception:
@@ -375,18 +564,22 @@ class Runtime(object):
                 task.dependencies.add(tasks[requirement])
 
         graph = dict((task, task.dependencies) for task in tasks.itervalues())
-        self.queue = topological_sort(graph)
+        order = topological_sort(graph, attrgetter('name'))
 
-        while self.queue:
-            task = self.queue.pop(0)
-            try:
-                self.execute(task)
-            except TaskFailed:
+        jobs, workers = self.jobs, self.workers
+        if self.interactive:
+            jobs, workers = 1, None
+
+        scheduler = Scheduler(self, graph, order, jobs, self.keepgoing, workers)
+        try:
+            if not scheduler.run():
                 return False
-            else:
-                self.completed.append(task)
+        finally:
+            if self._hashcache is not None:
+                self._hashcache.save()
 
     def run_script(self, script):
+        self.flush()
         fileno, filename = mkstemp('.sh', 'bake')
         os.write(fileno, dedent(script))
         os.close(fileno)
@@ -394,17 +587,82 @@ class Runtime(object):
         self.shell(['bash', '-x', filename], merge_output=True)
         os.unlink(filename)
 
+    def serve(self, address):
+        """Serves as a worker on ``address``, executing the tasks dispatched
+        by coordinators until interrupted."""
+
+        server = WorkerServer(self, address)
+        try:
+            host, port = server.listen()
+        except (EnvironmentError, ValueError), exception:
+            self.error('cannot listen on %r: %s' % (address, exception))
+            return False
+
+        self.interactive = False
+        self.serving = True
+        self.report('worker listening on %s:%d' % (host, port))
+        self.flush()
+        try:
+            server.serve()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.close()
+            self.serving = False
+
     def shell(self, cmdline, data=None, environ=None, shell=False, timeout=None,
-            merge_output=False, passthrough=True):
+            merge_output=False, passthrough=True, stream=None, tee=None, tail=20, limit=None):
 
+        # the output of a worker is streamed so that it reaches the coordinator
+        if stream is None:
+            stream = passthrough and (self.jobs > 1 or self.serving)
+
+        callback = None
         if passthrough:
             passthrough = self.verbose
+            if passthrough and stream:
+                callback = self._report_output
+                passthrough = False
 
-        process = Process(cmdline, environ, shell, merge_output, passthrough)
+        process = Process(cmdline, environ, shell, merge_output, passthrough, limit,
+            callback, tee, tail)
+        process.observer = self.observe
         process.run(self, data, timeout)
         return process
 
+    def shell_many(self, cmdlines, environ=None, shell=False, timeout=None, concurrency=None,
+            merge_output=False, passthrough=False, limit=None, passive=False, cwd=None, tail=20):
+
+        if passthrough:
+            passthrough = self.verbose
+
+        processes = []
+        for cmdline in cmdlines:
+            process = Process(cmdline, environ, shell, merge_output, passthrough, limit, tail=tail)
+            process.observer = self.observe
+            processes.append(process)
+            self.info('shell: %s' % ' '.join(process.cmdline))
+
+        # output passed through by the processes must follow what precedes it
+        if passthrough:
+            self.flush()
+        ProcessMonitor(concurrency, timeout).run(processes, cwd=cwd)
+        if not passive:
+            for process in processes:
+                if process.returncode != 0:
+                    raise ProcessFailure(process.returncode, process)
+        return processes
+
+    def shutdown(self):
+        while self.cleanups:
+            callback = self.cleanups.pop()
+            try:
+                callback()
+            except Exception:
+                self.error('cleanup failed', True)
+
     def spawn(self, cmdline, environment=None):
+        self.flush()
         if isinstance(cmdline, basestring):
             cmdline = shlex.split(cmdline)
         if environment:
@@ -430,27 +688,51 @@ class Runtime(object):
         self.report('bake 1.0.a1')
 
     def _find_bakefile(self, nosearch=False):
-        path = self.path
-        for bakefile in BAKEFILES:
-            candidate = os.path.join(path, bakefile)
-            if os.path.exists(candidate):
-                return candidate
+        if os.environ.get(ENV_BAKEFILE):
+            return os.environ[ENV_BAKEFILE]
 
+        start = os.path.abspath(self.path)
         if nosearch:
+            for bakefile in BAKEFILES:
+                candidate = os.path.join(start, bakefile)
+                if os.path.exists(candidate):
+                    return candidate
             return
 
-        path = os.path.dirname(path)
+        cache = DiscoveryCache(self.cachedir)
+        found, bakefile = cache.get(start)
+        if found:
+            return bakefile
+
+        bakefile, searched = self._search_for_bakefile(start)
+        cache.set(start, bakefile, searched)
+        return bakefile
+
+    def _search_for_bakefile(self, path):
+        # the search ascends no further than the root of a git repository
+        # or the boundary of the filesystem
+        searched = []
+        status = os.stat(path)
         while True:
+            searched.append((path, status.st_mtime))
             for bakefile in BAKEFILES:
                 candidate = os.path.join(path, bakefile)
                 if os.path.exists(candidate):
-                    return candidate
+                    return candidate, searched
+
+            if os.path.exists(os.path.join(path, '.git')):
+                break
 
             up = os.path.dirname(path)
-            if up != path:
-                path = up
-            else:
+            if up == path:
+                break
+
+            parent = os.stat(up)
+            if parent.st_dev != status.st_dev:
                 break
+            path, status = up, parent
+
+        return None, searched
 
     def _find_task(self, name):
         try:
@@ -464,6 +746,9 @@ class Runtime(object):
             else:
                 self.error('cannot find task %r' % name)
                 return False
+        except TaskError, exception:
+            self.error(exception.args[0])
+            return False
         else:
             return task
 
@@ -483,16 +768,120 @@ class Runtime(object):
                 self.error('failed to parse %r' % path, True)
                 return False
 
+    def _at_path(self):
+        return self.path is None or os.getcwd() == self.path
+
+    def _claim_path(self):
+        # a task which changes directory waits for the other tasks to finish,
+        # and holds the working directory exclusively until it finishes
+        local = self._local
+        if not getattr(local, 'pathdepth', 0) or local.pathexclusive:
+            return
+
+        with self._paths:
+            self._pathholders -= 1
+            self._paths.notify_all()
+            while self._pathexclusive or self._pathholders:
+                self._paths.wait(0.5)
+            self._pathexclusive = True
+            self._pathholders = 1
+        local.pathexclusive = True
+
+    def _expire(self):
+        with self._lock:
+            if self._flusher:
+                self._flusher = None
+                self._flush()
+
+    def _flush(self):
+        if self._flusher:
+            self._flusher.cancel()
+            self._flusher = None
+        self.stream.flush()
+        self._flushed = time()
+
+    def _hold_path(self, independent):
+        # the working directory is shared by every thread, so each task holds
+        # it while it runs; an independent task which must restore the path
+        # first waits for the others to finish
+        local = self._local
+        if getattr(local, 'pathdepth', 0):
+            local.pathdepth += 1
+            return True
+
+        with self._paths:
+            while self._pathexclusive or (independent and self._pathholders
+                    and not self._at_path()):
+                self._paths.wait(0.5)
+            self._pathholders += 1
+            resetting = independent and not self._at_path()
+            self._pathexclusive = resetting
+
+        if resetting:
+            restored = self._reset_path()
+            with self._paths:
+                self._pathexclusive = False
+                if restored is False:
+                    self._pathholders -= 1
+                self._paths.notify_all()
+            if restored is False:
+                return False
+
+        local.pathdepth, local.pathexclusive = 1, False
+        return True
+
+    def _record_message(self, level, message, context=None):
+        if context is None:
+            context = ' '.join(self.context) or None
+        if self.log:
+            self.log.write(level, message, context)
+        if self.events:
+            self.events.emit('log', level=level, message=ansify(message).rstrip('\n'),
+                task=context)
+
     def _report_message(self, message, asis=False):
+        # the prefix is rendered apart from the message, so that the rendering
+        # of each is cached no matter how the other varies
+        prefix = ''
         if self.context and not asis:
-            message = '[!b][%s][!] %s' % (' '.join(self.context), message)
+            prefix = '[!b][%s][!] ' % ' '.join(self.context)
         if self.timestamps:
-            message = '[!b]%s[!] %s' % (datetime.now().strftime('%Y-%m-%dT%H:%M:%S'), message)
+            prefix = '[!b]%s[!] %s' % (datetime.now().strftime('%Y-%m-%dT%H:%M:%S'), prefix)
         if message[-1] != '\n':
             message += '\n'
 
-        self.stream.write(ansify(message, self.color))
-        self.stream.flush()
+        self._write(ansify(prefix, self.color, False) + ansify(message, self.color))
+
+    def _report_output(self, name, line):
+        # output is only streamed when verbose, so it is recorded as such
+        if self.events or self.log:
+            self._record_message('debug', line)
+        self._report_message(line or ' ')
+
+    def _write(self, message):
+        # the stream is flushed as each task finishes, and otherwise at most
+        # every flush_interval seconds, rather than after every message; a
+        # timer flushes what would otherwise wait on the next message
+        with self._lock:
+            self.stream.write(message)
+            if time() - self._flushed >= self.flush_interval:
+                self._flush()
+            elif not self._flusher:
+                self._flusher = threading.Timer(self.flush_interval, self._expire)
+                self._flusher.daemon = True
+                self._flusher.start()
+
+    def _release_path(self):
+        local = self._local
+        local.pathdepth -= 1
+        if local.pathdepth:
+            return
+
+        with self._paths:
+            self._pathholders -= 1
+            if local.pathexclusive:
+                self._pathexclusive = False
+            self._paths.notify_all()
 
     def _reset_path(self):
         path = self.path
@@ -0,0 +1,153 @@
+import sys
+from heapq import heappop, heappush
+from Queue import Empty, Queue
+from threading import Thread
+from time import time
+
+from bake.exceptions import TaskFailed
+from bake.remote import RemoteWorker
+
+__all__ = ('Scheduler',)
+
+class Scheduler(object):
+    """Executes a dependency graph of tasks, running each task once all of
+    its dependencies have completed. Tasks are dispatched to the workers at
+    ``remotes``, if any, alongside any local workers."""
+
+    def __init__(self, runtime, graph, order, jobs=1, keepgoing=False, remotes=None):
+        self.blocked = []
+        self.completed = []
+        self.failed = []
+        self.graph = graph
+        self.jobs = max(jobs or 1, 1)
+        self.keepgoing = keepgoing
+        self.order = order
+        self.remotes = remotes or []
+        self.runtime = runtime
+        self.workers = []
+
+    def run(self):
+        graph = self.graph
+        index = dict((task, i) for i, task in enumerate(self.order))
+
+        dependents = dict((task, []) for task in graph)
+        waiting = {}
+        for task, dependencies in graph.iteritems():
+            waiting[task] = len(dependencies)
+            for dependency in dependencies:
+                dependents[dependency].append(task)
+
+        ready = []
+        for task in self.order:
+            if not waiting[task]:
+                self._enqueue(ready, index, task)
+
+        results = Queue()
+        self._start_workers(results)
+        try:
+            capacity = max(len(self.workers), 1)
+            running = 0
+            stopped = False
+            while True:
+                while ready and running < capacity and not stopped:
+                    self._dispatch(heappop(ready)[1], results)
+                    running += 1
+                if not running:
+                    break
+
+                task, succeeded, exc_info = self._wait(results)
+                running -= 1
+                if exc_info:
+                    raise exc_info[0], exc_info[1], exc_info[2]
+
+                if succeeded:
+                    self.completed.append(task)
+                    self.runtime.completed.append(task)
+                    for dependent in dependents[task]:
+                        waiting[dependent] -= 1
+                        if not waiting[dependent]:
+                            self._enqueue(ready, index, dependent)
+                else:
+                    self.failed.append(task)
+                    if not self.keepgoing:
+                        stopped = True
+        finally:
+            self._stop_workers()
+
+        finished = set(self.completed) | set(self.failed)
+        self.blocked = [task for task in self.order if task not in finished]
+        if self.keepgoing:
+            for task in self.blocked:
+                self.runtime.error('[!R]task %s not executed[!] (a dependency failed)' % task.name)
+
+        return not self.failed
+
+    def _dispatch(self, task, results):
+        if self.workers:
+            self.workers[0].queue.put(task)
+        else:
+            results.put(self._execute(task))
+
+    def _enqueue(self, ready, index, task):
+        task.queued = time()
+        self.runtime.emit('task.queued', task=task.name)
+        heappush(ready, (index[task], task))
+
+    def _execute(self, task):
+        try:
+            self.runtime.execute(task)
+        except TaskFailed:
+            return task, False, None
+        except Exception:
+            return task, False, sys.exc_info()
+        else:
+            return task, True, None
+
+    def _start_workers(self, results):
+        queue = Queue()
+        for address in self.remotes:
+            try:
+                worker = RemoteWorker(self, address, queue, results)
+            except (EnvironmentError, ValueError), exception:
+                self.runtime.error('cannot connect to worker %s (%s)' % (address, exception))
+                continue
+            worker.start()
+            self.workers.append(worker)
+
+        if self.jobs == 1:
+            return
+
+        for i in range(self.jobs):
+            worker = Worker(self, queue, results)
+            worker.start()
+            self.workers.append(worker)
+
+    def _stop_workers(self):
+        for worker in self.workers:
+            worker.queue.put(None)
+        self.workers = []
+
+    def _wait(self, results):
+        # a blocking get without a timeout cannot be interrupted in python 2
+        while True:
+            try:
+                return results.get(True, 0.5)
+            except Empty:
+                pass
+
+class Worker(Thread):
+    """A worker thread which executes tasks dispatched by a scheduler."""
+
+    def __init__(self, scheduler, queue, results):
+        Thread.__init__(self)
+        self.daemon = True
+        self.queue = queue
+        self.results = results
+        self.scheduler = scheduler
+
+    def run(self):
+        while True:
+            task = self.queue.get()
+            if task is None:
+                break
+            self.results.put(self.scheduler._execute(task))
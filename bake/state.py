@@ -0,0 +1,214 @@
+import json
+import marshal
+import os
+from binascii import hexlify
+from threading import Lock
+from time import time
+
+from bake.path import path
+
+__all__ = ('DiscoveryCache', 'HashCache', 'StateStore')
+
+STATEDIR = '.bake'
+
+class DiscoveryCache(object):
+    """A persistent record of the bakefile found when searching from each
+    directory, which stands for as long as none of the directories searched
+    has been modified."""
+
+    filename = 'bakefiles'
+    version = 1
+
+    # directories modified this recently are not cached, since a further
+    # change within the resolution of the timestamp would go unnoticed
+    window = 2
+
+    def __init__(self, cachedir=None):
+        self.cachedir = cachedir
+        self.entries = None
+
+    def get(self, directory):
+        """Returns ``(True, bakefile)`` if the result of a search from
+        ``directory`` is known, and ``(False, None)`` otherwise."""
+
+        entry = self._load().get(directory)
+        if not entry:
+            return False, None
+
+        bakefile, searched = entry
+        for searched_directory, mtime in searched:
+            try:
+                if os.stat(searched_directory).st_mtime != mtime:
+                    return False, None
+            except OSError:
+                return False, None
+        return True, bakefile
+
+    def set(self, directory, bakefile, searched):
+        """Records that a search from ``directory`` found ``bakefile`` (or
+        nothing) after searching ``searched``, a list of ``(directory, mtime)``
+        pairs, and saves the cache."""
+
+        now = time()
+        if not self.cachedir or any(now - mtime <= self.window for _, mtime in searched):
+            return
+
+        entries = self._load()
+        entries[directory] = (bakefile, searched)
+
+        filename = os.path.join(self.cachedir, self.filename)
+        temporary = '%s.%d' % (filename, os.getpid())
+        try:
+            if not os.path.isdir(self.cachedir):
+                os.makedirs(self.cachedir)
+            with open(temporary, 'wb') as openfile:
+                marshal.dump((self.version, entries), openfile)
+            os.rename(temporary, filename)
+        except EnvironmentError:
+            pass
+
+    def _load(self):
+        if self.entries is None:
+            self.entries = {}
+            if self.cachedir:
+                try:
+                    with open(os.path.join(self.cachedir, self.filename), 'rb') as openfile:
+                        version, entries = marshal.load(openfile)
+                except (EnvironmentError, EOFError, ValueError, TypeError):
+                    pass
+                else:
+                    if version == self.version:
+                        self.entries = entries
+        return self.entries
+
+class HashCache(object):
+    """A persistent cache of file hashes, keyed on the path, inode, size and
+    modification time of each file so that unchanged files need only be
+    stat'd rather than read."""
+
+    filename = 'hashes'
+    version = 1
+
+    # files modified this recently are not cached, since a further change
+    # within the resolution of the filesystem timestamp would go unnoticed
+    window = 2
+
+    def __init__(self, root):
+        if not isinstance(root, path):
+            root = path(root)
+
+        self.dirty = False
+        self.entries = None
+        self.lock = Lock()
+        self.path = root / STATEDIR / self.filename
+
+    def evict(self, prefix=None, retain=None):
+        """Evicts entries for files under ``prefix`` (or everywhere) which are
+        not in ``retain``; if ``retain`` is not given, entries for files which
+        no longer exist are evicted."""
+
+        with self.lock:
+            entries = self._load()
+            for filepath in entries.keys():
+                if prefix and not filepath.startswith(prefix):
+                    continue
+                if retain is not None:
+                    if filepath in retain:
+                        continue
+                elif os.path.exists(filepath):
+                    continue
+                del entries[filepath]
+                self.dirty = True
+
+    def hexhash(self, filepath, hash_name='sha1'):
+        filepath = os.path.abspath(filepath)
+        status = os.stat(filepath)
+        signature = (status.st_ino, status.st_size, _mtime_ns(status))
+
+        with self.lock:
+            entry = self._load().get(filepath)
+        if entry and entry[:3] == signature and entry[3] == hash_name:
+            return hexlify(entry[4])
+
+        digest = path(filepath)._hash(hash_name).digest()
+        if time() - status.st_mtime > self.window:
+            with self.lock:
+                self.entries[filepath] = signature + (hash_name, digest)
+                self.dirty = True
+        return hexlify(digest)
+
+    def save(self):
+        with self.lock:
+            if not self.dirty:
+                return
+
+            self.path.dirname().makedirs_p()
+            temporary = self.path + '.tmp'
+            temporary.write_bytes(marshal.dumps((self.version, self.entries)))
+            os.rename(temporary, self.path)
+            self.dirty = False
+
+    def _load(self):
+        if self.entries is None:
+            self.entries = {}
+            if self.path.exists():
+                try:
+                    version, entries = marshal.loads(self.path.bytes())
+                except (EOFError, ValueError, TypeError):
+                    pass
+                else:
+                    if version == self.version:
+                        self.entries = entries
+        return self.entries
+
+class StateStore(object):
+    """A persistent record of task fingerprints, kept under the state
+    directory of a project."""
+
+    filename = 'tasks.json'
+
+    def __init__(self, root):
+        if not isinstance(root, path):
+            root = path(root)
+
+        self.lock = Lock()
+        self.path = root / STATEDIR / self.filename
+        self.records = None
+
+    def get(self, name):
+        with self.lock:
+            return self._load().get(name)
+
+    def remove(self, name):
+        with self.lock:
+            records = self._load()
+            if name in records:
+                del records[name]
+                self._save()
+
+    def set(self, name, record):
+        with self.lock:
+            self._load()[name] = record
+            self._save()
+
+    def _load(self):
+        if self.records is None:
+            self.records = {}
+            if self.path.exists():
+                try:
+                    self.records = json.loads(self.path.bytes())
+                except ValueError:
+                    pass
+        return self.records
+
+    def _save(self):
+        self.path.dirname().makedirs_p()
+        temporary = self.path + '.tmp'
+        temporary.write_bytes(json.dumps(self.records, sort_keys=True))
+        os.rename(temporary, self.path)
+
+def _mtime_ns(status):
+    mtime_ns = getattr(status, 'st_mtime_ns', None)
+    if mtime_ns is None:
+        mtime_ns = int(status.st_mtime * 1000000000)
+    return mtime_ns
@@ -1,38 +1,130 @@
+import json
+import os
 import repr as reprlib
+from contextlib import contextmanager
+from copy import deepcopy
 from datetime import datetime
+from hashlib import sha1
 from textwrap import dedent
+from threading import Lock
+from time import time
 from types import FunctionType
 
 from scheme import Structure, Text
 
 from bake.environment import *
 from bake.exceptions import *
-from bake.util import call_with_supported_params, propagate_traceback
+from bake.path import path
+from bake.state import STATEDIR
+from bake.util import call_with_supported_params, import_object, propagate_traceback
 
-__all__ = ('Task', 'TaskError', 'parameter', 'requires', 'task')
+__all__ = ('Task', 'TaskError', 'inputs', 'outputs', 'parameter', 'requires', 'task')
 
 class Tasks(object):
     by_fullname = {}
     by_name = {}
     by_source = {}
     current_source = None
+    deferred = {}
+    pending = set()
 
     @classmethod
-    def get(cls, name, prefix=None):
-        task = cls.by_fullname.get(name)
-        if task:
-            return task
+    def defer(cls, module, names):
+        """Defers the import of ``module``, which defines the tasks ``names``,
+        until one of them is requested."""
+
+        cls.pending.add(module)
+        for name in names:
+            cls.deferred.setdefault(name, set()).add(module)
 
+    @classmethod
+    def get(cls, name, prefix=None):
         if prefix and not name.startswith(prefix):
-            name = prefix + name
+            prefixed = prefix + name
+        else:
+            prefixed = name
+
+        candidate = cls._find(name, prefixed)
+        if candidate is None and cls._import_modules(prefixed):
+            candidate = cls._find(name, prefixed)
 
-        candidate = cls.by_name.get(name)
         if isinstance(candidate, set):
             raise MultipleTasksError(candidate)
         elif candidate:
             return candidate
         else:
-            raise UnknownTaskError('no task named %r' % name)
+            raise UnknownTaskError('no task named %r' % prefixed)
+
+    @classmethod
+    def import_deferred(cls, name=None):
+        """Imports the deferred modules which define ``name``, or all deferred
+        modules if ``name`` is not specified, returning True if any were."""
+
+        if name is None:
+            modules = sorted(cls.pending)
+        else:
+            modules = sorted(cls.deferred.get(name, set()) & cls.pending)
+
+        for module in modules:
+            cls.pending.discard(module)
+            try:
+                import_object(module)
+            except Exception, exception:
+                raise TaskError('failed to load %r: %s' % (module, exception))
+        return bool(modules)
+
+    @classmethod
+    def _find(cls, name, prefixed):
+        return cls.by_fullname.get(name) or cls.by_name.get(prefixed)
+
+    @classmethod
+    def _import_modules(cls, name):
+        from bake.lib import import_library
+        if import_library(name) or cls.import_deferred(name):
+            return True
+
+        # a task the index did not know of may be defined dynamically
+        return cls.import_deferred()
+
+class ResolutionCache(object):
+    """A cache of the parameter values resolved for each task class against
+    each environment. An environment is identified by its serial number and
+    version, and a stack by those of its bottom environment and the content
+    of the environments above it, which are typically small and built afresh
+    for each execution; a change to any of them makes for a new entry. Once
+    there are ``maxsize`` entries, the cache is cleared."""
+
+    def __init__(self, maxsize=1024):
+        self.entries = {}
+        self.hits = 0
+        self.lock = Lock()
+        self.maxsize = maxsize
+        self.misses = 0
+
+    def get(self, task, key, strict):
+        with self.lock:
+            values = self.entries.get((task, strict, key))
+            if values is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return values
+
+    def identify(self, environment):
+        if isinstance(environment, EnvironmentStack):
+            layers = environment.stack
+            content = json.dumps([layer.environment for layer in layers[:-1]],
+                sort_keys=True, default=repr)
+            environment = layers[-1]
+        else:
+            content = None
+        return environment.serial, environment.version, content
+
+    def put(self, task, key, strict, values):
+        with self.lock:
+            if len(self.entries) >= self.maxsize:
+                self.entries.clear()
+            self.entries[(task, strict, key)] = values
 
 class TaskMeta(type):
     def __new__(metatype, name, bases, namespace):
@@ -72,8 +164,10 @@ class TaskMeta(type):
         else:
             Tasks.by_name[task.name] = task
 
+        # bundled libraries are imported on demand, possibly while a bakefile
+        # is loading, but their tasks are always attributed to themselves
         source = Tasks.current_source
-        if source is None:
+        if source is None or task.__module__.startswith('bake.lib.'):
             source = task.__module__
         if source in Tasks.by_source:
             Tasks.by_source[source][task.name] = task
@@ -100,9 +194,12 @@ class Task(object):
     configuration = None
     description = None
     implementation = None
+    inputs = None
     name = None
     notes = None
+    outputs = None
     parameters = None
+    queued = None
     requires = []
     source = None
     supports_dryrun = False
@@ -141,8 +238,35 @@ class Task(object):
 
     def execute(self, environment=None):
         runtime = self.runtime
+        profiler = runtime.profiler
+        if not (profiler or runtime.events):
+            return self._execute(runtime, environment)
+
+        started = time()
+        runtime.emit('task.started', task=self.name)
+        if profiler and self.queued:
+            profiler.record('queued', 'scheduler', self.queued, started, task=self.name)
+        try:
+            return self._execute(runtime, environment)
+        finally:
+            finished = time()
+            status = self.status
+            if status == self.PENDING:
+                status = self.FAILED
+            runtime.emit('task.%s' % status, task=self.name, duration=finished - started)
+            if profiler:
+                profiler.record(self.name, 'task', started, finished, status=status)
+
+    def finalize(self, runtime):
+        pass
+
+    def prepare(self, runtime):
+        pass
+
+    def _execute(self, runtime, environment):
         try:
-            self.environment = self._prepare_environment(runtime, environment)
+            with self._measure(runtime, 'environment'):
+                self.environment = self._prepare_environment(runtime, environment)
         except RequiredParameterError, exception:
             runtime.error('task requires parameter %r' % exception.args[0])
             self.status = self.FAILED
@@ -155,14 +279,40 @@ class Task(object):
         if runtime.dryrun and not self.supports_dryrun:
             self.status = self.COMPLETED
 
+        fingerprint = None
+        if self.status == self.PENDING and (self.inputs or self.outputs):
+            fingerprint = self._calculate_fingerprint(runtime)
+            if not runtime.force and self._is_up_to_date(runtime, fingerprint):
+                self.status = self.SKIPPED
+                runtime.report('[!Y]task skipped[!] (up to date)')
+                return True
+
+        # the outputs of a task may be restored from those stored by an
+        # identical execution of the task, here or elsewhere
+        artifacts = None
+        if fingerprint and self.outputs and not runtime.dryrun:
+            artifacts = runtime.artifacts
+
+        restored = False
+        if self.status == self.PENDING and artifacts and not runtime.force:
+            restored = self._restore_outputs(runtime, artifacts, fingerprint)
+
         if self.status == self.PENDING:
             self._execute_task(runtime)
+            if artifacts and self.status == self.COMPLETED:
+                self._store_outputs(runtime, artifacts, fingerprint)
+
+        if fingerprint and not runtime.dryrun:
+            self._record_fingerprint(runtime, fingerprint)
 
         duration = ''
         if runtime.timing:
             duration = ' (%s)' % self.duration
         
-        if self.status == self.COMPLETED:
+        if self.status == self.COMPLETED and restored:
+            runtime.report('[!G]task completed[!] (outputs restored)%s' % duration)
+            return True
+        elif self.status == self.COMPLETED:
             runtime.report('[!G]task completed[!]%s' % duration)
             return True
         elif self.status == self.SKIPPED:
@@ -174,19 +324,40 @@ class Task(object):
             runtime.error('[!R]task failed[!]%s' % duration)
             return False
 
-    def finalize(self, runtime):
-        pass
-
-    def prepare(self, runtime):
-        pass
+    def _calculate_fingerprint(self, runtime):
+        hasher = sha1(self.fullname)
+        for name in sorted(self.configuration or ()):
+            value = json.dumps(self.environment.find(name), sort_keys=True, default=str)
+            hasher.update('%s=%s\0' % (name, value))
+        for filepath, hexhash in _hash_files(self.inputs, runtime.hashcache):
+            hasher.update('%s:%s\0' % (filepath, hexhash))
+        return hasher.hexdigest()
+
+    def _collate_outputs(self, runtime):
+        for pattern in self.outputs:
+            if not path('.').glob(pattern):
+                return None
+
+        hasher = sha1()
+        for filepath, hexhash in _hash_files(self.outputs, runtime.hashcache):
+            hasher.update('%s:%s\0' % (filepath, hexhash))
+        return hasher.hexdigest()
 
     def _execute_task(self, runtime):
         self.started = datetime.now()
         try:
-            self.prepare(runtime)
-            call_with_supported_params(self.implementation or self.run,
-                runtime=runtime, environment=self.environment)
-            self.finalize(runtime)
+            with self._measure(runtime, 'prepare'):
+                self.prepare(runtime)
+            with self._measure(runtime, 'run'):
+                implementation = self.implementation or self.run
+                if runtime.profiler:
+                    runtime.profiler.call(self.name, call_with_supported_params,
+                        implementation, runtime=runtime, environment=self.environment)
+                else:
+                    call_with_supported_params(implementation, runtime=runtime,
+                        environment=self.environment)
+            with self._measure(runtime, 'finalize'):
+                self.finalize(runtime)
         except RequiredParameterError, exception:
             runtime.error('task requires parameter %r' % exception.args[0])
             self.status = self.FAILED
@@ -201,26 +372,128 @@ class Task(object):
         finally:
             self.finished = datetime.now()
 
+    def _is_up_to_date(self, runtime, fingerprint):
+        record = runtime.state.get(self.fullname)
+        if not record or record.get('inputs') != fingerprint:
+            return False
+        if self.outputs:
+            return record.get('outputs') == self._collate_outputs(runtime)
+        return True
+
+    def _record_fingerprint(self, runtime, fingerprint):
+        if self.status != self.COMPLETED:
+            runtime.state.remove(self.fullname)
+            return
+
+        record = {'inputs': fingerprint}
+        if self.outputs:
+            record['outputs'] = self._collate_outputs(runtime)
+        runtime.state.set(self.fullname, record)
+
+    def _restore_outputs(self, runtime, artifacts, fingerprint):
+        self.started = datetime.now()
+        try:
+            restored = artifacts.restore(fingerprint)
+        except (EnvironmentError, ValueError), exception:
+            runtime.report('[!Y]cannot restore outputs[!] (%s)' % exception)
+            return False
+        finally:
+            self.finished = datetime.now()
+
+        if restored is None:
+            return False
+
+        runtime.info('restored %d outputs for %s' % (restored, fingerprint))
+        self.status = self.COMPLETED
+        return True
+
+    def _store_outputs(self, runtime, artifacts, fingerprint):
+        try:
+            artifacts.store(fingerprint, _hash_files(self.outputs, runtime.hashcache))
+        except (EnvironmentError, ValueError), exception:
+            runtime.report('[!Y]cannot store outputs[!] (%s)' % exception)
+
+    @contextmanager
+    def _measure(self, runtime, phase):
+        if runtime.profiler:
+            with runtime.profiler.measure(phase, 'phase', task=self.name):
+                yield
+        else:
+            yield
+
     def _prepare_environment(self, runtime, environment):
         environment = environment or runtime.environment
         if not self.configuration:
             return environment
 
+        cache, strict = runtime.resolutions, runtime.strict
+        key = cache.identify(environment)
+        values = cache.get(type(self), key, strict)
+        if values is None:
+            values = self._resolve_parameters(environment, strict)
+            cache.put(type(self), key, strict, values)
+
+        # the overlay, and each value in it, is built afresh for each task,
+        # since a task may modify either in place
         overlay = Environment()
+        for name, value, original in values:
+            overlay.set(name, deepcopy(value))
+            if original is not None:
+                runtime.info('%s = %s' % (name, reprlib.repr(original)))
+        return environment.overlay(overlay)
+
+    def _resolve_parameters(self, environment, strict):
+        values = []
         for name, parameter in self.configuration.iteritems():
-            if runtime.strict:
+            if strict:
                 value = environment.get(name)
             else:
                 value = environment.find(name)
             if value is not None:
-                overlay.set(name, parameter.process(value, serialized=True))
-                runtime.info('%s = %s' % (name, reprlib.repr(value)))
+                values.append((name, parameter.process(value, serialized=True), value))
             elif parameter.default is not None:
-                overlay.set(name, parameter.get_default())
+                values.append((name, parameter.get_default(), None))
             elif parameter.required:
                 raise RequiredParameterError(name)
+        return values
+
+def _hash_files(patterns, cache=None):
+    # each pattern names a file, a directory (whose files are all included)
+    # or a glob; a pattern which matches nothing contributes nothing, as does
+    # the state directory, which is rewritten after every run
+    prune = lambda directory: os.path.basename(directory) == STATEDIR
+    filepaths = set()
+    for pattern in (patterns or ()):
+        for candidate in path('.').glob(pattern):
+            if STATEDIR in candidate.normpath().splitall():
+                continue
+            if candidate.isdir():
+                for subject, isdir, isfile in candidate.walktree(prune):
+                    if isfile:
+                        filepaths.add(subject)
+            elif candidate.isfile():
+                filepaths.add(candidate)
+
+    return [(str(filepath.normpath()), filepath.read_hexhash('sha1', cache))
+        for filepath in sorted(filepaths)]
+
+def inputs(*args):
+    def decorator(function):
+        try:
+            function.inputs.extend(args)
+        except AttributeError:
+            function.inputs = list(args)
+        return function
+    return decorator
 
-        return environment.overlay(overlay)
+def outputs(*args):
+    def decorator(function):
+        try:
+            function.outputs.extend(args)
+        except AttributeError:
+            function.outputs = list(args)
+        return function
+    return decorator
 
 def parameter(name, field=None):
     if not field:
@@ -250,6 +523,8 @@ def task(name=None, description=None, supports_dryrun=False, supports_interactiv
             'name': name or function.__name__,
             'description': description,
             'implementation': staticmethod(function),
+            'inputs': getattr(function, 'inputs', None),
+            'outputs': getattr(function, 'outputs', None),
             'supports_dryrun': supports_dryrun,
             'supports_interactive': supports_interactive,
             'parameters': getattr(function, 'parameters', None),
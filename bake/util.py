@@ -1,10 +1,17 @@
+import imp
+import marshal
 import os
 import sys
+from collections import deque
+from hashlib import sha1
 from inspect import getargspec
 from tempfile import mkstemp
 from textwrap import dedent
+from time import time
 from traceback import format_tb
 
+from bake.exceptions import CyclicDependencyError
+
 def call_with_supported_params(callable, **params):
     arguments = getargspec(callable)[0]
     for key in params.keys():
@@ -70,15 +77,48 @@ def import_object(path):
         else:
             raise
 
-def import_source(path):
-    namespace = {}
+def compile_source(path, cachedir=None):
+    """Compiles the python source at ``path``. If ``cachedir`` is specified,
+    the compiled code is cached there, keyed on the path, size and
+    modification time of the source and the magic number of the interpreter,
+    so that an unchanged source need not be compiled again."""
 
-    openfile = open(path, 'r')
-    try:
-        exec(openfile, namespace)
-        return namespace
-    finally:
-        openfile.close()
+    path = os.path.abspath(path)
+    status = os.stat(path)
+    signature = (imp.get_magic(), path, status.st_size, status.st_mtime)
+
+    cachefile = None
+    if cachedir:
+        cachefile = os.path.join(cachedir, '%s.code' % sha1(path).hexdigest())
+        try:
+            with open(cachefile, 'rb') as openfile:
+                if marshal.load(openfile) == signature:
+                    return marshal.load(openfile)
+        except (EnvironmentError, EOFError, ValueError, TypeError):
+            pass
+
+    with open(path, 'rU') as openfile:
+        code = compile(openfile.read(), path, 'exec')
+
+    # a source modified this recently might change again within the
+    # resolution of its timestamp, so is not cached
+    if cachefile and time() - status.st_mtime > 2:
+        temporary = '%s.%d' % (cachefile, os.getpid())
+        try:
+            if not os.path.isdir(cachedir):
+                os.makedirs(cachedir)
+            with open(temporary, 'wb') as openfile:
+                marshal.dump(signature, openfile)
+                marshal.dump(code, openfile)
+            os.rename(temporary, cachefile)
+        except EnvironmentError:
+            pass
+    return code
+
+def import_source(path, cachedir=None):
+    namespace = {}
+    exec(compile_source(path, cachedir), namespace)
+    return namespace
 
 def propagate_traceback(exception):
     traceback = sys.exc_info()[2]
@@ -101,27 +141,62 @@ def recursive_merge(original, addition):
             original[key] = value
     return original
 
-def topological_sort(graph):
-    queue = []
-    edges = graph.values()
-    for node in graph.iterkeys():
+def topological_sort(graph, key=None):
+    """Sorts ``graph``, a dict mapping each node to the set of nodes it depends
+    upon, so that every node follows its dependencies. Ties are broken by
+    ``key``, so the result is deterministic; ``graph`` is not modified."""
+
+    nodes = set(graph)
+    for edges in graph.itervalues():
+        nodes.update(edges)
+
+    nodes = sorted(nodes, key=key)
+    dependents = dict((node, []) for node in nodes)
+    indegrees = {}
+
+    for node in nodes:
+        edges = graph.get(node, ())
+        indegrees[node] = len(edges)
         for edge in edges:
-            if node in edge:
-                break
-        else:
-            queue.append(node)
+            dependents[edge].append(node)
 
+    queue = deque(node for node in nodes if not indegrees[node])
     result = []
+
     while queue:
-        node = queue.pop(0)
+        node = queue.popleft()
         result.append(node)
-        for target in graph[node].copy():
-            graph[node].remove(target)
-            for edge in graph.itervalues():
-                if target in edge:
-                    break
-            else:
-                queue.append(target)
-
-    result.reverse()
+        for dependent in dependents[node]:
+            indegrees[dependent] -= 1
+            if not indegrees[dependent]:
+                queue.append(dependent)
+
+    if len(result) != len(nodes):
+        cycle = _find_cycle(graph, [node for node in nodes if indegrees[node]])
+        names = [str(key(node) if key else node) for node in cycle]
+        raise CyclicDependencyError('cyclic dependency between %s' % ', '.join(names), cycle)
+
     return result
+
+def _find_cycle(graph, candidates):
+    # candidates are the nodes left over by topological_sort, which are either
+    # part of a cycle or depend upon one; successively discarding candidates
+    # which nothing else left over depends upon leaves only the former
+    remaining = set(candidates)
+    outdegrees = dict((node, 0) for node in candidates)
+    for node in candidates:
+        for edge in graph.get(node, ()):
+            if edge in remaining:
+                outdegrees[edge] += 1
+
+    queue = deque(node for node in candidates if not outdegrees[node])
+    while queue:
+        node = queue.popleft()
+        remaining.discard(node)
+        for edge in graph.get(node, ()):
+            if edge in remaining:
+                outdegrees[edge] -= 1
+                if not outdegrees[edge]:
+                    queue.append(edge)
+
+    return [node for node in candidates if node in remaining]
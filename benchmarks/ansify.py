@@ -0,0 +1,50 @@
+"""Times rendering log lines with and without color, comparing the compiled
+templates of bake.color.ansify to substituting tokens with a pattern on
+every line, as ansify previously did."""
+
+import sys
+from time import time
+
+from bake.color import Reset, TokenPattern, _render_token, ansify
+
+def substitute(value, colorize=False, reset=True):
+    if colorize:
+        value = TokenPattern.sub(lambda match: _render_token(match.group(1)), value)
+        if reset:
+            value += Reset
+        return value
+    else:
+        return TokenPattern.sub('', value)
+
+def construct_lines(count, distinct=1000):
+    lines = []
+    for i in range(count):
+        kind = i % 4
+        if kind == 0:
+            lines.append('[!b][task%d][!] ' % (i % 50))
+        elif kind == 1:
+            lines.append('[!G]task completed[!] (%d)\n' % (i % distinct))
+        elif kind == 2:
+            lines.append('[!r]error[!]: [!y]%s[!] failed\n' % (i % distinct))
+        else:
+            lines.append('compiling module%d.c\n' % i)
+    return lines
+
+def measure(lines, method, colorize):
+    started = time()
+    for line in lines:
+        method(line, colorize)
+    return time() - started
+
+def main(count=1000000):
+    lines = construct_lines(count)
+    for colorize in (False, True):
+        if colorize and Reset is None:
+            continue
+        for name, method in (('substitute', substitute), ('ansify', ansify)):
+            elapsed = measure(lines, method, colorize)
+            print '%-10s %-7s %8d lines %8.1fms' % (name, 'color' if colorize else 'plain',
+                count, elapsed * 1000)
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
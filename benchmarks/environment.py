@@ -0,0 +1,47 @@
+"""Times lookups against a large environment beneath a deep stack of
+overlays, in the manner of task parameter resolution."""
+
+import sys
+from time import time
+
+from bake.environment import Environment
+
+def construct_environment(size, depth=4, fanout=8):
+    environment = Environment()
+    for i in range(size):
+        tokens, n = [], i
+        for level in range(depth):
+            tokens.append('n%d' % (n % fanout))
+            n //= fanout
+        environment.set('%s.value%d' % ('.'.join(tokens), i), i)
+    return environment
+
+def measure(environment, paths, method, repeat=5):
+    best = None
+    for i in range(repeat):
+        started = time()
+        for path in paths:
+            method(path)
+        elapsed = time() - started
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+def main(size=100000, layers=20, lookups=10000):
+    environment = construct_environment(size)
+    stack = environment
+    for i in range(layers):
+        stack = stack.overlay({'layer%d' % i: {'value': i}})
+
+    present = ['n%d.n%d.n%d.n%d.value%d' % (i % 8, i // 8 % 8, i // 64 % 8, i // 512 % 8, i)
+        for i in range(0, size, max(size // lookups, 1))]
+    inherited = ['n0.n0.n0.n0.task.value%d' % i for i in range(len(present))]
+
+    for name, target in (('environment', environment), ('stack', stack)):
+        for method, paths in (('get', present), ('has', present), ('find', present),
+                ('find', inherited)):
+            elapsed = measure(target, paths, getattr(target, method))
+            print '%-12s %-5s %6d lookups %8.1fms' % (name, method, len(paths), elapsed * 1000)
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
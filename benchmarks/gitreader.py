@@ -0,0 +1,59 @@
+"""Compares the in-process git reader with the subprocess paths (a git
+process per query, or the persistent cat-file session) used by
+bake.lib.git.Repository."""
+
+import os
+import shutil
+import subprocess
+import sys
+from tempfile import mkdtemp
+from time import time
+
+from bake.lib.git import Repository
+from bake.lib.gitreader import ObjectReader
+
+def construct_repository(root, commits=50):
+    def git(*tokens):
+        subprocess.check_call(['git', '-c', 'user.name=bake', '-c', 'user.email=bake@localhost']
+            + list(tokens), cwd=root)
+
+    git('init', '-q')
+    for i in range(commits):
+        with open(os.path.join(root, 'file%d' % (i % 10)), 'w') as openfile:
+            openfile.write(''.join('line %d\n' % j for j in range(1000)) + 'commit %d\n' % i)
+        git('add', '.')
+        git('commit', '-q', '-m', 'commit %d' % i)
+    git('gc', '-q')
+
+def measure(callable, repeat):
+    started = time()
+    for i in range(repeat):
+        callable()
+    return (time() - started) / repeat
+
+def main(repeat=200):
+    root = mkdtemp()
+    try:
+        construct_repository(root)
+        repository = Repository(root, inprocess=False)
+        reader = ObjectReader(os.path.join(root, '.git'))
+
+        queries = [
+            ('current hash', lambda: reader.resolve('HEAD'), repository.get_current_hash),
+            ('current branch', reader.get_current_branch, repository.get_current_branch),
+            ('file contents', lambda: reader.get_file('file3'),
+                lambda: repository.get_file('file3')),
+        ]
+        for name, inprocess, subprocess in queries:
+            a = measure(inprocess, repeat)
+            b = measure(subprocess, repeat)
+            print '%-16s in-process %9.1fus   subprocess %9.1fus   %6.1fx' % (
+                name, a * 1e6, b * 1e6, b / a)
+
+        reader.close()
+        repository.close()
+    finally:
+        shutil.rmtree(root)
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
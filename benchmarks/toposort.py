@@ -0,0 +1,50 @@
+"""Times bake.util.topological_sort against large synthetic task graphs."""
+
+import random
+import sys
+from time import time
+
+from bake.util import topological_sort
+
+def chain(size):
+    graph = {0: set()}
+    for node in range(1, size):
+        graph[node] = set([node - 1])
+    return graph
+
+def layered(size, width=100):
+    graph = {}
+    for node in range(size):
+        layer = node // width
+        if layer:
+            start = (layer - 1) * width
+            graph[node] = set(range(start, start + width))
+        else:
+            graph[node] = set()
+    return graph
+
+def scattered(size, fanout=5, seed=0):
+    generator = random.Random(seed)
+    graph = {0: set()}
+    for node in range(1, size):
+        graph[node] = set(generator.randrange(node) for i in range(fanout))
+    return graph
+
+def measure(graph, repeat=5):
+    best = None
+    for i in range(repeat):
+        started = time()
+        topological_sort(graph)
+        elapsed = time() - started
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+def main(size=10000):
+    for name, generator in (('chain', chain), ('layered', layered), ('scattered', scattered)):
+        graph = generator(size)
+        edges = sum(len(value) for value in graph.itervalues())
+        print '%-10s %6d nodes %8d edges %8.1fms' % (name, size, edges, measure(graph) * 1000)
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,128 @@
+import os
+import shutil
+import threading
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from StringIO import StringIO
+from tempfile import mkdtemp
+
+from unittest2 import TestCase
+from bake.artifacts import HTTPStore, LocalStore
+from bake.runtime import Runtime
+from bake.task import Task
+
+class ProducingTask(Task):
+    name = 'test.producing'
+    outputs = ['build']
+    runs = 0
+
+    def run(self, runtime):
+        ProducingTask.runs += 1
+        os.makedirs('build/bin')
+        with open('build/output.txt', 'w') as openfile:
+            openfile.write('produced')
+        with open('build/bin/tool', 'w') as openfile:
+            openfile.write('#!/bin/sh\n')
+        os.chmod('build/bin/tool', 0755)
+
+class StandInHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        content = self.server.resources.get(self.path)
+        if content is None:
+            self.send_response(404)
+            self.end_headers()
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        if self.command == 'GET':
+            self.wfile.write(content)
+
+    do_HEAD = do_GET
+
+    def do_PUT(self):
+        length = int(self.headers.getheader('Content-Length'))
+        self.server.resources[self.path] = self.rfile.read(length)
+        self.send_response(201)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+class ArtifactTestCase(TestCase):
+    def setUp(self):
+        self.curdir = os.getcwd()
+        self.root = mkdtemp()
+        os.makedirs(os.path.join(self.root, 'project'))
+        os.chdir(os.path.join(self.root, 'project'))
+
+    def tearDown(self):
+        os.chdir(self.curdir)
+        shutil.rmtree(self.root)
+
+    def produce(self, store, **params):
+        stream = StringIO()
+        runtime = Runtime(stream=stream, artifacts=store, **params)
+        runtime.execute('test.producing')
+        return stream.getvalue()
+
+    def verify_outputs(self):
+        with open('build/output.txt') as openfile:
+            self.assertEqual(openfile.read(), 'produced')
+        self.assertEqual(os.stat('build/bin/tool').st_mode & 0777, 0755)
+
+    def verify_restoration(self, store):
+        runs = ProducingTask.runs
+        self.produce(store)
+        self.assertEqual(ProducingTask.runs, runs + 1)
+        self.verify_outputs()
+
+        shutil.rmtree('build')
+        shutil.rmtree('.bake')
+        output = self.produce(store)
+        self.assertEqual(ProducingTask.runs, runs + 1)
+        self.assertIn('outputs restored', output)
+        self.verify_outputs()
+
+        shutil.rmtree('build')
+        self.produce(store, force=True)
+        self.assertEqual(ProducingTask.runs, runs + 2)
+
+class TestLocalStore(ArtifactTestCase):
+    def test_restoration(self):
+        store = LocalStore(os.path.join(self.root, 'store'))
+        self.verify_restoration(store)
+        self.assertEqual(len(os.listdir(os.path.join(self.root, 'store', 'manifests'))), 1)
+
+    def test_corrupt_blob(self):
+        store = LocalStore(os.path.join(self.root, 'store'))
+        store.put_blob('0' * 40, 'content')
+        store.put_manifest('key', {'outputs': [['output.txt', '0' * 40, 0644]]})
+        self.assertIsNone(store.restore('key'))
+        self.assertFalse(os.path.exists('output.txt'))
+
+        store.put_manifest('key', {'outputs': [['../output.txt', '0' * 40, 0644]]})
+        self.assertRaises(ValueError, store.restore, 'key')
+
+class TestHTTPStore(ArtifactTestCase):
+    def setUp(self):
+        super(TestHTTPStore, self).setUp()
+        self.server = HTTPServer(('localhost', 0), StandInHandler)
+        self.server.resources = {}
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self.url = 'http://localhost:%d/cache/' % self.server.server_address[1]
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        super(TestHTTPStore, self).tearDown()
+
+    def test_restoration(self):
+        store = HTTPStore(self.url)
+        self.assertIsNone(store.get_manifest('missing'))
+        self.verify_restoration(store)
+        self.assertEqual(len([resource for resource in self.server.resources
+            if resource.startswith('/cache/blobs/')]), 2)
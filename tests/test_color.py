@@ -0,0 +1,36 @@
+from unittest2 import TestCase
+from bake.color import LRUCache, Reset, TokenPattern, _render_token, ansify
+
+class TestAnsify(TestCase):
+    def test_plain(self):
+        self.assertEqual(ansify('[!b][task][!] [!G]done[!]\n'), '[task] done\n')
+        self.assertEqual(ansify('no tokens'), 'no tokens')
+        self.assertEqual(ansify('[!x] [! ]'), '[!x] [! ]')
+
+    def test_colored(self):
+        if Reset is None:
+            self.skipTest('colorama is not installed')
+
+        for value in ('[!b][task][!] [!G]done[!]\n', 'no tokens', '[!r][!R][!]'):
+            expected = TokenPattern.sub(lambda match: _render_token(match.group(1)), value)
+            self.assertEqual(ansify(value, True, False), expected)
+            self.assertEqual(ansify(value, True), expected + Reset)
+            self.assertEqual(ansify(value, True), expected + Reset)
+
+class TestLRUCache(TestCase):
+    def test_eviction(self):
+        cache = LRUCache(2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        self.assertEqual(cache.get('a'), 1)
+
+        cache.put('c', 3)
+        self.assertEqual(len(cache), 2)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.get('c'), 3)
+
+        cache.put('c', 4)
+        cache.put('d', 5)
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.get('c'), 4)
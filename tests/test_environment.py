@@ -1,6 +1,29 @@
+import threading
+
 from unittest2 import TestCase
 from bake.environment import *
 
+class InterleavingEnvironment(Environment):
+    interleave = None
+
+    def find(self, path, default=None):
+        value = Environment.find(self, path, default)
+        if self.interleave:
+            interleave, self.interleave = self.interleave, None
+            interleave()
+        return value
+
+class InterruptingDict(dict):
+    # starts a modification of the environment while it is being indexed
+    def iteritems(self):
+        for i, item in enumerate(dict.iteritems(self)):
+            if not i:
+                thread = threading.Thread(target=self.environment.set, args=('a.added', 2))
+                thread.start()
+                thread.join(0.2)
+                self.threads.append(thread)
+            yield item
+
 class TestEnvironment(TestCase):
     def test_path_handling(self):
         e = Environment()
@@ -11,6 +34,30 @@ class TestEnvironment(TestCase):
             self.assertTrue(e.has(path))
             self.assertEqual(e.get(path), value)
 
+    def test_find(self):
+        e = Environment({'a': {'b': {'c': 1}, 'd': 2}, 'e': 3})
+        self.assertEqual(e.find('a.b.c'), 1)
+        self.assertEqual(e.find('a.b.d'), 2)
+        self.assertEqual(e.find('a.b.e'), 3)
+        self.assertIsNone(e.find('a.b.f'))
+        self.assertEqual(e.find('a.b.f', 4), 4)
+
+        e.set('a.b.d', 5)
+        self.assertEqual(e.find('a.b.d'), 5)
+        e.merge({'a': {'b': {'f': 6}}})
+        self.assertEqual(e.find('a.b.f'), 6)
+        self.assertEqual(e.get('a.b'), {'c': 1, 'd': 5, 'f': 6})
+        self.assertFalse(e.has('a.b.c.d'))
+
+    def test_concurrent_indexing(self):
+        nested = InterruptingDict({'b': 1})
+        nested.threads = []
+        environment = nested.environment = Environment({'a': nested})
+        self.assertEqual(environment.get('a.b'), 1)
+
+        nested.threads[0].join()
+        self.assertEqual(environment.get('a.added'), 2)
+
     def test_pair_parsing(self):
         e = Environment()
         pairs = [
@@ -28,3 +75,46 @@ class TestEnvironmentStack(TestCase):
         e2 = Environment({'a': {'b': 4, 'd': 5}})
         es = EnvironmentStack(e1, e2)
 
+
+    def test_deep_overlays(self):
+        layers = [Environment({'a': {'b': {'c': 0}}, 'x': 0})]
+        es = EnvironmentStack(layers[0])
+        for i in range(1, 20):
+            layer = Environment({'a': {'b': {'c%d' % i: i}}, 'y%d' % i: i})
+            if i % 3 == 0:
+                layer.set('a.x', i)
+            elif i == 1:
+                layer.set('a.b.x', i)
+            layers.insert(0, layer)
+            es = es.overlay(layer)
+
+        self.assertLessEqual(es.depth, EnvironmentStack.threshold + 1)
+        self.assertEqual(es.stack, layers)
+        for path in ('a.b.c', 'a.b.c5', 'a.b.x', 'a.x', 'a.b.y7', 'x', 'a.b.z', 'a.b.c19'):
+            expected = [e.find(path, None) for e in layers if e.find(path, None) is not None]
+            self.assertEqual(es.find(path), (expected or [None])[0])
+            self.assertEqual(es.get(path), (
+                [e.get(path) for e in layers if e.has(path)] or [None])[0])
+            self.assertEqual(es.has(path), any(e.has(path) for e in layers))
+
+    def test_modification(self):
+        e1 = Environment({'a': {'b': 1}})
+        base = e1.overlay({'c': 2})
+        es = base.overlay({})
+        self.assertEqual(es.find('a.b'), 1)
+        self.assertFalse(es.has('a.d'))
+
+        e1.set('a.b', 3)
+        base.set('a.d', 4)
+        self.assertEqual(es.find('a.b'), 3)
+        self.assertEqual(es.get('a.d'), 4)
+        self.assertEqual(e1.overlay().find('a.c'), None)
+
+    def test_concurrent_modification(self):
+        # another thread modifies the stack and looks up the path while this
+        # lookup holds the old value, which must not then be cached
+        base = InterleavingEnvironment({'a': 1})
+        es = EnvironmentStack(Environment(), base)
+        base.interleave = lambda: (es.set('a', 2), es.find('a'))
+        self.assertEqual(es.find('a'), 1)
+        self.assertEqual(es.find('a'), 2)
@@ -0,0 +1,83 @@
+import json
+import os
+import shutil
+from StringIO import StringIO
+from tempfile import mkdtemp
+from time import sleep
+
+from unittest2 import TestCase
+from bake.events import EventStream
+from bake.runtime import Runtime
+from bake.task import Task
+
+class ReportingTask(Task):
+    name = 'test.reporting'
+
+    def run(self, runtime):
+        runtime.info('running [!G]echo[!]')
+        runtime.shell(['echo', 'reported'], passthrough=False)
+
+class TestEventStream(TestCase):
+    def setUp(self):
+        self.root = mkdtemp()
+        self.filename = os.path.join(self.root, 'events')
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def read(self):
+        with open(self.filename) as openfile:
+            return [json.loads(line) for line in openfile]
+
+    def test_buffering(self):
+        stream = EventStream(self.filename, buffersize=100, interval=60)
+        stream.emit('first', value=1)
+        self.assertEqual(os.path.getsize(self.filename), 0)
+
+        stream.emit('second', value='x' * 100)
+        self.assertEqual([event['event'] for event in self.read()], ['first', 'second'])
+
+        stream.emit('third')
+        stream.close()
+        self.assertEqual(self.read()[-1]['event'], 'third')
+
+    def test_interval(self):
+        stream = EventStream(self.filename, interval=0.1)
+        stream.emit('first')
+        self.assertEqual(os.path.getsize(self.filename), 0)
+        sleep(0.3)
+        self.assertEqual([event['event'] for event in self.read()], ['first'])
+
+        stream.emit('task.started')
+        self.assertEqual(len(self.read()), 2)
+        stream.close()
+
+    def test_descriptor_left_open(self):
+        fd = os.open(self.filename, os.O_WRONLY | os.O_CREAT)
+        try:
+            stream = EventStream(str(fd))
+            stream.emit('first')
+            stream.close()
+            os.fstat(fd)
+        finally:
+            os.close(fd)
+        self.assertEqual(len(self.read()), 1)
+
+    def test_runtime_events(self):
+        events = EventStream(self.filename)
+        runtime = Runtime(stream=StringIO(), events=events)
+        runtime.execute('test.reporting')
+        events.close()
+
+        events = self.read()
+        self.assertEqual([event['event'] for event in events], ['task.started', 'log',
+            'log', 'process.spawn', 'process.exit', 'log', 'task.completed'])
+
+        self.assertEqual(events[1]['level'], 'debug')
+        self.assertEqual(events[1]['message'], 'running echo')
+        self.assertEqual(events[1]['task'], 'test.reporting')
+        self.assertEqual(events[4]['cmdline'], ['echo', 'reported'])
+        self.assertEqual(events[4]['returncode'], 0)
+        self.assertEqual(events[4]['received'], len('reported\n'))
+        self.assertEqual(events[5]['level'], 'info')
+        self.assertGreaterEqual(events[6]['duration'], events[4]['duration'])
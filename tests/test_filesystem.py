@@ -0,0 +1,99 @@
+import os
+import shutil
+import tarfile
+from StringIO import StringIO
+from tempfile import mkdtemp
+
+from unittest2 import TestCase
+from bake.filesystem import Collation, collate_ancestors, ignore_directories
+from bake.runtime import Runtime
+
+class TestCollation(TestCase):
+    def setUp(self):
+        self.root = mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def construct(self, files, directories=()):
+        for directory in directories:
+            os.makedirs(os.path.join(self.root, directory))
+        for filepath, content in files.iteritems():
+            filepath = os.path.join(self.root, filepath)
+            if not os.path.exists(os.path.dirname(filepath)):
+                os.makedirs(os.path.dirname(filepath))
+            with open(filepath, 'w') as openfile:
+                openfile.write(content)
+
+    def test_collate_ancestors(self):
+        ancestors = collate_ancestors(['/a/b/c.txt', '/a/d.txt'])
+        self.assertEqual(ancestors, set(['/', '/a', '/a/b']))
+
+    def test_collation(self):
+        self.construct({'a/one': '1', 'a/b/two': '2', 'three': '3'}, ['empty'])
+        collation = Collation(self.root, workers=2)
+        self.assertEqual(sorted(collation.directories), [self.root] +
+            [os.path.join(self.root, name) for name in ('a', 'a/b', 'empty')])
+        self.assertEqual(len(collation.files), 3)
+
+    def test_parallel_hashing(self):
+        self.construct(dict(('d%d/f%d' % (i % 7, i), 'content %d' % i) for i in range(200)))
+        serial = Collation(self.root).files
+        self.assertEqual(len(serial), 200)
+        self.assertEqual(Collation(self.root, workers=4).files, serial)
+
+    def test_runtime_hashcache(self):
+        self.construct({'one': '1'})
+        os.utime(os.path.join(self.root, 'one'), (1000000000, 1000000000))
+        runtime = Runtime(stream=StringIO(), path=self.root)
+        collation = Collation(self.root, runtime)
+        self.assertIs(collation.cache, runtime.hashcache)
+        self.assertTrue(os.path.exists(os.path.join(self.root, '.bake', 'hashes')))
+
+    def test_state_not_collated(self):
+        self.construct({'one': '1'})
+        runtime = Runtime(stream=StringIO(), path=self.root)
+        original = Collation(self.root, runtime)
+        runtime.state.set('task', {'fingerprint': '0' * 40})
+
+        collation = Collation(self.root, runtime)
+        self.assertEqual(collation.files.keys(), [os.path.join(self.root, 'one')])
+        self.assertEqual(collation.prune(original).files, {})
+
+    def test_exclusion(self):
+        self.construct({'a/one': '1', '.git/config': '2', 'b/node_modules/c/three': '3'})
+        collation = Collation(self.root, exclude=ignore_directories('.git', 'node_modules'))
+        self.assertEqual(sorted(collation.directories), [self.root] +
+            [os.path.join(self.root, name) for name in ('a', 'b')])
+        self.assertEqual(collation.files.keys(), [os.path.join(self.root, 'a/one')])
+
+    def test_prune(self):
+        self.construct({'a/one': '1', 'a/b/two': '2', 'three': '3'})
+        original = Collation(self.root)
+
+        self.construct({'a/one': 'changed', 'ab/four': '4', 'c/d/five': '5'}, ['e'])
+        collation = Collation(self.root).prune(original)
+
+        join = lambda *names: [os.path.join(self.root, name) for name in names]
+        self.assertEqual(sorted(collation.files.keys()), join('a/one', 'ab/four', 'c/d/five'))
+        self.assertEqual(sorted(collation.directories), join('ab', 'c', 'c/d'))
+
+    def test_parallel_tar(self):
+        self.construct({'a/one': '1' * 3000000, 'a/b/two': '2', 'three': '3'}, ['empty'])
+        collation = Collation(self.root)
+
+        for compression in ('gz', 'bz2'):
+            filename = os.path.join(self.root, 'archive.tar.' + compression)
+            collation.tar(filename, compression=compression, workers=4)
+
+            archive = tarfile.open(filename)
+            try:
+                names = sorted(archive.getnames())
+                content = archive.extractfile(self.root.lstrip('/') + '/a/one').read()
+            finally:
+                archive.close()
+                os.remove(filename)
+
+            self.assertEqual(names, [self.root.lstrip('/') + name
+                for name in ('/a/b/two', '/a/one', '/empty', '/three')])
+            self.assertEqual(content, '1' * 3000000)
@@ -0,0 +1,191 @@
+import os
+import shutil
+import subprocess
+from StringIO import StringIO
+from tempfile import mkdtemp
+
+from unittest2 import TestCase
+from bake.exceptions import TaskFailed
+from bake.lib.git import BatchSession, GitSync, Repository, _sessions
+from bake.runtime import Runtime
+from bake.lib.gitreader import ObjectReader, UnsupportedError
+
+def git(root, *tokens):
+    return subprocess.check_output(['git', '-c', 'user.name=bake', '-c', 'user.email=bake@localhost']
+        + list(tokens), cwd=root).strip()
+
+class TestObjectReader(TestCase):
+    def setUp(self):
+        self.root = mkdtemp()
+        git(self.root, 'init', '-q')
+        git(self.root, 'checkout', '-q', '-b', 'master')
+        os.mkdir(os.path.join(self.root, 'docs'))
+
+        self.contents = []
+        for i in range(5):
+            content = ''.join('line %d\n' % j for j in range(2000)) + 'revision %d\n' % i
+            self.contents.append(content)
+            with open(os.path.join(self.root, 'docs', 'readme'), 'w') as openfile:
+                openfile.write(content)
+            git(self.root, 'add', '.')
+            git(self.root, 'commit', '-q', '-m', 'revision %d' % i)
+            git(self.root, 'tag', '-a', 'v%d' % i, '-m', 'version %d' % i)
+
+        self.reader = ObjectReader(os.path.join(self.root, '.git'))
+
+    def tearDown(self):
+        self.reader.close()
+        shutil.rmtree(self.root)
+
+    def assertMatchesGit(self):
+        self.assertEqual(self.reader.get_current_branch(), 'master')
+        self.assertEqual(self.reader.resolve('HEAD'), git(self.root, 'rev-parse', 'HEAD'))
+        for i, content in enumerate(self.contents):
+            self.assertEqual(self.reader.get_file('docs/readme', 'v%d' % i), content)
+
+    def test_loose_objects(self):
+        self.assertMatchesGit()
+
+    def test_packed_objects(self):
+        git(self.root, 'gc', '-q', '--aggressive')
+        self.assertFalse(os.path.exists(os.path.join(self.root, '.git', 'refs', 'tags', 'v0')))
+        self.assertMatchesGit()
+
+    def test_unsupported_queries(self):
+        self.assertRaises(UnsupportedError, self.reader.resolve, 'HEAD~1')
+        self.assertRaises(UnsupportedError, self.reader.get_file, 'missing')
+
+        git(self.root, 'checkout', '-q', 'v1')
+        self.assertEqual(self.reader.get_current_branch(), 'HEAD')
+
+    def test_repository_fallback(self):
+        repository = Repository(self.root)
+        try:
+            self.assertEqual(repository.get_file('docs/readme', 'v1'), self.contents[1])
+            self.assertIsNone(repository.batch.process)
+
+            self.assertEqual(repository.get_file('docs/readme', 'HEAD~1'), self.contents[3])
+            self.assertIsNotNone(repository.batch.process)
+            self.assertEqual(repository.get_current_hash(), git(self.root, 'rev-parse', 'HEAD'))
+            self.assertTrue(repository.is_on_master())
+        finally:
+            repository.close()
+
+class TestBatchSession(TestCase):
+    def setUp(self):
+        self.root = mkdtemp()
+        git(self.root, 'init', '-q')
+        os.mkdir(os.path.join(self.root, 'docs'))
+        for filename, content in (('one', 'first\n'), ('docs/two', 'second\n')):
+            with open(os.path.join(self.root, filename), 'w') as openfile:
+                openfile.write(content)
+        git(self.root, 'add', '.')
+        git(self.root, 'commit', '-q', '-m', 'initial')
+        self.repository = Repository(self.root, inprocess=False)
+
+    def tearDown(self):
+        self.repository.close()
+        shutil.rmtree(self.root)
+
+    def test_queries(self):
+        session = BatchSession(self.repository)
+        try:
+            hash, type, size, content = session.query('HEAD:one')
+            self.assertEqual((type, size, content), ('blob', 6, 'first\n'))
+            self.assertEqual(hash, git(self.root, 'rev-parse', 'HEAD:one'))
+
+            pid = session.process.pid
+            self.assertEqual(session.query('HEAD:docs/two')[3], 'second\n')
+            self.assertIsNone(session.query('HEAD:missing'))
+            self.assertEqual(session.query('HEAD')[1], 'commit')
+            self.assertEqual(session.process.pid, pid)
+        finally:
+            session.close()
+        self.assertIsNone(session.process)
+
+        session = BatchSession(self.repository, True)
+        try:
+            self.assertEqual(session.query('HEAD:one')[1:], ('blob', 6, None))
+        finally:
+            session.close()
+
+    def test_get_files(self):
+        files = self.repository.get_files(['one', 'docs/two'])
+        self.assertEqual(files, {'one': 'first\n', 'docs/two': 'second\n'})
+        self.assertRaises(RuntimeError, self.repository.get_files, ['missing'])
+        self.assertRaises(RuntimeError, self.repository.get_file, 'docs')
+
+    def test_cleanup_on_shutdown(self):
+        runtime = Runtime(stream=StringIO())
+        for i in range(3):
+            repository = Repository(self.root, runtime, inprocess=False)
+        self.assertEqual(runtime.cleanups, [])
+
+        repository.get_file('one')
+        self.assertEqual(runtime.cleanups, [repository.batch.close])
+        repository.close()
+        self.assertEqual(runtime.cleanups, [])
+
+        repository.get_file('one')
+        process = repository.batch.process
+        self.assertIsNone(process.poll())
+
+        runtime.shutdown()
+        self.assertIsNone(repository.batch.process)
+        self.assertIsNotNone(process.poll())
+
+    def test_cleanup_at_exit(self):
+        self.repository.get_file('one')
+        self.assertIn(self.repository.batch, _sessions)
+        self.repository.close()
+        self.assertNotIn(self.repository.batch, _sessions)
+
+class TestGitSync(TestCase):
+    def setUp(self):
+        self.root = mkdtemp()
+        self.origin = os.path.join(self.root, 'origin.git')
+        self.work = os.path.join(self.root, 'work')
+        git(self.root, 'init', '-q', '--bare', self.origin)
+        git(self.root, 'init', '-q', self.work)
+        git(self.work, 'checkout', '-q', '-b', 'master')
+        git(self.work, 'remote', 'add', 'origin', self.origin)
+        self.commit('first')
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def commit(self, content):
+        with open(os.path.join(self.work, 'readme'), 'w') as openfile:
+            openfile.write(content)
+        git(self.work, 'add', 'readme')
+        git(self.work, 'commit', '-q', '-m', content)
+        git(self.work, 'push', '-q', 'origin', 'master')
+        return git(self.work, 'rev-parse', 'HEAD')
+
+    def sync(self, *repositories):
+        runtime = Runtime(stream=StringIO())
+        task = GitSync(runtime)
+        environment = {'git': {'sync': {'repositories': list(repositories), 'concurrency': 2}}}
+        try:
+            runtime.execute(task, environment)
+            return [(status, name) for name, status, detail in task.results]
+        finally:
+            runtime.shutdown()
+
+    def test_sync(self):
+        a = {'url': self.origin, 'path': os.path.join(self.root, 'a'), 'branch': 'master'}
+        b = {'url': self.origin, 'path': os.path.join(self.root, 'b')}
+        self.assertEqual(self.sync(a, b), [('cloned', a['path']), ('cloned', b['path'])])
+        self.assertEqual(self.sync(a, b), [('current', a['path']), ('current', b['path'])])
+
+        head = self.commit('second')
+        self.assertEqual(self.sync(a, b), [('updated', a['path']), ('updated', b['path'])])
+        self.assertEqual(git(a['path'], 'rev-parse', 'HEAD'), head)
+        with open(os.path.join(b['path'], 'readme')) as openfile:
+            self.assertEqual(openfile.read(), 'second')
+
+    def test_failures(self):
+        a = {'url': self.origin, 'path': os.path.join(self.root, 'a'), 'branch': 'master'}
+        missing = {'url': os.path.join(self.root, 'missing.git'), 'path': os.path.join(self.root, 'c')}
+        self.assertRaises(TaskFailed, self.sync, a, missing)
+        self.assertTrue(os.path.exists(os.path.join(a['path'], 'readme')))
@@ -0,0 +1,56 @@
+import os
+import shutil
+from StringIO import StringIO
+from tempfile import mkdtemp
+
+from unittest2 import TestCase
+from bake.logsink import LogSink
+from bake.runtime import Runtime
+
+class TestLogSink(TestCase):
+    def setUp(self):
+        self.root = mkdtemp()
+        self.filename = os.path.join(self.root, 'bake.log')
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def read(self, filename=None):
+        with open(filename or self.filename) as openfile:
+            return [line.split(' ', 1)[1] for line in openfile]
+
+    def test_levels(self):
+        log = LogSink(self.filename, 'info')
+        runtime = Runtime(stream=StringIO(), log=log, quiet=True)
+        runtime.report('reported [!G]message[!]')
+        runtime.info('verbose message')
+        runtime.context.append('task')
+        runtime.error('failure')
+        log.close()
+
+        self.assertEqual(self.read(), ['INFO  reported message\n', 'ERROR [task] failure\n'])
+        self.assertEqual(runtime.stream.getvalue(), '[task] failure\n')
+
+    def test_rotation(self):
+        log = LogSink(self.filename, 'debug', maxsize=1000, backups=2)
+        for i in range(100):
+            log.write('debug', 'message %02d' % i)
+        log.close()
+
+        self.assertFalse(os.path.exists(self.filename + '.3'))
+        lines = self.read(self.filename + '.2') + self.read(self.filename + '.1') + self.read()
+        self.assertEqual(lines[-1], 'DEBUG message 99\n')
+        self.assertEqual(lines, ['DEBUG message %02d\n' % i for i in range(100 - len(lines), 100)])
+        for filename in os.listdir(self.root):
+            self.assertLessEqual(os.path.getsize(os.path.join(self.root, filename)), 1000)
+
+    def test_failed_rotation(self):
+        # a backup which cannot be replaced makes rotation fail
+        os.makedirs(os.path.join(self.root, 'bake.log.1', 'occupied'))
+        log = LogSink(self.filename, 'debug', maxsize=100, backups=1, queuesize=10)
+        for i in range(50):
+            log.write('debug', 'message %02d' % i)
+        log.close()
+
+        lines = self.read()
+        self.assertEqual(lines, ['DEBUG message %02d\n' % i for i in range(50)])
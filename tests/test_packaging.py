@@ -0,0 +1,31 @@
+import os
+import shutil
+from tempfile import mkdtemp
+
+from unittest2 import TestCase
+from bake.packaging import collate_data_files, enumerate_packages
+
+class TestPackaging(TestCase):
+    def setUp(self):
+        self.curdir = os.getcwd()
+        self.root = mkdtemp()
+        os.chdir(self.root)
+
+        os.makedirs('pkg/sub')
+        for filename in ('pkg/__init__.py', 'pkg/sub/__init__.py', 'pkg/sub/data.txt'):
+            open(filename, 'w').close()
+
+        # neither a loop nor a link elsewhere is followed, as with os.walk
+        os.symlink(os.path.join(self.root, 'pkg'), 'pkg/sub/loop')
+        os.symlink(os.path.join(self.root, 'pkg', 'sub'), 'pkg/linked')
+
+    def tearDown(self):
+        os.chdir(self.curdir)
+        shutil.rmtree(self.root)
+
+    def test_enumerate_packages(self):
+        self.assertEqual(sorted(enumerate_packages('pkg')), ['pkg', 'pkg.sub'])
+
+    def test_collate_data_files(self):
+        self.assertEqual(collate_data_files('pkg', '.txt'),
+            [('pkg/sub', ['pkg/sub/data.txt'])])
@@ -0,0 +1,147 @@
+import os
+import shutil
+from StringIO import StringIO
+from tempfile import mkdtemp, mkstemp
+from time import sleep, time
+
+from unittest2 import TestCase
+from bake.logsink import LogSink
+from bake.process import Process, ProcessFailure, ProcessMonitor
+from bake.runtime import Runtime
+
+class TestProcessMonitor(TestCase):
+    def test_concurrency(self):
+        processes = [Process(['sleep', '0.3']) for i in range(4)]
+        ProcessMonitor(2).run(processes)
+
+        for process in processes:
+            self.assertEqual(process.returncode, 0)
+        for i, process in enumerate(processes[2:]):
+            self.assertGreaterEqual(process.started,
+                min(earlier.finished for earlier in processes[:i + 2]))
+
+    def test_reaping_any_process(self):
+        # without pipes, a short process must free its slot before a long one
+        processes = [Process(['sleep', duration], passthrough=True)
+            for duration in ('1', '0.1', '0.1')]
+        started = time()
+        ProcessMonitor(2).run(processes)
+        self.assertLess(processes[2].finished - started, 0.8)
+
+    def test_timeout_escalation(self):
+        process = Process(['sh', '-c', 'trap "" TERM; while true; do sleep 0.1; done'])
+        started = time()
+        ProcessMonitor(timeout=0.2, grace=0.3).run([process])
+
+        self.assertTrue(process.timedout)
+        self.assertEqual(process.returncode, -9)
+        self.assertLess(time() - started, 3)
+
+    def test_exited_with_descendant(self):
+        # a descendant holding the pipes is not waited on past the deadline
+        process = Process(['sh', '-c', 'sleep 3 & echo started'])
+        started = time()
+        ProcessMonitor(timeout=0.3).run([process])
+
+        self.assertEqual((process.returncode, process.timedout), (0, False))
+        self.assertEqual(process.stdout, 'started\n')
+        self.assertLess(time() - started, 2)
+
+    def test_limit(self):
+        cmdline = ['sh', '-c', 'printf abcdefghij; printf 0123456789 >&2']
+        process = Process(cmdline, limit=4)
+        ProcessMonitor().run([process])
+        self.assertEqual((process.stdout, process.stderr), ('ghij', '6789'))
+        self.assertEqual(process.received, 20)
+
+        process = Process(cmdline, limit=0)
+        ProcessMonitor().run([process])
+        self.assertEqual((process.stdout, process.stderr), ('', ''))
+
+class TestRuntimeShellMany(TestCase):
+    def test_shell_many(self):
+        runtime = Runtime(stream=StringIO())
+        processes = runtime.shell_many([['echo', 'one'], ['echo', 'two']], concurrency=1)
+        self.assertEqual([process.stdout for process in processes], ['one\n', 'two\n'])
+
+        processes = runtime.shell_many([['true'], ['false']], passive=True)
+        self.assertEqual([process.returncode for process in processes], [0, 1])
+        self.assertRaises(ProcessFailure, runtime.shell_many, [['true'], ['false']])
+
+class FlushRecordingStream(StringIO):
+    flushed = ''
+
+    def flush(self):
+        self.flushed = self.getvalue()
+
+class TestRuntimeShell(TestCase):
+    def test_flushed_before_passthrough(self):
+        stream = FlushRecordingStream()
+        runtime = Runtime(stream=stream, verbose=True, flush_interval=60)
+        runtime.report('header')
+
+        runtime.shell(['true'])
+        self.assertIn('shell: true', stream.flushed)
+
+        runtime.info('before')
+        runtime.shell_many([['true']], passthrough=True)
+        self.assertIn('before', stream.flushed)
+
+    def test_flushed_when_idle(self):
+        stream = FlushRecordingStream()
+        runtime = Runtime(stream=stream, flush_interval=0.2)
+        runtime.report('first')
+        runtime.report('second')
+        self.assertNotIn('second', stream.flushed)
+        sleep(0.5)
+        self.assertIn('second', stream.flushed)
+
+class TestProcessOutput(TestCase):
+    def setUp(self):
+        self.root = mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_callback(self):
+        lines = []
+        process = Process(['sh', '-c', 'printf "one\\r\\ntwo\\nthr"; printf "ee"; echo err >&2'],
+            callback=lambda name, line: lines.append((name, line)))
+        ProcessMonitor().run([process])
+        self.assertEqual(sorted(lines), [('stderr', 'err'), ('stdout', 'one'),
+            ('stdout', 'three'), ('stdout', 'two')])
+        self.assertEqual(process.stdout, 'one\ntwo\nthree')
+
+    def test_tee(self):
+        filename = os.path.join(self.root, 'tee')
+        for i in range(2):
+            ProcessMonitor().run([Process(['echo', 'line'], tee=filename)])
+        with open(filename) as openfile:
+            self.assertEqual(openfile.read(), 'line\nline\n')
+
+        tee = StringIO()
+        ProcessMonitor().run([Process(['echo', 'line'], tee=tee)])
+        self.assertEqual(tee.getvalue(), 'line\n')
+
+    def test_tail_and_failure(self):
+        process = Process(['sh', '-c', 'seq 1 10; exit 3'], tail=2)
+        ProcessMonitor().run([process])
+        self.assertEqual(list(process.tail), ['9', '10'])
+
+        failure = ProcessFailure(process.returncode, process)
+        self.assertEqual(str(failure),
+            "'sh -c seq 1 10; exit 3' returned 3; last output:\n9\n10")
+        self.assertEqual(str(ProcessFailure('message')), 'message')
+
+class TestRuntimeOutput(TestCase):
+    def test_streamed_output_recorded(self):
+        filename = mkstemp()[1]
+        try:
+            log = LogSink(filename, 'debug')
+            runtime = Runtime(stream=StringIO(), verbose=True, jobs=2, log=log)
+            runtime.shell(['echo', 'streamed'])
+            log.close()
+            with open(filename) as openfile:
+                self.assertIn('streamed', openfile.read())
+        finally:
+            os.remove(filename)
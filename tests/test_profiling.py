@@ -0,0 +1,48 @@
+import json
+import os
+import shutil
+from StringIO import StringIO
+from tempfile import mkdtemp
+
+from unittest2 import TestCase
+from bake.profiling import Profiler
+from bake.runtime import Runtime
+from bake.task import Task
+
+class ProfiledTask(Task):
+    name = 'test.profiled'
+
+    def run(self, runtime):
+        runtime.shell(['echo', 'profiled'], passthrough=False)
+
+class TestProfiler(TestCase):
+    def setUp(self):
+        self.root = mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_trace(self):
+        filename = os.path.join(self.root, 'trace.json')
+        profiler = Profiler(filename, os.path.join(self.root, 'pstats'))
+
+        runtime = Runtime(stream=StringIO(), profiler=profiler)
+        runtime.execute('test.profiled')
+        runtime.execute('test.profiled')
+        profiler.save()
+
+        with open(filename) as openfile:
+            events = json.load(openfile)['traceEvents']
+
+        spans = [(event['cat'], event['name']) for event in events if event['ph'] == 'X']
+        self.assertEqual(spans[:5], [('phase', 'environment'), ('phase', 'prepare'),
+            ('process', 'echo'), ('phase', 'run'), ('phase', 'finalize')])
+        self.assertEqual(spans[5], ('task', 'test.profiled'))
+
+        process = events[2]
+        self.assertEqual(process['args']['received'], len('profiled\n'))
+        self.assertEqual(process['args']['returncode'], 0)
+        self.assertTrue(all(event['dur'] >= 0 for event in events if event['ph'] == 'X'))
+
+        self.assertEqual(sorted(os.listdir(os.path.join(self.root, 'pstats'))),
+            ['test.profiled-2.pstats', 'test.profiled.pstats'])
@@ -0,0 +1,137 @@
+import os
+import shutil
+import sys
+from tempfile import mkdtemp
+from textwrap import dedent
+
+from unittest2 import TestCase
+from bake.registry import ModuleIndex
+
+MODULES = {
+    'plugins/__init__.py': '',
+    'plugins/classes.py': """
+        from bake.task import Task
+
+        class Base(Task):
+            pass
+
+        class Deploy(Base):
+            name = 'deploy'
+    """,
+    'plugins/functions.py': """
+        import bake.task
+        from bake.task import task
+
+        @task()
+        def build(runtime):
+            pass
+
+        @bake.task.task('package.sdist')
+        def sdist(runtime):
+            pass
+
+        @task(name='package.wheel', description='builds a wheel')
+        def wheel(runtime):
+            pass
+    """,
+    'plugins/configured.py': """
+        from bake.task import task
+
+        environment = {'deploy': {'target': 'staging'}}
+
+        @task()
+        def configure(runtime):
+            pass
+    """,
+    'plugins/imported.py': """
+        from bake.task import task
+        from plugins.settings import environment
+
+        @task()
+        def imported(runtime):
+            pass
+    """,
+    'plugins/conditional.py': """
+        from bake.task import task
+
+        try:
+            import json
+        except ImportError:
+            environment, other = {}, {}
+
+        @task()
+        def conditional(runtime):
+            pass
+    """,
+    'plugins/nontasks.py': """
+        import bake.task
+
+        class Helper(object):
+            name = 'helper'
+
+        class Derived(Helper):
+            name = 'derived'
+
+        class Qualified(bake.task.Task):
+            name = 'qualified'
+    """,
+    'plugins/derived.py': """
+        from plugins.bases import BaseTask
+
+        class Derived(BaseTask):
+            name = 'derived'
+    """,
+    'plugins/dynamic.py': """
+        from bake.task import Task
+
+        for name in ('a', 'b'):
+            type(name, (Task,), {'name': name})
+    """,
+}
+
+class TestModuleIndex(TestCase):
+    def setUp(self):
+        self.root = mkdtemp()
+        for filename, content in MODULES.iteritems():
+            filename = os.path.join(self.root, 'source', filename)
+            if not os.path.exists(os.path.dirname(filename)):
+                os.makedirs(os.path.dirname(filename))
+            with open(filename, 'w') as openfile:
+                openfile.write(dedent(content))
+        sys.path.insert(0, os.path.join(self.root, 'source'))
+
+    def tearDown(self):
+        sys.path.remove(os.path.join(self.root, 'source'))
+        shutil.rmtree(self.root)
+
+    def test_scanning(self):
+        index = ModuleIndex(os.path.join(self.root, 'cache'))
+        self.assertEqual(index.scan('plugins.classes'), ['deploy'])
+        self.assertEqual(index.scan('plugins.functions'),
+            ['build', 'package.sdist', 'package.wheel'])
+        self.assertIsNone(index.scan('plugins.configured'))
+        self.assertIsNone(index.scan('plugins.dynamic'))
+        self.assertIsNone(index.scan('plugins.imported'))
+        self.assertIsNone(index.scan('plugins.conditional'))
+        self.assertEqual(index.scan('plugins.nontasks'), ['qualified'])
+        self.assertIsNone(index.scan('plugins.derived'))
+        self.assertIsNone(index.scan('plugins.missing'))
+        self.assertIsNone(index.scan('plugins.classes:Deploy'))
+        self.assertNotIn('plugins', sys.modules)
+
+    def test_persistence(self):
+        filename = os.path.join(self.root, 'source', 'plugins', 'classes.py')
+        os.utime(filename, (1000000000, 1000000000))
+
+        index = ModuleIndex(os.path.join(self.root, 'cache'))
+        self.assertEqual(index.scan('plugins.classes'), ['deploy'])
+        index.save()
+
+        # the cached entry stands as long as the source appears unchanged
+        with open(filename, 'w') as openfile:
+            openfile.write(dedent(MODULES['plugins/classes.py']).replace('deploy', 'depl0y'))
+        os.utime(filename, (1000000000, 1000000000))
+        self.assertEqual(ModuleIndex(index.cachedir).scan('plugins.classes'), ['deploy'])
+
+        os.utime(filename, (1000000010, 1000000010))
+        self.assertEqual(ModuleIndex(index.cachedir).scan('plugins.classes'), ['depl0y'])
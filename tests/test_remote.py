@@ -0,0 +1,164 @@
+import os
+import shutil
+import subprocess
+import sys
+import threading
+from StringIO import StringIO
+from tempfile import mkdtemp, mkstemp
+
+from unittest2 import TestCase
+from bake.logsink import LogSink
+from bake.remote import RemoteWorker, WorkerServer, parse_address
+from bake.runtime import Runtime
+from bake.task import Tasks
+
+EXECUTABLE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    'bin', 'bake')
+
+MODULE = '''
+import os
+import time
+from bake.task import *
+
+class RemoteTask(Task):
+    def run(self, runtime, environment):
+        time.sleep(0.3)
+        with open(os.path.join(environment.find('root'), self.name), 'w') as openfile:
+            openfile.write('%d %s' % (os.getpid(), environment.find('remote.value')))
+        runtime.report('recorded %s' % self.name)
+
+class First(RemoteTask):
+    name = 'remote-first'
+
+class Second(RemoteTask):
+    name = 'remote-second'
+
+class Third(RemoteTask):
+    name = 'remote-third'
+    requires = ['remote-first', 'remote-second']
+
+class Failing(Task):
+    name = 'remote-failing'
+
+    def run(self, runtime):
+        raise TaskError('failing remotely')
+'''
+
+class TestRemoteWorkers(TestCase):
+    def setUp(self):
+        self.root = mkdtemp()
+        with open(os.path.join(self.root, 'remotetasks.py'), 'w') as openfile:
+            openfile.write(MODULE)
+
+        environ = dict(os.environ, BAKE_CACHE=os.path.join(self.root, 'cache'),
+            PYTHONPATH=os.pathsep.join(sys.path))
+        self.addresses, self.workers = [], []
+        for i in range(2):
+            worker = subprocess.Popen([sys.executable, EXECUTABLE, '--serve', 'localhost:0',
+                '-N', '-p', self.root, '-P', self.root, '-m', 'remotetasks'],
+                stdout=subprocess.PIPE, env=environ)
+            self.workers.append(worker)
+            self.addresses.append(worker.stdout.readline().strip().rsplit(' ', 1)[-1])
+
+        sys.path.insert(0, self.root)
+        __import__('remotetasks')
+
+    def tearDown(self):
+        for worker in self.workers:
+            worker.kill()
+            worker.wait()
+        sys.path.remove(self.root)
+        shutil.rmtree(self.root)
+
+    def run_tasks(self, *names, **params):
+        stream = StringIO()
+        runtime = Runtime(stream=stream, workers=self.addresses, path=self.root,
+            environment={'root': self.root, 'remote': {'value': 'dispatched'}}, **params)
+        runtime.queue = [Tasks.get(name)(runtime, True) for name in names]
+        return runtime, runtime.run(), stream.getvalue()
+
+    def read(self, name):
+        with open(os.path.join(self.root, name)) as openfile:
+            pid, value = openfile.read().split(' ')
+        return int(pid), value
+
+    def test_parse_address(self):
+        self.assertEqual(parse_address('host:8000'), ('host', 8000))
+        self.assertEqual(parse_address('8000'), ('localhost', 8000))
+        self.assertRaises(ValueError, parse_address, 'host:port')
+
+    def test_dispatch(self):
+        runtime, result, output = self.run_tasks('remote-third')
+        self.assertIsNot(result, False)
+        self.assertEqual([task.name for task in runtime.completed][-1], 'remote-third')
+        self.assertIn('[remote-first] recorded remote-first', output)
+        self.assertIn('[remote-third] task completed', output)
+
+        for name in ('remote-first', 'remote-second', 'remote-third'):
+            pid, value = self.read(name)
+            self.assertEqual(value, 'dispatched')
+            self.assertIn(pid, [worker.pid for worker in self.workers])
+
+        # the independent tasks run concurrently, on different workers
+        self.assertNotEqual(self.read('remote-first')[0], self.read('remote-second')[0])
+
+    def test_recorded(self):
+        filename = mkstemp()[1]
+        try:
+            log = LogSink(filename)
+            self.run_tasks('remote-first', log=log)
+            log.close()
+            with open(filename) as openfile:
+                self.assertIn('[remote-first] recorded remote-first', openfile.read())
+        finally:
+            os.remove(filename)
+
+    def test_failure(self):
+        runtime, result, output = self.run_tasks('remote-failing')
+        self.assertIs(result, False)
+        self.assertIn('failing remotely', output)
+        self.assertIn('task failed', output)
+
+class Coordinator(object):
+    def __init__(self, token=None):
+        self.runtime = Runtime(stream=StringIO(), token=token)
+
+class TestWorkerServer(TestCase):
+    def serve(self, address, token=None):
+        server = WorkerServer(Runtime(stream=StringIO(), token=token), address)
+        host, port = server.listen()
+        thread = threading.Thread(target=server.serve)
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(self.stop, server, thread)
+        return '%s:%d' % (host, port)
+
+    def stop(self, server, thread):
+        server.close()
+        thread.join(5)
+        self.assertFalse(thread.is_alive())
+
+    def test_loopback_only_without_token(self):
+        server = WorkerServer(Runtime(stream=StringIO()), '0.0.0.0:0')
+        self.assertRaises(ValueError, server.listen)
+
+        address = self.serve('0.0.0.0:0', 'secret')
+        self.assertTrue(address.startswith('0.0.0.0:'))
+
+    def test_token(self):
+        address = self.serve('localhost:0', 'secret')
+        for token in (None, 'wrong'):
+            self.assertRaises(EnvironmentError, RemoteWorker, Coordinator(token),
+                address, None, None)
+
+        worker = RemoteWorker(Coordinator('secret'), address, None, None)
+        worker.close()
+
+    def test_flags_restored(self):
+        runtime = Runtime(stream=StringIO(), verbose=False, timing=True)
+        server, writer = WorkerServer(runtime, 'localhost:0'), StringIO()
+        server._execute(writer, {'id': 1, 'task': 'remote.Missing', 'name': 'remote-missing',
+            'flags': {'verbose': True}})
+
+        self.assertIn('"status": "failed"', writer.getvalue())
+        self.assertEqual((runtime.verbose, runtime.timing), (False, True))
@@ -0,0 +1,149 @@
+import os
+import shutil
+import threading
+from StringIO import StringIO
+from tempfile import mkdtemp
+
+from unittest2 import TestCase
+from bake.exceptions import TaskFailed
+from bake.runtime import ENV_BAKEFILE, Runtime
+from bake.task import Task
+
+class TestBakefileDiscovery(TestCase):
+    def setUp(self):
+        self.root = mkdtemp()
+        for directory in ('outer/repo/.git', 'outer/repo/a/b'):
+            os.makedirs(os.path.join(self.root, directory))
+        self.touch('outer/bakefile.py')
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def age(self):
+        for directory, subdirectories, filenames in os.walk(self.root):
+            os.utime(directory, (1000000000, 1000000000))
+
+    def find(self, directory):
+        runtime = Runtime(stream=StringIO(), path=os.path.join(self.root, directory),
+            cachedir=os.path.join(self.root, 'cache'))
+        return runtime._find_bakefile()
+
+    def touch(self, filename):
+        open(os.path.join(self.root, filename), 'w').close()
+
+    def test_search_stops_at_repository_root(self):
+        self.assertIsNone(self.find('outer/repo/a/b'))
+        self.assertEqual(self.find('outer'), os.path.join(self.root, 'outer/bakefile.py'))
+
+    def test_cached_discovery(self):
+        self.touch('outer/repo/bakefile')
+        self.age()
+
+        expected = os.path.join(self.root, 'outer/repo/bakefile')
+        self.assertEqual(self.find('outer/repo/a/b'), expected)
+        self.assertTrue(os.path.exists(os.path.join(self.root, 'cache', 'bakefiles')))
+        self.assertEqual(self.find('outer/repo/a/b'), expected)
+
+        # adding a bakefile modifies a searched directory
+        self.touch('outer/repo/a/bakefile.py')
+        self.assertEqual(self.find('outer/repo/a/b'),
+            os.path.join(self.root, 'outer/repo/a/bakefile.py'))
+
+    def test_pinned_bakefile(self):
+        os.environ[ENV_BAKEFILE] = os.path.join(self.root, 'pinned.py')
+        try:
+            self.assertEqual(self.find('outer'), os.environ[ENV_BAKEFILE])
+        finally:
+            del os.environ[ENV_BAKEFILE]
+
+class MovingTask(Task):
+    name = 'test.moving'
+
+    def run(self, runtime):
+        runtime.started.set()
+        runtime.chdir('sub')
+        runtime.moved.set()
+        runtime.proceed.wait(5)
+        runtime.paths.append(os.getcwd())
+
+class RecordingTask(Task):
+    name = 'test.recording'
+
+    def run(self, runtime):
+        runtime.paths.append(os.getcwd())
+
+class WaitingTask(Task):
+    name = 'test.waiting'
+
+    def run(self, runtime):
+        runtime.waiting.set()
+        runtime.proceed.wait(5)
+        runtime.paths.append(os.getcwd())
+
+class TestConcurrentPaths(TestCase):
+    def setUp(self):
+        self.curdir = os.getcwd()
+        self.root = os.path.realpath(mkdtemp())
+        os.makedirs(os.path.join(self.root, 'sub'))
+        os.chdir(self.root)
+
+        self.runtime = Runtime(stream=StringIO(), path=self.root)
+        for name in ('moved', 'proceed', 'started', 'waiting'):
+            setattr(self.runtime, name, threading.Event())
+        self.runtime.paths = []
+        self.threads = []
+
+    def tearDown(self):
+        self.runtime.proceed.set()
+        for thread in self.threads:
+            thread.join()
+        os.chdir(self.curdir)
+        shutil.rmtree(self.root)
+
+    def execute(self, task, independent=False):
+        thread = threading.Thread(target=self.runtime.execute,
+            args=(task(self.runtime, independent),))
+        thread.start()
+        self.threads.append(thread)
+        return thread
+
+    def test_path_restored_alone(self):
+        runtime = self.runtime
+        moving = self.execute(MovingTask, True)
+        runtime.moved.wait(5)
+
+        # the independent task must restore the path, and the dependency must
+        # not run in a directory another task has changed to, so both wait
+        self.execute(RecordingTask, True)
+        self.execute(RecordingTask).join(0.3)
+        self.assertEqual(runtime.paths, [])
+
+        runtime.proceed.set()
+        for thread in self.threads:
+            thread.join()
+        self.assertEqual(runtime.paths[0], os.path.join(self.root, 'sub'))
+        self.assertEqual(len(runtime.paths), 3)
+        self.assertIn(self.root, runtime.paths[1:])
+
+    def test_chdir_waits_for_others(self):
+        runtime = self.runtime
+        self.execute(WaitingTask)
+        runtime.waiting.wait(5)
+
+        self.execute(MovingTask)
+        runtime.started.wait(5)
+        self.assertFalse(runtime.moved.wait(0.3))
+
+        runtime.proceed.set()
+        for thread in self.threads:
+            thread.join()
+        self.assertEqual(runtime.paths, [self.root, os.path.join(self.root, 'sub')])
+
+    def test_failed_restoration(self):
+        runtime = self.runtime
+        runtime.path = os.path.join(self.root, 'missing')
+        self.assertRaises(TaskFailed, runtime.execute, RecordingTask(runtime, True))
+        self.assertEqual((runtime._pathholders, runtime._pathexclusive), (0, False))
+
+        runtime.execute(RecordingTask(runtime))
+        self.assertEqual(runtime.paths, [self.root])
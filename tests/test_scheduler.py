@@ -0,0 +1,86 @@
+from threading import Lock
+from time import sleep
+
+from unittest2 import TestCase
+from bake.exceptions import TaskFailed
+from bake.scheduler import Scheduler
+
+class MockTask(object):
+    def __init__(self, name, fails=False, delay=0):
+        self.delay = delay
+        self.fails = fails
+        self.name = name
+
+class MockRuntime(object):
+    def __init__(self):
+        self.active = 0
+        self.completed = []
+        self.errors = []
+        self.events = []
+        self.executed = []
+        self.lock = Lock()
+        self.peak = 0
+
+    def emit(self, event, **fields):
+        self.events.append((event, fields['task']))
+
+    def error(self, message):
+        self.errors.append(message)
+
+    def execute(self, task):
+        with self.lock:
+            self.active += 1
+            self.peak = max(self.peak, self.active)
+            self.executed.append(task.name)
+        try:
+            sleep(task.delay)
+            if task.fails:
+                raise TaskFailed()
+        finally:
+            with self.lock:
+                self.active -= 1
+
+def construct_graph():
+    a, b, c, d = [MockTask(name, delay=0.05) for name in 'abcd']
+    graph = {a: set(), b: set(), c: set([a, b]), d: set([c])}
+    return graph, [a, b, c, d]
+
+class TestScheduler(TestCase):
+    def test_serial_execution(self):
+        runtime = MockRuntime()
+        graph, order = construct_graph()
+        self.assertTrue(Scheduler(runtime, graph, order).run())
+        self.assertEqual(runtime.executed, ['a', 'b', 'c', 'd'])
+        self.assertEqual(runtime.completed, order)
+        self.assertEqual(runtime.peak, 1)
+        self.assertEqual(runtime.events, [('task.queued', name) for name in 'abcd'])
+
+    def test_parallel_execution(self):
+        runtime = MockRuntime()
+        graph, order = construct_graph()
+        self.assertTrue(Scheduler(runtime, graph, order, jobs=4).run())
+        self.assertEqual(set(runtime.executed[:2]), set(['a', 'b']))
+        self.assertEqual(runtime.executed[2:], ['c', 'd'])
+        self.assertEqual(runtime.peak, 2)
+
+    def test_failure_stops_scheduling(self):
+        runtime = MockRuntime()
+        a, b, c = MockTask('a', True), MockTask('b'), MockTask('c')
+        graph = {a: set(), b: set(), c: set()}
+
+        scheduler = Scheduler(runtime, graph, [a, b, c])
+        self.assertFalse(scheduler.run())
+        self.assertEqual(runtime.executed, ['a'])
+        self.assertEqual(scheduler.blocked, [b, c])
+
+    def test_keepgoing(self):
+        runtime = MockRuntime()
+        a, b, c = MockTask('a', True), MockTask('b'), MockTask('c')
+        graph = {a: set(), b: set([a]), c: set()}
+
+        scheduler = Scheduler(runtime, graph, [a, b, c], keepgoing=True)
+        self.assertFalse(scheduler.run())
+        self.assertEqual(runtime.executed, ['a', 'c'])
+        self.assertEqual(scheduler.failed, [a])
+        self.assertEqual(scheduler.blocked, [b])
+        self.assertEqual(len(runtime.errors), 1)
@@ -0,0 +1,76 @@
+import os
+import shutil
+from tempfile import mkdtemp
+
+from unittest2 import TestCase
+from bake.state import HashCache
+
+OLD = (1000000000, 1000000000)
+
+class TestHashCache(TestCase):
+    def setUp(self):
+        self.root = mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def write(self, filename, content, times=OLD):
+        filepath = os.path.join(self.root, filename)
+        with open(filepath, 'w') as openfile:
+            openfile.write(content)
+        if times:
+            os.utime(filepath, times)
+        return filepath
+
+    def test_hit(self):
+        cache = HashCache(self.root)
+        filepath = self.write('file', 'content')
+        hexhash = cache.hexhash(filepath)
+        self.assertTrue(cache.dirty)
+
+        # content changed without changing the signature is not noticed
+        self.write('file', 'CONTENT')
+        self.assertEqual(cache.hexhash(filepath), hexhash)
+
+    def test_miss_on_changed_signature(self):
+        cache = HashCache(self.root)
+        filepath = self.write('file', 'content')
+        hexhash = cache.hexhash(filepath)
+
+        self.write('file', 'longer content')
+        self.assertNotEqual(cache.hexhash(filepath), hexhash)
+
+        self.write('file', 'CONTENT', (1000000001, 1000000001))
+        self.assertNotEqual(cache.hexhash(filepath), hexhash)
+
+    def test_recently_modified(self):
+        cache = HashCache(self.root)
+        filepath = self.write('file', 'content', None)
+        cache.hexhash(filepath)
+        self.assertEqual(cache.entries, {})
+
+    def test_evict(self):
+        cache = HashCache(self.root)
+        first = self.write('first', 'first')
+        second = self.write('second', 'second')
+        for filepath in (first, second):
+            cache.hexhash(filepath)
+
+        cache.evict(retain=[first])
+        self.assertEqual(sorted(cache.entries), [first])
+
+        os.remove(first)
+        cache.evict()
+        self.assertEqual(cache.entries, {})
+
+    def test_persistence(self):
+        cache = HashCache(self.root)
+        filepath = self.write('file', 'content')
+        hexhash = cache.hexhash(filepath)
+        cache.save()
+        self.assertFalse(cache.dirty)
+
+        self.write('file', 'CONTENT')
+        cache = HashCache(self.root)
+        self.assertEqual(cache.hexhash(filepath), hexhash)
+        self.assertFalse(cache.dirty)
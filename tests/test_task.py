@@ -0,0 +1,155 @@
+import os
+import shutil
+import subprocess
+import sys
+from StringIO import StringIO
+from tempfile import mkdtemp
+
+from scheme import Sequence, Text
+from unittest2 import TestCase
+from bake.runtime import Runtime
+from bake.state import StateStore
+from bake.task import Task
+
+class ResolvingTask(Task):
+    name = 'test.resolving'
+    parameters = {
+        'greeting': Text(default='hello'),
+        'name': Text(),
+    }
+
+    def run(self, runtime):
+        runtime.report('%s %s' % (self['greeting'], self['name']))
+        self['name'] = 'modified'
+
+class MutatingTask(Task):
+    name = 'test.mutating'
+    parameters = {
+        'items': Sequence(Text()),
+    }
+
+    def run(self, runtime):
+        items = self['items']
+        items.append('b')
+        runtime.report(repr(items))
+
+class TestParameterResolution(TestCase):
+    def test_resolution_cache(self):
+        stream = StringIO()
+        runtime = Runtime(environment={'name': 'world'}, stream=stream)
+        cache = runtime.resolutions
+
+        for i in range(3):
+            runtime.execute('test.resolving')
+        self.assertEqual((cache.hits, cache.misses), (2, 1))
+        self.assertEqual(stream.getvalue().count('hello world'), 3)
+
+        runtime.environment.set('test.resolving.greeting', 'goodbye')
+        runtime.execute('test.resolving')
+        self.assertEqual((cache.hits, cache.misses), (2, 2))
+        self.assertIn('goodbye world', stream.getvalue())
+
+        runtime.execute('test.resolving', {'name': 'everyone'})
+        self.assertEqual(cache.misses, 3)
+        self.assertIn('goodbye everyone', stream.getvalue())
+
+        # each execution builds a new stack, but with the same content
+        runtime.execute('test.resolving', {'name': 'everyone'})
+        self.assertEqual((cache.hits, cache.misses), (3, 3))
+        runtime.execute('test.resolving', {'name': 'nobody'})
+        self.assertEqual(cache.misses, 4)
+
+    def test_cached_values_are_copied(self):
+        stream = StringIO()
+        runtime = Runtime(environment={'items': ['a']}, stream=stream)
+        for i in range(3):
+            runtime.execute('test.mutating')
+        self.assertEqual(stream.getvalue().count("['a', 'b']"), 3)
+        self.assertEqual(runtime.resolutions.hits, 2)
+
+class BuildingTask(Task):
+    name = 'test.building'
+    inputs = ['src']
+    outputs = ['out.txt']
+    runs = 0
+
+    def run(self, runtime):
+        BuildingTask.runs += 1
+        with open('src/input.txt') as source:
+            with open('out.txt', 'w') as target:
+                target.write(source.read().upper())
+
+class TestFingerprints(TestCase):
+    def setUp(self):
+        self.curdir = os.getcwd()
+        self.root = mkdtemp()
+        os.chdir(self.root)
+        os.mkdir('src')
+        self.write('src/input.txt', 'content')
+
+    def tearDown(self):
+        os.chdir(self.curdir)
+        shutil.rmtree(self.root)
+
+    def build(self, **params):
+        runs = BuildingTask.runs
+        stream = StringIO()
+        Runtime(stream=stream, **params).execute('test.building')
+        return BuildingTask.runs - runs, stream.getvalue()
+
+    def write(self, filename, content):
+        with open(filename, 'w') as openfile:
+            openfile.write(content)
+
+    def test_skipped_when_unchanged(self):
+        self.assertEqual(self.build()[0], 1)
+        runs, output = self.build()
+        self.assertEqual(runs, 0)
+        self.assertIn('task skipped', output)
+
+    def test_rerun_when_changed(self):
+        self.build()
+        self.write('src/input.txt', 'changed')
+        self.assertEqual(self.build()[0], 1)
+        with open('out.txt') as openfile:
+            self.assertEqual(openfile.read(), 'CHANGED')
+
+        self.write('src/added.txt', 'added')
+        self.assertEqual(self.build()[0], 1)
+        self.assertEqual(self.build()[0], 0)
+
+        os.remove('out.txt')
+        self.assertEqual(self.build()[0], 1)
+
+    def test_state_not_hashed(self):
+        BuildingTask.inputs = ['.', '.bake/*']
+        try:
+            # the output is among the inputs once it exists
+            self.build()
+            self.build()
+            self.assertEqual(self.build()[0], 0)
+        finally:
+            BuildingTask.inputs = ['src']
+
+    def test_forced(self):
+        self.build()
+        self.assertEqual(self.build(force=True)[0], 1)
+
+    def test_state_store(self):
+        store = StateStore(self.root)
+        store.set('task', {'inputs': 'abc', 'outputs': None})
+        store.set('other', {'inputs': 'def'})
+        store.remove('other')
+
+        store = StateStore(self.root)
+        self.assertEqual(store.get('task'), {'inputs': 'abc', 'outputs': None})
+        self.assertIsNone(store.get('other'))
+        self.assertTrue(os.path.exists(os.path.join(self.root, '.bake', 'tasks.json')))
+
+class TestLibraries(TestCase):
+    def test_get_by_fullname(self):
+        # in a fresh interpreter, so that the library is not yet imported
+        output = subprocess.check_output([sys.executable, '-c',
+            'from bake.task import Tasks; print Tasks.get("bake.lib.git.GitClone").name'],
+            env=dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path)))
+        self.assertEqual(output.strip(), 'git.clone')
@@ -0,0 +1,72 @@
+import os
+import shutil
+from tempfile import mkdtemp
+from time import time
+
+from unittest2 import TestCase
+from bake.exceptions import CyclicDependencyError
+from bake.util import compile_source, import_source, topological_sort
+
+class TestCompileSource(TestCase):
+    def setUp(self):
+        self.root = mkdtemp()
+        self.cachedir = os.path.join(self.root, 'cache')
+        self.source = os.path.join(self.root, 'bakefile.py')
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def write(self, content, mtime):
+        with open(self.source, 'w') as openfile:
+            openfile.write(content)
+        os.utime(self.source, (mtime, mtime))
+
+    def test_caching(self):
+        mtime = int(time()) - 60
+        self.write('value = 1\n', mtime)
+        self.assertEqual(import_source(self.source, self.cachedir)['value'], 1)
+        self.assertEqual(len(os.listdir(self.cachedir)), 1)
+
+        # an edit which preserves the size and mtime is indistinguishable
+        self.write('value = 3\n', mtime)
+        code = compile_source(self.source, self.cachedir)
+        self.assertEqual(code.co_filename, self.source)
+        self.assertEqual(import_source(self.source, self.cachedir)['value'], 1)
+
+        self.write('value = 2\n', time() - 30)
+        self.assertEqual(import_source(self.source, self.cachedir)['value'], 2)
+
+    def test_recent_sources_not_cached(self):
+        self.write('value = 1\n', time())
+        self.assertEqual(import_source(self.source, self.cachedir)['value'], 1)
+        self.assertFalse(os.path.exists(self.cachedir))
+
+class TestTopologicalSort(TestCase):
+    def test_ordering(self):
+        graph = {'d': set(['b', 'c']), 'c': set(['a']), 'b': set(['a']), 'a': set()}
+        self.assertEqual(topological_sort(graph), ['a', 'b', 'c', 'd'])
+
+    def test_deterministic_ties(self):
+        graph = dict((name, set()) for name in 'zyxwv')
+        self.assertEqual(topological_sort(graph), ['v', 'w', 'x', 'y', 'z'])
+        self.assertEqual(topological_sort(graph, key=lambda n: -ord(n)),
+            ['z', 'y', 'x', 'w', 'v'])
+
+    def test_implicit_nodes(self):
+        self.assertEqual(topological_sort({'b': set(['a'])}), ['a', 'b'])
+
+    def test_input_not_modified(self):
+        graph = {'b': set(['a']), 'a': set()}
+        topological_sort(graph)
+        self.assertEqual(graph, {'b': set(['a']), 'a': set()})
+
+    def test_cycle_detection(self):
+        graph = {'a': set(), 'b': set(['a', 'd']), 'c': set(['b']), 'd': set(['c']),
+            'e': set(['d'])}
+        try:
+            topological_sort(graph)
+        except CyclicDependencyError, exception:
+            self.assertEqual(exception.args[1], ['b', 'c', 'd'])
+            self.assertIn('b, c, d', exception.args[0])
+        else:
+            self.fail()